@@ -0,0 +1,120 @@
+"""
+Measures how many frames per second can be checked before indexing (empty, dark, color block and sharpness)
+using the separate checks, the fused triage and the fused triage on batches of frames.
+
+The frames are generated (gradients, noise, flat colors and dark frames), so no video file is needed.
+
+Usage (from the StoryToolkitAI directory):
+    python -m benchmarks.frame_triage
+    python -m benchmarks.frame_triage --width 1920 --height 1080 --frames 200 --batch-size 16
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from storytoolkitai.core.toolkit_ops.videoanalysis import ClipIndex
+
+
+def make_frames(width, height, count):
+    """
+    Creates a mix of frames that look like the ones we find in videos
+    """
+
+    rng = np.random.default_rng(0)
+
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None].repeat(height, axis=0).repeat(3, axis=2)
+
+    frames = []
+    for frame_n in range(count):
+
+        kind = frame_n % 4
+
+        # a gradient with some noise (a regular frame)
+        if kind == 0:
+            frame = gradient + rng.normal(0, 10, size=(height, width, 1)).astype(np.float32)
+
+        # noise (a sharp frame)
+        elif kind == 1:
+            frame = rng.integers(0, 255, size=(height, width, 3))
+
+        # a flat color (a color block)
+        elif kind == 2:
+            frame = np.full((height, width, 3), rng.integers(0, 255, size=3))
+
+        # a dark frame
+        else:
+            frame = gradient * 0.02
+
+        frames.append(np.clip(frame, 0, 255).astype(np.uint8))
+
+    return frames
+
+
+def run_separate_checks(frames):
+
+    for frame in frames:
+        ClipIndex.is_single_color_block(frame)
+        ClipIndex.is_empty_frame(frame, threshold=2)
+        ClipIndex.is_dark_frame(frame, ire=11)
+        ClipIndex.get_frame_sharpness_laplacian(frame)
+
+
+def run_fused_triage(frames):
+
+    for frame in frames:
+        ClipIndex.is_skippable_frame(ClipIndex.triage_frame(frame), skip_empty=2)
+
+
+def run_batched_triage(frames, batch_size):
+
+    for batch_start in range(0, len(frames), batch_size):
+        for triage in ClipIndex.triage_frames(frames[batch_start:batch_start + batch_size]):
+            ClipIndex.is_skippable_frame(triage, skip_empty=2)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=3840)
+    parser.add_argument('--height', type=int, default=2160)
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=8)
+    args = parser.parse_args()
+
+    frames = make_frames(args.width, args.height, args.frames)
+
+    # make sure the fused triage makes the same decisions as the separate checks
+    mismatches = 0
+    for frame in frames:
+
+        separate_decision = ClipIndex.is_single_color_block(frame) \
+            or ClipIndex.is_empty_frame(frame, threshold=2) \
+            or ClipIndex.is_dark_frame(frame, ire=11)
+
+        if separate_decision != ClipIndex.is_skippable_frame(ClipIndex.triage_frame(frame), skip_empty=2):
+            mismatches += 1
+
+    print('{}x{}, {} frames ({} different decisions)'.format(args.width, args.height, len(frames), mismatches))
+    print('{:>24} {:>12} {:>12}'.format('method', 'frames/sec', 'total (s)'))
+
+    for method_name, method in [
+        ('separate checks', lambda: run_separate_checks(frames)),
+        ('fused triage', lambda: run_fused_triage(frames)),
+        ('fused triage (batched)', lambda: run_batched_triage(frames, args.batch_size)),
+    ]:
+
+        start_time = time.perf_counter()
+        method()
+        total_time = time.perf_counter() - start_time
+
+        print('{:>24} {:>12.1f} {:>12.3f}'.format(method_name, len(frames) / total_time, total_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Measures how many progress updates per second the ProcessingQueue can take
+with a large queue history (for eg. per-frame progress updates while indexing videos).
+
+The queue files are written to a temporary directory, so the user's queue is not touched.
+
+Usage (from the StoryToolkitAI directory):
+    python -m benchmarks.processing_queue_progress
+    python -m benchmarks.processing_queue_progress --history-sizes 1000 10000 --updates 20000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from storytoolkitai.core.toolkit_ops import processing_queue
+from storytoolkitai.core.toolkit_ops.processing_queue import ProcessingQueue
+
+
+class DummyToolkitOps:
+    """
+    The queue only needs the observers from the toolkit ops object for progress updates
+    """
+
+    def notify_observers(self, action):
+        pass
+
+
+def make_queue(history_size):
+    """
+    Creates a queue with a history of finished items and one item that is being processed
+    """
+
+    queue = ProcessingQueue(toolkit_ops_obj=DummyToolkitOps())
+
+    queue.queue_history = [
+        {'queue_id': 'item-{}'.format(i), 'name': 'Item {}'.format(i), 'item_type': 'video',
+         'source_file_path': '/path/to/video_{}.mov'.format(i), 'device': 'cpu', 'tasks': ['index_video'],
+         'status': 'done', 'progress': '100'}
+        for i in range(history_size)
+    ]
+
+    queue.queue_history.append(
+        {'queue_id': 'current', 'name': 'Current', 'item_type': 'video', 'source_file_path': '/path/to/video.mov',
+         'device': 'cpu', 'tasks': ['index_video'], 'status': 'processing', 'progress': '0'}
+    )
+
+    # the history was replaced, so re-index it
+    queue.queue_history = queue.queue_history
+
+    queue.save_queue_to_file()
+
+    return queue
+
+
+def run(history_size, updates, sync_save):
+
+    queue = make_queue(history_size)
+
+    start_time = time.perf_counter()
+
+    for update_n in range(updates):
+
+        queue.update_queue_item(queue_id='current', progress=str(update_n * 100 // updates))
+
+        # this is how the queue used to save on each update
+        if sync_save:
+            queue.save_queue_to_file()
+
+        queue.cancel_if_canceled(queue_id='current')
+
+    update_time = time.perf_counter() - start_time
+
+    # include the time needed to write the last changes
+    queue.flush_queue_to_file()
+    total_time = time.perf_counter() - start_time
+
+    # make sure the changes made it to disk
+    loaded_item = [item for item in queue.load_queue_from_file() if item['queue_id'] == 'current'][0]
+    assert loaded_item['progress'] == str((updates - 1) * 100 // updates)
+
+    return updates / update_time, total_time
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--history-sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--updates', type=int, default=10000)
+    parser.add_argument('--sync-save', action='store_true',
+                        help='also save the whole queue file after each update (the old behavior)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+
+        processing_queue.QUEUE_FILE_PATH = os.path.join(temp_dir, 'queue.json')
+        processing_queue.QUEUE_JOURNAL_FILE_PATH = os.path.join(temp_dir, 'queue.journal.jsonl')
+
+        print('{:>12} {:>10} {:>16} {:>12}'.format('history', 'updates', 'updates/sec', 'total (s)'))
+
+        for history_size in args.history_sizes:
+
+            updates = args.updates if not args.sync_save else min(args.updates, 200)
+
+            updates_per_sec, total_time = run(history_size, updates, args.sync_save)
+
+            print('{:>12} {:>10} {:>16.0f} {:>12.3f}'.format(history_size, updates, updates_per_sec, total_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Compares the approximate nearest neighbour index used by TextSearch to the brute-force cosine similarity search
+on synthetic corpora.
+
+Usage (from the StoryToolkitAI directory):
+    python -m benchmarks.text_search_ann
+    python -m benchmarks.text_search_ann --sizes 10000 100000 --n-probe 4 8 16
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from storytoolkitai.core.toolkit_ops.search import TextSearchANNIndex
+
+
+def make_corpus(corpus_size, dim, n_topics, generator):
+    """
+    Creates a normalized synthetic corpus with embeddings grouped around a number of topics,
+    which is closer to real phrase embeddings than uniform noise
+    """
+
+    topics = torch.randn(n_topics, dim, generator=generator)
+    topic_idx = torch.randint(n_topics, (corpus_size,), generator=generator)
+
+    corpus = topics[topic_idx] + 0.8 * torch.randn(corpus_size, dim, generator=generator)
+
+    return torch.nn.functional.normalize(corpus, p=2, dim=1)
+
+
+def make_queries(corpus, n_queries, generator):
+    """
+    The queries are noisy copies of random corpus embeddings
+    """
+
+    query_rows = torch.randint(len(corpus), (n_queries,), generator=generator)
+    queries = corpus[query_rows] + 0.05 * torch.randn(n_queries, corpus.shape[1], generator=generator)
+
+    return torch.nn.functional.normalize(queries, p=2, dim=1)
+
+
+def run(corpus_size, dim, n_queries, top_k, n_probes, device):
+
+    generator = torch.Generator().manual_seed(0)
+
+    corpus = make_corpus(corpus_size, dim, n_topics=max(10, corpus_size // 1000), generator=generator).to(device)
+    queries = make_queries(corpus, n_queries, generator=generator).to(device)
+
+    # brute force - the same as TextSearch.search_semantic without the index
+    start_time = time.perf_counter()
+    exact_rows = []
+    for query in queries:
+        exact_rows.append(torch.topk(corpus @ query, k=top_k, sorted=True).indices)
+    brute_force_ms = (time.perf_counter() - start_time) * 1000 / n_queries
+
+    start_time = time.perf_counter()
+    ann_index = TextSearchANNIndex.build(corpus)
+    build_s = time.perf_counter() - start_time
+
+    print('\n{} phrases, {} dim, {} clusters (built in {:.2f}s)'
+          .format(corpus_size, dim, ann_index.n_lists, build_s))
+    print('  brute force: {:8.2f} ms/query'.format(brute_force_ms))
+
+    for n_probe in n_probes:
+
+        start_time = time.perf_counter()
+        ann_results = []
+        for query in queries:
+            ann_results.append(
+                ann_index.search(query.unsqueeze(0), corpus, top_k=top_k, n_probe=n_probe)[0][1])
+        ann_ms = (time.perf_counter() - start_time) * 1000 / n_queries
+
+        # recall@k is the share of the exact top_k results that the index also found
+        recall = sum(
+            len(set(exact.tolist()) & set(approx.tolist())) for exact, approx in zip(exact_rows, ann_results)
+        ) / (top_k * n_queries)
+
+        print('  n_probe {:4d}: {:8.2f} ms/query, recall@{} {:.3f}, speedup {:.1f}x'
+              .format(n_probe, ann_ms, top_k, recall, brute_force_ms / ann_ms if ann_ms else 0))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Text search ANN index benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--device', default='cpu')
+    args = parser.parse_args()
+
+    with torch.no_grad():
+        for corpus_size in args.sizes:
+            run(corpus_size=corpus_size, dim=args.dim, n_queries=args.queries, top_k=args.top_k,
+                n_probes=args.n_probe, device=args.device)
+
+
+if __name__ == '__main__':
+    main()
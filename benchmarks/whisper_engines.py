@@ -0,0 +1,152 @@
+"""
+Compares the Whisper engines (openai and ctranslate2) on the same audio file:
+the model loading time, the real-time factor (transcription time / audio duration, lower is better)
+and, if a reference transcript is passed, the word error rate.
+
+The audio is decoded once (16kHz mono) and the same samples are transcribed by each engine,
+so the decoding time is not part of the measurements.
+
+Usage (from the StoryToolkitAI directory):
+    python -m benchmarks.whisper_engines --audio interview.wav --reference interview.txt
+    python -m benchmarks.whisper_engines --audio interview.wav --model-name small --engines ctranslate2 \
+        --ct2-model-path models/whisper-small-ct2-int8 --compute-type int8
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import storytoolkitai.integrations.mots_whisper as whisper
+from storytoolkitai.integrations.mots_faster_whisper import FasterWhisperModel, WHISPER_ENGINES
+from storytoolkitai.core.toolkit_ops.audio_stream import AudioStreamReader
+
+
+def load_audio(audio_file_path):
+    """
+    Decodes the whole audio file to 16kHz mono float32 samples
+    """
+
+    audio_stream = AudioStreamReader(audio_file_path, sample_rate=16_000, chunk_duration=60)
+
+    return np.concatenate([chunk for _, chunk in audio_stream])
+
+
+def normalize_words(text):
+    """
+    Lowercases the text and removes the punctuation, so only the words are compared
+    """
+
+    return re.sub(r"[^\w\s']", ' ', text.lower()).split()
+
+
+def word_error_rate(reference, hypothesis):
+    """
+    The word-level edit distance (substitutions, deletions and insertions) divided by the reference length
+    """
+
+    reference_words = normalize_words(reference)
+    hypothesis_words = normalize_words(hypothesis)
+
+    if not reference_words:
+        return 0.0 if not hypothesis_words else 1.0
+
+    # keep only the previous row of the edit distance matrix
+    previous_row = list(range(len(hypothesis_words) + 1))
+
+    for reference_n, reference_word in enumerate(reference_words, start=1):
+
+        current_row = [reference_n]
+
+        for hypothesis_n, hypothesis_word in enumerate(hypothesis_words, start=1):
+            current_row.append(min(
+                previous_row[hypothesis_n] + 1,
+                current_row[hypothesis_n - 1] + 1,
+                previous_row[hypothesis_n - 1] + (reference_word != hypothesis_word)
+            ))
+
+        previous_row = current_row
+
+    return previous_row[-1] / len(reference_words)
+
+
+def load_model(engine, args):
+
+    if engine == 'ctranslate2':
+        return FasterWhisperModel(args.ct2_model_path or args.model_name, device=args.device,
+                                  compute_type=args.compute_type, cpu_threads=args.cpu_threads)
+
+    return whisper.load_model(args.model_name, device=args.device)
+
+
+def run(engine, audio, args):
+
+    load_start = time.perf_counter()
+    model = load_model(engine, args)
+    load_time = time.perf_counter() - load_start
+
+    decode_options = {'task': 'transcribe'}
+    if args.language:
+        decode_options['language'] = args.language
+
+    transcribe_start = time.perf_counter()
+    result = model.transcribe(audio, verbose=None, word_timestamps=args.word_timestamps, **decode_options)
+    transcribe_time = time.perf_counter() - transcribe_start
+
+    # use the segments, just like the transcription files do
+    text = ' '.join([segment['text'].strip() for segment in result['segments'] if segment['text']])
+
+    return load_time, transcribe_time, len(result['segments']), text
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--audio', required=True, help='the audio (or video) file to transcribe')
+    parser.add_argument('--reference', help='a text file with the correct transcript (to calculate the WER)')
+    parser.add_argument('--engines', nargs='+', default=WHISPER_ENGINES, choices=WHISPER_ENGINES)
+    parser.add_argument('--model-name', default='small')
+    parser.add_argument('--ct2-model-path', help='a converted CTranslate2 model (instead of the model name)')
+    parser.add_argument('--compute-type', default='int8')
+    parser.add_argument('--cpu-threads', type=int, default=0)
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--language', help='skip the language detection')
+    parser.add_argument('--word-timestamps', action='store_true')
+    parser.add_argument('--output-dir', help='save the transcript of each engine in this directory')
+    args = parser.parse_args()
+
+    audio = load_audio(args.audio)
+    audio_duration = len(audio) / 16_000
+
+    reference = None
+    if args.reference:
+        with open(args.reference, 'r', encoding='utf-8') as f:
+            reference = f.read()
+
+    print('Audio: {} ({:.1f}s)'.format(args.audio, audio_duration))
+    print('{:>12} {:>10} {:>16} {:>8} {:>10} {:>8}'.format(
+        'engine', 'load (s)', 'transcribe (s)', 'RTF', 'segments', 'WER'))
+
+    for engine in args.engines:
+
+        load_time, transcribe_time, segment_count, text = run(engine, audio, args)
+
+        wer = '{:.3f}'.format(word_error_rate(reference, text)) if reference is not None else '-'
+
+        print('{:>12} {:>10.2f} {:>16.2f} {:>8.3f} {:>10} {:>8}'.format(
+            engine, load_time, transcribe_time, transcribe_time / audio_duration, segment_count, wer))
+
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+
+            with open(os.path.join(args.output_dir, '{}.txt'.format(engine)), 'w', encoding='utf-8') as f:
+                f.write(text)
+
+
+if __name__ == '__main__':
+    main()
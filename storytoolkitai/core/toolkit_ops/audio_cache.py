@@ -0,0 +1,403 @@
+import hashlib
+import os
+import tempfile
+from threading import Lock, RLock
+
+import numpy as np
+
+from storytoolkitai import USER_DATA_PATH
+from storytoolkitai.core.logger import logger
+from .audio_stream import AudioStreamReader, AudioArrayReader
+
+
+class AudioCache:
+    """
+    This keeps the decoded audio of the source files (16kHz mono float32 samples) in raw files on the disk,
+    so the transcription, the speaker detection and the re-transcriptions of the same source
+    don't need to decode it again.
+
+    The cached audio is memory-mapped, so reading a slice of it doesn't copy the rest of the file in memory.
+
+    The audio is usually cached while it's streamed for something else (see CachingAudioStream),
+    so we never need an extra decoding pass just to fill the cache.
+
+    The cache files are named after the path, the modification time and the size of the source file,
+    so when the source file changes, its old cached audio is no longer used (and it's evicted eventually).
+    When the cache gets larger than max_size, the files that weren't used for the longest time are removed.
+    """
+
+    _instances = {}
+
+    # the sample rate of the cached audio
+    sample_rate = 16_000
+
+    # how much the decoded audio can differ from the duration in the file header
+    # (as a fraction of the duration, but we always allow at least one second)
+    duration_tolerance = 0.01
+
+    def __new__(cls, cache_dir, max_size=None):
+
+        cache_dir = os.path.abspath(cache_dir)
+
+        # only one cache object per cache directory
+        if cache_dir not in cls._instances:
+            cls._instances[cache_dir] = super(AudioCache, cls).__new__(cls)
+
+        return cls._instances[cache_dir]
+
+    def __init__(self, cache_dir, max_size=None):
+        """
+        :param cache_dir: the directory where the decoded audio is stored
+        :param max_size: the maximum size of the cache (bytes), None for no limit
+        """
+
+        # the size limit can change with the settings
+        if max_size is not None or not getattr(self, '_initialized', False):
+            self.max_size = max_size
+
+        # prevent initializing the instance more than once
+        if hasattr(self, '_initialized') and self._initialized:
+            return
+
+        self.cache_dir = os.path.abspath(cache_dir)
+
+        self._lock = RLock()
+
+        # one lock for each source, so the same source is never decoded twice at the same time
+        self._source_locks = {}
+
+        self._initialized = True
+
+    @classmethod
+    def from_settings(cls, stAI=None):
+        """
+        This returns the audio cache from the directory set in the config (if any) or from the default cache directory
+        """
+
+        cache_dir = stAI.get_app_setting(setting_name='audio_cache_dir', default_if_none='') \
+            if stAI is not None else ''
+
+        if not cache_dir:
+            cache_dir = os.path.join(USER_DATA_PATH, 'cache', 'audio')
+
+        max_size_mb = stAI.get_app_setting(setting_name='audio_cache_max_size_mb', default_if_none=5000) \
+            if stAI is not None else 5000
+
+        return cls(cache_dir, max_size=int(max_size_mb) * 1024 * 1024 if max_size_mb else None)
+
+    def get_cache_path(self, source_path):
+        """
+        This returns the path of the cached audio of the source file (even if it wasn't cached yet),
+        or None if the source file doesn't exist
+        """
+
+        source_path = os.path.abspath(source_path)
+
+        try:
+            source_stat = os.stat(source_path)
+        except OSError:
+            return None
+
+        cache_key = '{}|{}|{}|{}'.format(source_path, source_stat.st_mtime_ns, source_stat.st_size, self.sample_rate)
+
+        return os.path.join(self.cache_dir, '{}.f32'.format(hashlib.md5(cache_key.encode('utf-8')).hexdigest()))
+
+    def _get_source_lock(self, cache_path):
+
+        with self._lock:
+
+            if cache_path not in self._source_locks:
+                self._source_locks[cache_path] = Lock()
+
+            return self._source_locks[cache_path]
+
+    def get_audio(self, source_path):
+        """
+        This returns the decoded audio of the source file as a memory-mapped array
+        (it decodes and caches the audio first, if needed)
+
+        :param source_path: the path of the audio or video file
+        :return: a read-only (copy-on-write) float32 array, or None if the audio couldn't be decoded
+        """
+
+        cache_path = self.get_cache_path(source_path)
+
+        if cache_path is None:
+            return None
+
+        with self._get_source_lock(cache_path):
+
+            if not os.path.isfile(cache_path) and not self._decode_to_cache(source_path, cache_path):
+                return None
+
+            return self._read_cache_file(cache_path)
+
+    def get_cached_audio(self, source_path):
+        """
+        This returns the decoded audio of the source file as a memory-mapped array,
+        but only if it's already in the cache (it doesn't decode anything)
+
+        :param source_path: the path of the audio or video file
+        :return: a read-only (copy-on-write) float32 array, or None if the audio isn't cached
+        """
+
+        cache_path = self.get_cache_path(source_path)
+
+        if cache_path is None or not os.path.isfile(cache_path):
+            return None
+
+        return self._read_cache_file(cache_path)
+
+    def _read_cache_file(self, cache_path):
+
+        try:
+            # mark the file as recently used, so it's evicted last
+            os.utime(cache_path)
+
+            # we can't memory-map empty files
+            if os.path.getsize(cache_path) == 0:
+                return np.empty(0, dtype=np.float32)
+
+            # copy-on-write means nothing is copied unless something writes to the array
+            return np.memmap(cache_path, dtype=np.float32, mode='c')
+
+        except OSError:
+            logger.debug('Cannot read cached audio {}.'.format(cache_path), exc_info=True)
+            return None
+
+    def get_caching_stream(self, audio_stream):
+        """
+        This wraps the AudioStreamReader so its audio is cached while it's read (see CachingAudioStream)
+
+        :param audio_stream: the AudioStreamReader
+        :return: the CachingAudioStream, or the audio stream itself if its audio can't be cached
+        """
+
+        if audio_stream.sample_rate != self.sample_rate:
+            return audio_stream
+
+        cache_path = self.get_cache_path(audio_stream.path)
+
+        if cache_path is None:
+            return audio_stream
+
+        return CachingAudioStream(self, audio_stream, cache_path)
+
+    def _decode_to_cache(self, source_path, cache_path):
+        """
+        This decodes the audio of the source file into the cache file
+        """
+
+        audio_stream = AudioStreamReader(source_path, sample_rate=self.sample_rate, chunk_duration=60)
+
+        if audio_stream.backend is None:
+            return False
+
+        try:
+            # the audio is cached while we go through it
+            for _ in self._iter_to_cache(audio_stream, cache_path):
+                pass
+
+        except Exception:
+            logger.warning('Cannot decode the audio of {}.'.format(source_path), exc_info=True)
+            return False
+
+        return os.path.isfile(cache_path)
+
+    def _iter_to_cache(self, audio_stream, cache_path):
+        """
+        This yields the chunks of the audio stream and also writes them to a temporary file,
+        which is moved to the cache path only after the whole audio was read and its duration was checked
+        (so if the reading fails or stops early, nothing ends up in the cache).
+
+        If the audio can't be written to the cache, the chunks are still yielded.
+        """
+
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+
+            # each reader gets its own temporary file, in case the same source is read at the same time
+            temp_file_descriptor, temp_file_path = tempfile.mkstemp(
+                prefix='{}.'.format(os.path.basename(cache_path)), suffix='.tmp', dir=self.cache_dir)
+
+        except OSError:
+            logger.warning('Cannot cache the decoded audio of {}.'.format(audio_stream.path), exc_info=True)
+
+            yield from audio_stream
+            return
+
+        logger.debug('Caching decoded audio of {} to {}.'.format(audio_stream.path, cache_path))
+
+        decoded_samples = 0
+        cache_failed = False
+        reached_end = False
+
+        try:
+            with os.fdopen(temp_file_descriptor, 'wb') as f:
+
+                # the reader raises an error if the decoding fails before the end of the audio
+                for chunk_start, chunk in audio_stream:
+
+                    if not cache_failed:
+                        try:
+                            chunk.tofile(f)
+                            decoded_samples += len(chunk)
+
+                        # for eg. if the disk is full, we continue without caching
+                        except OSError:
+                            logger.warning('Cannot cache the decoded audio of {}.'.format(audio_stream.path),
+                                           exc_info=True)
+                            cache_failed = True
+
+                    yield chunk_start, chunk
+
+                reached_end = True
+
+            if reached_end and not cache_failed:
+                self._publish_cache_file(audio_stream, temp_file_path, decoded_samples, cache_path)
+
+        finally:
+            # the temporary file is only left if it wasn't published
+            if os.path.isfile(temp_file_path):
+                try:
+                    os.remove(temp_file_path)
+                except OSError:
+                    logger.debug('Cannot remove {}.'.format(temp_file_path), exc_info=True)
+
+    def _publish_cache_file(self, audio_stream, temp_file_path, decoded_samples, cache_path):
+        """
+        This moves the temporary file with the decoded audio to the cache path,
+        if its duration matches the duration from the file header
+        """
+
+        # make sure we decoded all the audio that the file header says is there,
+        # otherwise the cut-off audio would be used until the source file changes
+        expected_duration = audio_stream.duration
+        decoded_duration = decoded_samples / self.sample_rate
+
+        if expected_duration and \
+                abs(expected_duration - decoded_duration) > max(1, expected_duration * self.duration_tolerance):
+            logger.warning('Cannot cache the decoded audio: decoded {:.2f} seconds of audio, but {} has {:.2f} seconds.'
+                           .format(decoded_duration, audio_stream.path, expected_duration))
+            return False
+
+        try:
+            os.replace(temp_file_path, cache_path)
+
+        except OSError:
+            logger.warning('Cannot cache the decoded audio of {}.'.format(audio_stream.path), exc_info=True)
+            return False
+
+        self.evict(keep=cache_path)
+
+        return True
+
+    def evict(self, keep=None):
+        """
+        This removes the cached audio files that weren't used for the longest time
+        until the cache fits in max_size
+        :param keep: a cache file that shouldn't be removed
+        """
+
+        if not self.max_size or not os.path.isdir(self.cache_dir):
+            return
+
+        with self._lock:
+
+            cache_files = []
+            for file_name in os.listdir(self.cache_dir):
+
+                if not file_name.endswith('.f32'):
+                    continue
+
+                file_path = os.path.join(self.cache_dir, file_name)
+
+                try:
+                    file_stat = os.stat(file_path)
+                except OSError:
+                    continue
+
+                cache_files.append((file_stat.st_mtime, file_stat.st_size, file_path))
+
+            total_size = sum([file_size for _, file_size, _ in cache_files])
+
+            # remove the least recently used files first
+            for _, file_size, file_path in sorted(cache_files):
+
+                if total_size <= self.max_size:
+                    break
+
+                if keep is not None and os.path.abspath(file_path) == os.path.abspath(keep):
+                    continue
+
+                try:
+                    os.remove(file_path)
+                    total_size -= file_size
+
+                    logger.debug('Removed cached audio {}.'.format(file_path))
+
+                # the file might still be memory-mapped (on Windows)
+                except OSError:
+                    logger.debug('Cannot remove cached audio {}.'.format(file_path))
+
+
+class CachingAudioStream:
+    """
+    This works just like the AudioStreamReader it wraps, but while the audio is read, it's also written to the cache,
+    so the audio is cached during the first complete pass over it, without decoding it separately.
+
+    Once the audio is in the cache, the next passes read it from the cache instead of decoding it again.
+    """
+
+    def __init__(self, audio_cache, audio_stream, cache_path):
+        """
+        :param audio_cache: the AudioCache
+        :param audio_stream: the AudioStreamReader
+        :param cache_path: the cache path of the audio (see AudioCache.get_cache_path)
+        """
+
+        self.audio_cache = audio_cache
+        self.audio_stream = audio_stream
+        self.cache_path = cache_path
+
+    @property
+    def path(self):
+        return self.audio_stream.path
+
+    @property
+    def sample_rate(self):
+        return self.audio_stream.sample_rate
+
+    @property
+    def chunk_duration(self):
+        return self.audio_stream.chunk_duration
+
+    @property
+    def chunk_samples(self):
+        return self.audio_stream.chunk_samples
+
+    @property
+    def backend(self):
+        return self.audio_stream.backend
+
+    @property
+    def duration(self):
+        return self.audio_stream.duration
+
+    def with_chunk_duration(self, chunk_duration):
+        return CachingAudioStream(self.audio_cache, self.audio_stream.with_chunk_duration(chunk_duration),
+                                  self.cache_path)
+
+    def __iter__(self):
+
+        # read the audio from the cache if a previous pass already cached it
+        cached_audio_array = self.audio_cache._read_cache_file(self.cache_path) \
+            if os.path.isfile(self.cache_path) else None
+
+        if cached_audio_array is not None:
+            yield from AudioArrayReader(cached_audio_array, sample_rate=self.sample_rate,
+                                        chunk_duration=self.chunk_duration, path=self.path)
+            return
+
+        yield from self.audio_cache._iter_to_cache(self.audio_stream, self.cache_path)
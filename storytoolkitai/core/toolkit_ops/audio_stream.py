@@ -0,0 +1,430 @@
+import os
+import re
+import subprocess
+
+import numpy as np
+
+from storytoolkitai.core.logger import logger
+
+
+class AudioStreamReader:
+    """
+    This decodes the audio of a file in chunks of mono float32 samples (16kHz by default),
+    so we never need to hold the audio of the whole file in memory.
+
+    The audio is decoded by an FFmpeg process which sends the raw samples through a pipe
+    (FFmpeg also does the downmixing and the resampling), and if FFmpeg can't be used,
+    we read the file in blocks with soundfile and resample them with soxr.
+    """
+
+    def __init__(self, path, sample_rate=16_000, chunk_duration=30):
+        """
+        :param path: the path to the audio or video file
+        :param sample_rate: the sample rate of the decoded audio
+        :param chunk_duration: the duration of each chunk (seconds)
+        """
+
+        self.path = path
+        self.sample_rate = int(sample_rate)
+        self.chunk_duration = chunk_duration
+
+        # the backend that was able to decode the file (ffmpeg or soundfile)
+        self._backend = None
+        self._duration = None
+
+    @property
+    def chunk_samples(self):
+        return max(1, int(self.chunk_duration * self.sample_rate))
+
+    def with_chunk_duration(self, chunk_duration):
+        """
+        This returns a reader for the same audio, but with a different chunk duration
+        """
+
+        reader = AudioStreamReader(self.path, sample_rate=self.sample_rate, chunk_duration=chunk_duration)
+        reader._backend = self._backend
+        reader._duration = self._duration
+
+        return reader
+
+    @staticmethod
+    def get_ffmpeg_binary():
+        """
+        This returns the ffmpeg binary found by StoryToolkitAI.check_ffmpeg (or just 'ffmpeg' if it wasn't set)
+        """
+
+        return os.getenv('FFMPEG_BINARY') or 'ffmpeg'
+
+    @property
+    def backend(self):
+        """
+        This returns the backend that can decode the file, or None if none of them can
+        (it decodes the first second of the file with each backend to find out)
+        """
+
+        if self._backend is None:
+
+            for backend in ['ffmpeg', 'soundfile']:
+
+                try:
+                    for _ in self._iter_backend(backend, max_samples=self.sample_rate):
+                        self._backend = backend
+                        break
+
+                except Exception:
+                    logger.debug('Cannot decode {} using {}.'.format(self.path, backend), exc_info=True)
+
+                if self._backend is not None:
+                    break
+
+        return self._backend
+
+    @property
+    def duration(self):
+        """
+        The duration of the audio (seconds) according to the file header, or None if it's not known
+        """
+
+        if self._duration is None:
+            self._duration = self._get_duration()
+
+        return self._duration
+
+    def _get_duration(self):
+
+        try:
+            import soundfile
+
+            return soundfile.info(self.path).duration
+
+        except Exception:
+            pass
+
+        # ffmpeg prints the duration of the file when it opens it
+        try:
+            result = subprocess.run([self.get_ffmpeg_binary(), '-hide_banner', '-i', self.path],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+            match = re.search(r'Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)', result.stderr)
+
+            if match:
+                return int(match.group(1)) * 3600 + int(match.group(2)) * 60 + float(match.group(3))
+
+        except OSError:
+            logger.debug('Cannot get the duration of {}.'.format(self.path), exc_info=True)
+
+        return None
+
+    def __iter__(self):
+        """
+        This yields (start_sample, chunk) for each chunk of the audio
+        """
+
+        if self.backend is None:
+            raise IOError('Cannot decode audio from {}.'.format(self.path))
+
+        yield from self._iter_backend(self.backend)
+
+    def _iter_backend(self, backend, max_samples=None):
+
+        if backend == 'ffmpeg':
+            return self._iter_ffmpeg(max_samples=max_samples)
+
+        return self._iter_soundfile(max_samples=max_samples)
+
+    def _iter_ffmpeg(self, max_samples=None):
+
+        command = [self.get_ffmpeg_binary(), '-v', 'error', '-nostdin', '-i', self.path, '-map', '0:a:0', '-vn']
+
+        if max_samples is not None:
+            command += ['-t', '{:.6f}'.format(max_samples / self.sample_rate)]
+
+        command += ['-ac', '1', '-ar', str(self.sample_rate), '-f', 'f32le', '-']
+
+        chunk_bytes = self.chunk_samples * 4
+
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                   stdin=subprocess.DEVNULL, bufsize=chunk_bytes)
+
+        start_sample = 0
+
+        # this stays False if the consumer stops reading before the end of the audio
+        reached_end = False
+
+        try:
+            while True:
+
+                chunk = np.empty(self.chunk_samples, dtype=np.float32)
+                view = memoryview(chunk).cast('B')
+
+                # fill the chunk (the pipe might return less than we asked for)
+                bytes_read = 0
+                while bytes_read < chunk_bytes:
+
+                    read_size = process.stdout.readinto(view[bytes_read:])
+
+                    if not read_size:
+                        break
+
+                    bytes_read += read_size
+
+                # ignore the incomplete sample at the end (if any)
+                chunk = chunk[:bytes_read // 4]
+
+                if bytes_read < chunk_bytes:
+                    reached_end = True
+
+                if len(chunk):
+                    yield start_sample, chunk
+                    start_sample += len(chunk)
+
+                if reached_end:
+                    break
+
+        finally:
+
+            # if the consumer stopped reading early, we don't need the rest of the audio,
+            # otherwise, ffmpeg closed the pipe, so we wait for it to finish to know if it decoded everything
+            if not reached_end and process.poll() is None:
+                process.kill()
+
+            process.stdout.close()
+            return_code = process.wait()
+
+        # ffmpeg failed (for eg. the file has no audio stream, or it's damaged after some point),
+        # so the audio we sent so far is incomplete
+        if return_code:
+            raise IOError('FFmpeg could not decode {} (exit code {}) after {:.2f} seconds of audio.'
+                          .format(self.path, return_code, start_sample / self.sample_rate))
+
+    def _iter_soundfile(self, max_samples=None):
+
+        import soundfile
+        import soxr
+
+        with soundfile.SoundFile(self.path) as audio_file:
+
+            file_sample_rate = audio_file.samplerate
+
+            resampler = soxr.ResampleStream(file_sample_rate, self.sample_rate, 1, dtype='float32') \
+                if file_sample_rate != self.sample_rate else None
+
+            # read about as many samples as we need for each chunk
+            block_size = max(1, int(self.chunk_samples * file_sample_rate / self.sample_rate))
+
+            start_sample = 0
+            read_samples = 0
+
+            while max_samples is None or start_sample < max_samples:
+
+                block = audio_file.read(block_size, dtype='float32', always_2d=True)
+                read_samples += len(block)
+
+                last_block = len(block) < block_size \
+                    or (max_samples is not None and read_samples * self.sample_rate >= max_samples * file_sample_rate)
+
+                # mix the channels down to mono
+                block = block.mean(axis=1, dtype=np.float32)
+
+                chunk = resampler.resample_chunk(block, last=last_block) if resampler is not None else block
+
+                if len(chunk):
+                    yield start_sample, np.ascontiguousarray(chunk, dtype=np.float32)
+                    start_sample += len(chunk)
+
+                if last_block:
+                    break
+
+
+class AudioArrayReader:
+    """
+    This works just like AudioStreamReader, but for audio that was already decoded
+    (for eg. the memory-mapped audio from the AudioCache).
+    The chunks are views of the audio array, so nothing is copied.
+    """
+
+    backend = 'array'
+
+    def __init__(self, audio_array, sample_rate=16_000, chunk_duration=30, path=None):
+        """
+        :param audio_array: the mono float32 audio
+        :param sample_rate: the sample rate of the audio
+        :param chunk_duration: the duration of each chunk (seconds)
+        :param path: the path of the source file (if any)
+        """
+
+        self.audio_array = audio_array
+        self.sample_rate = int(sample_rate)
+        self.chunk_duration = chunk_duration
+        self.path = path
+
+    @property
+    def chunk_samples(self):
+        return max(1, int(self.chunk_duration * self.sample_rate))
+
+    @property
+    def duration(self):
+        return len(self.audio_array) / self.sample_rate
+
+    def with_chunk_duration(self, chunk_duration):
+        return AudioArrayReader(
+            self.audio_array, sample_rate=self.sample_rate, chunk_duration=chunk_duration, path=self.path)
+
+    def __iter__(self):
+
+        for start_sample in range(0, len(self.audio_array), self.chunk_samples):
+            yield start_sample, self.audio_array[start_sample:start_sample + self.chunk_samples]
+
+
+class StreamedAudioSegments:
+    """
+    This cuts the audio segments that need to be transcribed from an AudioStreamReader (or an AudioArrayReader),
+    in a single pass over the audio, so only the audio of the current segment is kept in memory.
+
+    It works like the list of [start_time, end_time, audio_array] segments returned by split_audio_by_intervals,
+    only that the audio of each segment is decoded when the iteration reaches it.
+
+    By default, each time interval is a single segment (and without time intervals, the whole audio is one segment).
+    If a max_segment_duration is passed, the longer time intervals are split into multiple segments,
+    and if no time intervals are passed, the whole audio is split into segments of max_segment_duration.
+    But these cuts are made at fixed times, regardless of the speech (so words might get split),
+    and each segment is transcribed without the text of the previous one, so splitting is opt-in.
+    """
+
+    def __init__(self, reader, time_intervals=None, max_segment_duration=None):
+        """
+        :param reader: the AudioStreamReader
+        :param time_intervals: a sorted list of non-overlapping [start_time, end_time] intervals (seconds)
+        :param max_segment_duration: the maximum duration of a segment (seconds), None for no limit
+        """
+
+        self.reader = reader
+        self.max_segment_duration = max_segment_duration
+
+        # when we don't have time intervals, we read until the end of the audio
+        self._open_ended = not time_intervals
+
+        self._time_intervals = self._split_intervals(time_intervals) if time_intervals else None
+
+    def _split_intervals(self, time_intervals):
+
+        if not self.max_segment_duration:
+            return [[interval[0], interval[1]] for interval in time_intervals]
+
+        split_intervals = []
+
+        for start_time, end_time in time_intervals:
+
+            while end_time - start_time > self.max_segment_duration:
+                split_intervals.append([start_time, start_time + self.max_segment_duration])
+                start_time += self.max_segment_duration
+
+            split_intervals.append([start_time, end_time])
+
+        return split_intervals
+
+    @property
+    def time_intervals(self):
+        """
+        The time intervals of the segments
+        (if we're reading the whole audio, this uses the duration from the file header)
+        """
+
+        if self._time_intervals is None:
+            return self._split_intervals([[0, self.reader.duration]]) if self.reader.duration else []
+
+        return self._time_intervals
+
+    @property
+    def total_duration(self):
+        return sum([interval[1] - interval[0] for interval in self.time_intervals])
+
+    def __len__(self):
+        return len(self.time_intervals)
+
+    def __bool__(self):
+        return self._open_ended or bool(self._time_intervals)
+
+    def _iter_intervals(self):
+
+        if not self._open_ended:
+            yield from self._time_intervals
+            return
+
+        # read the whole audio in segments of max_segment_duration (or in one segment if there's no limit)
+        start_time = 0
+        while True:
+            yield [start_time, start_time + self.max_segment_duration if self.max_segment_duration else None]
+            start_time += self.max_segment_duration or 0
+
+    def __iter__(self):
+        """
+        This yields [start_time, end_time, audio_array] for each segment
+        """
+
+        sample_rate = self.reader.sample_rate
+
+        # the audio is already decoded, so we can simply slice it
+        if isinstance(self.reader, AudioArrayReader):
+            yield from self._iter_array_segments()
+            return
+
+        intervals = self._iter_intervals()
+        interval = next(intervals, None)
+
+        # the parts of the current segment
+        parts = []
+
+        def segment_samples(segment_interval):
+            return int(segment_interval[0] * sample_rate), \
+                int(segment_interval[1] * sample_rate) if segment_interval[1] is not None else None
+
+        end_sample = 0
+
+        for chunk_start, chunk in self.reader:
+
+            chunk_end = chunk_start + len(chunk)
+            end_sample = chunk_end
+
+            while interval is not None:
+
+                start, end = segment_samples(interval)
+
+                # the segment starts after this chunk
+                if start >= chunk_end:
+                    break
+
+                part_start = max(start, chunk_start) - chunk_start
+                part_end = (min(end, chunk_end) if end is not None else chunk_end) - chunk_start
+
+                if part_end > part_start:
+                    parts.append(chunk[part_start:part_end])
+
+                # we need the next chunks to complete the segment
+                if end is None or end > chunk_end:
+                    break
+
+                yield [interval[0], interval[1], np.concatenate(parts) if parts else np.empty(0, dtype=np.float32)]
+
+                parts = []
+                interval = next(intervals, None)
+
+            if interval is None:
+                break
+
+        # the audio ended before the end of the current segment
+        if interval is not None and parts:
+            yield [interval[0], end_sample / sample_rate, np.concatenate(parts)]
+
+    def _iter_array_segments(self):
+
+        sample_rate = self.reader.sample_rate
+        audio_array = self.reader.audio_array
+
+        for start_time, end_time in self.time_intervals:
+
+            # make sure the last segment goes until the end of the audio
+            if self._open_ended and end_time >= self.reader.duration:
+                end_time = self.reader.duration
+
+            yield [start_time, end_time, audio_array[int(start_time * sample_rate): int(end_time * sample_rate)]]
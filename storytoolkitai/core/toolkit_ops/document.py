@@ -2,10 +2,14 @@ import os
 import codecs
 import hashlib
 
+from .instance_registry import InstanceRegistry
+
 
 class Document:
-    
-    _instances = {}
+
+    # the documents that were loaded, so we don't load the same file twice
+    # (the registry only keeps the most recently used documents alive)
+    _instances = InstanceRegistry(name='documents')
 
     def __new__(cls, *args, **kwargs):
         """
@@ -13,21 +17,21 @@ class Document:
         and returns that instance if it is.
         """
 
+        document_file_path = kwargs.get('document_file_path', None) or args[0]
+
         # we use the document file path as the id for the instance
-        document_path_id = cls.get_document_path_id(
-            document_file_path=kwargs.get('document_file_path', None) or args[0]
-        )
+        document_path_id = cls.get_document_path_id(document_file_path=document_file_path)
 
         # if the document file path is already loaded in an instance, we return that instance
-        if document_path_id in cls._instances:
+        if (instance := cls._instances.get(document_path_id)) is not None:
 
-            return cls._instances[document_path_id]
+            return instance
 
         # otherwise we create a new instance
         instance = super().__new__(cls)
 
-        # and we store it in the instances dict
-        cls._instances[document_path_id] = instance
+        # and we store it in the instances registry
+        cls._instances.put(document_path_id, instance, size=InstanceRegistry.file_size(document_file_path))
 
         # then we return the instance
         return instance
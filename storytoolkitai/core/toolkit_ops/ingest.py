@@ -103,6 +103,8 @@ class TranscriptionSettings(BaseModel):
     excluded_time_intervals: Optional[List[TimeInterval]] = None
     keep_whisper_debug_info: Optional[bool] = None
     group_questions: Optional[bool] = None
+    whisper_engine: Optional[str] = None
+    whisper_engine_model_path: Optional[str] = None
     whisper_options: dict
 
 class VideoIndexingOptions(BaseModel):
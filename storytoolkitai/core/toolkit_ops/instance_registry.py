@@ -0,0 +1,352 @@
+import os
+import weakref
+from collections import OrderedDict
+from threading import RLock
+
+from storytoolkitai.core.logger import logger
+
+
+class InstanceRegistry:
+    """
+    This is a bounded LRU registry for the instances of classes that should only be loaded once per file
+    (Transcription, Story, Document, SearchItem etc.)
+
+    Only the most recently used instances are kept alive by the registry (strong references),
+    the rest are only referenced weakly, so they're released once nothing else in the app uses them.
+    This way, we still return the same instance for the same file while it's in use somewhere (windows etc.),
+    but we don't keep every file ever opened in memory until the app is closed.
+
+    Instances that are dirty (not yet saved) or that were explicitly pinned (for eg. open in a window)
+    are never evicted from the strong references.
+    """
+
+    # all the registries, so we can configure them and get their stats in one go
+    _registries = weakref.WeakValueDictionary()
+
+    # the default limits for all registries, use configure() to change them
+    default_max_items = 64
+
+    # the memory limit is estimated using the size of the source files of the instances (in bytes)
+    default_max_size = 512 * 1024 * 1024
+
+    def __init__(self, name, max_items=None, max_size=None, pin_check=None):
+        """
+        :param name: the name of the registry (used for logging and stats)
+        :param max_items: the max number of instances that are kept alive by the registry
+        :param max_size: the max estimated size (in bytes) of the instances that are kept alive by the registry
+        :param pin_check: a function that receives an instance and returns True if it shouldn't be evicted
+        """
+
+        self.name = name
+
+        self._max_items = max_items
+        self._max_size = max_size
+
+        self._pin_check = pin_check
+
+        # the instances that are kept alive by the registry, in the order they were used
+        # the format is {key: (instance, size)}
+        self._strong = OrderedDict()
+        self._strong_size = 0
+
+        # the estimated sizes of the instances, so we don't have to calculate them again
+        # when an instance is kept alive again after it was evicted
+        self._sizes = {}
+
+        # all the instances that are still alive, even if the registry doesn't keep them alive anymore
+        self._weak = weakref.WeakValueDictionary()
+
+        # the keys that were explicitly pinned
+        self._pinned = set()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        self._lock = RLock()
+
+        self.__class__._registries[name] = self
+
+    @property
+    def max_items(self):
+        return self._max_items if self._max_items is not None else self.__class__.default_max_items
+
+    @property
+    def max_size(self):
+        return self._max_size if self._max_size is not None else self.__class__.default_max_size
+
+    @classmethod
+    def configure(cls, max_items=None, max_size=None):
+        """
+        This changes the default limits for all the registries that don't have their own limits
+        and evicts the instances that are above the new limits
+        """
+
+        if max_items is not None:
+            cls.default_max_items = max(0, int(max_items))
+
+        if max_size is not None:
+            cls.default_max_size = max(0, int(max_size))
+
+        for registry in list(cls._registries.values()):
+            registry.evict()
+
+    @classmethod
+    def get_all_stats(cls):
+        """
+        This returns the stats of all the registries
+        """
+
+        return {name: registry.get_stats() for name, registry in list(cls._registries.items())}
+
+    @staticmethod
+    def file_size(file_paths):
+        """
+        This uses the size of the file(s) on disk as the estimated size of an instance
+        """
+
+        if not file_paths:
+            return 0
+
+        if isinstance(file_paths, str):
+            file_paths = [file_paths]
+
+        total_size = 0
+        for file_path in file_paths:
+            try:
+                total_size += os.path.getsize(file_path)
+            except (OSError, TypeError):
+                continue
+
+        return total_size
+
+    def __contains__(self, key):
+        return self._weak.get(key, None) is not None
+
+    def __len__(self):
+        return len(self._weak)
+
+    def values(self):
+        """
+        This returns all the instances that are still alive (without marking them as used)
+        """
+
+        with self._lock:
+            return list(self._weak.values())
+
+    def get(self, key, default=None):
+        """
+        This returns the instance stored for the key (if it's still alive) and marks it as recently used
+        """
+
+        with self._lock:
+
+            instance = self._weak.get(key, None)
+
+            if instance is None:
+                self._misses += 1
+                self._sizes.pop(key, None)
+                return default
+
+            self._hits += 1
+
+            # if the instance was only weakly referenced, the registry will keep it alive again
+            self._touch(key, instance)
+
+            # this might have pushed other instances out
+            self.evict()
+
+            return instance
+
+    def __getitem__(self, key):
+
+        instance = self.get(key)
+
+        if instance is None:
+            raise KeyError(key)
+
+        return instance
+
+    def __setitem__(self, key, instance):
+        self.put(key, instance)
+
+    def __delitem__(self, key):
+        self.remove(key)
+
+    def put(self, key, instance, size=0):
+        """
+        This stores the instance in the registry as the most recently used one
+
+        :param key: the key of the instance (usually the path id)
+        :param instance: the instance to store
+        :param size: the estimated size of the instance in bytes
+        """
+
+        with self._lock:
+
+            # remove any other instance that might be stored under the same key
+            if key in self._strong:
+                self._strong_size -= self._strong.pop(key)[1]
+
+            self._weak[key] = instance
+            self._sizes[key] = max(0, int(size or 0))
+            self._touch(key, instance)
+
+            self.evict()
+
+    def remove(self, key, instance=None):
+        """
+        This removes the key from the registry,
+        but only if the stored instance is the one that was passed (if any was passed)
+        """
+
+        with self._lock:
+
+            if instance is not None and self._weak.get(key, None) is not instance:
+                return False
+
+            if key in self._strong:
+                self._strong_size -= self._strong.pop(key)[1]
+
+            self._weak.pop(key, None)
+            self._sizes.pop(key, None)
+            self._pinned.discard(key)
+
+            return True
+
+    def pin(self, key):
+        """
+        This prevents the instance stored for this key from being evicted until it's unpinned
+        """
+
+        with self._lock:
+
+            instance = self._weak.get(key, None)
+
+            if instance is None:
+                return False
+
+            self._pinned.add(key)
+            self._touch(key, instance)
+
+            return True
+
+    def unpin(self, key):
+        """
+        This allows the instance stored for this key to be evicted again
+        """
+
+        with self._lock:
+            self._pinned.discard(key)
+            self.evict()
+
+    def is_pinned(self, key, instance=None):
+
+        if key in self._pinned:
+            return True
+
+        if self._pin_check is None:
+            return False
+
+        if instance is None:
+            instance = self._weak.get(key, None)
+
+        if instance is None:
+            return False
+
+        try:
+            return bool(self._pin_check(instance))
+
+        # if we can't check the instance, better keep it
+        except Exception:
+            return True
+
+    def evict(self):
+        """
+        This drops the strong references to the least recently used instances
+        until the registry is within its limits again.
+        The evicted instances remain available as long as they're referenced somewhere else.
+        """
+
+        with self._lock:
+
+            if len(self._strong) <= self.max_items and self._strong_size <= self.max_size:
+                return 0
+
+            evicted = 0
+
+            # go through the instances from the least recently used to the most recently used one
+            for key in list(self._strong.keys()):
+
+                if len(self._strong) <= self.max_items and self._strong_size <= self.max_size:
+                    break
+
+                instance, size = self._strong[key]
+
+                # never evict dirty or pinned instances
+                if self.is_pinned(key, instance):
+                    continue
+
+                del self._strong[key]
+                self._strong_size -= size
+                evicted += 1
+
+            if evicted:
+                self._evictions += evicted
+
+                logger.debug('Evicted {} instances from the {} registry ({} still kept alive).'
+                             .format(evicted, self.name, len(self._strong)))
+
+            return evicted
+
+    def clear(self):
+
+        with self._lock:
+            self._strong.clear()
+            self._strong_size = 0
+            self._weak.clear()
+            self._sizes.clear()
+            self._pinned.clear()
+
+    def get_stats(self):
+        """
+        This returns the usage stats of the registry, so we can tune the limits
+        """
+
+        with self._lock:
+
+            lookups = self._hits + self._misses
+
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': self._hits / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+                'kept_alive': len(self._strong),
+                'alive': len(self._weak),
+                'pinned': len(self._pinned),
+                'estimated_size': self._strong_size,
+                'max_items': self.max_items,
+                'max_size': self.max_size
+            }
+
+    def reset_stats(self):
+
+        with self._lock:
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+
+    def _touch(self, key, instance):
+        """
+        This marks the instance as the most recently used one and makes sure the registry keeps it alive
+        """
+
+        if key in self._strong:
+            self._strong.move_to_end(key)
+            return
+
+        size = self._sizes.get(key, 0)
+
+        self._strong[key] = (instance, size)
+        self._strong_size += size
@@ -1,21 +1,41 @@
+import sys
 import time
 import json
+import heapq
+import atexit
 
 from storytoolkitai import USER_DATA_PATH
 from storytoolkitai.core.logger import *
 
 import torch
-from threading import Thread
+from threading import Thread, Event, RLock, current_thread
 
 
 QUEUE_FILE_PATH = os.path.join(USER_DATA_PATH, 'queue.json')
 
+# the changes to the queue items are appended to this file between two full saves of the queue file
+QUEUE_JOURNAL_FILE_PATH = os.path.join(USER_DATA_PATH, 'queue.journal.jsonl')
+
 
 class ProcessingQueue:
     """
     This class handles the processing queue:
     """
 
+    # the resources each task needs by default (an item needs the resources of its biggest task)
+    # - cpu_threads: how many cpu threads the task should use
+    #   (torch is only limited to these in the worker processes, in the app process they're only used for scheduling)
+    # - memory_gb: roughly how much memory the task needs
+    task_resource_budgets = {
+        'transcribe': {'cpu_threads': 4, 'memory_gb': 6},
+        'translate': {'cpu_threads': 4, 'memory_gb': 6},
+        'index_video': {'cpu_threads': 4, 'memory_gb': 4},
+        'index_text': {'cpu_threads': 2, 'memory_gb': 2},
+        'speaker_detection': {'cpu_threads': 2, 'memory_gb': 2},
+        'group_questions': {'cpu_threads': 2, 'memory_gb': 2},
+        'default': {'cpu_threads': 1, 'memory_gb': 1},
+    }
+
     def __init__(self, toolkit_ops_obj=None):
 
         self.toolkit_ops_obj = toolkit_ops_obj
@@ -25,17 +45,75 @@ class ProcessingQueue:
         # since it's an ordered list, the first item in the list is the next item to be processed
         self.queue = []
 
+        # the position of each item in the queue (only the items that are in the queue)
+        # so we can keep the items that are ready to start in the queue order without going through the queue
+        self._queue_positions = {}
+        self._queue_next_position = 0
+
+        # the items in the queue that can start as soon as their device has enough resources
+        # (they have no dependencies that still need to finish),
+        # the ready items of each device are kept in a heap ordered by their position in the queue
+        # for eg. {'cpu': [(position, queue_id), ...], 'cuda': [...]}
+        self._ready_queue_ids = set()
+        self._ready_by_device = {}
+
+        # the dependencies that still need to finish before each item can start
+        # for eg. {queue_id: {dependency_id, ...}}
+        self._pending_dependencies = {}
+
+        # the items that are waiting for each dependency to finish
+        # for eg. {dependency_id: {queue_id, ...}}
+        self._dependents = {}
+
         # this holds the queue history
         # - when an object is added to the queue it must also have a corresponding entry in the queue history
         # - we are only tracking the status of the object in the queue history
         # - when an object sent for processing it will remain in the history so that we can track its status
-        self.queue_history = []
+        self._queue_history = []
+
+        # the queue history items by their queue id, so we don't have to go through the whole history to find them
+        self._queue_history_index = {}
+
+        # the queue ids of the items that changed since the last time we wrote the queue to disk
+        self._queue_items_to_save = set()
+
+        # this is set to True when the whole queue needs to be saved (for eg. when the order of the items changed)
+        self._queue_needs_full_save = False
+
+        # the changes are written to disk by a background thread,
+        # which waits for queue_save_delay seconds after it's triggered, so that more changes can pile up
+        self.queue_save_delay = 0.5
+        self._queue_save_event = Event()
+        self._queue_save_thread = None
+        self._queue_file_lock = RLock()
 
-        # this keeps track of the threads that are processing the queue by device
-        # the key is the device name and the value is a dict with the queue id and the thread object
-        # for eg. {'cuda:0': {'queue_id': queue_id, 'thread': <Thread(Thread-1, started 1234567890123)>}, ...}
+        # after this many lines in the journal file, we save the whole queue file again and empty the journal
+        self.queue_journal_max_lines = 1000
+        self._queue_journal_lines = 0
+
+        # make sure we write the last changes to disk before the app exits
+        atexit.register(self.flush_queue_to_file)
+
+        # this keeps track of the threads that are processing the queue items
+        # the key is the queue id and the value is a dict with the device, the thread object
+        # and the resources the item reserved on the device (see get_item_resources)
+        # for eg. {queue_id: {'queue_id': queue_id, 'device': 'cpu', 'thread': <Thread(...)>,
+        #                     'resources': {'slots': 1, 'cpu_threads': 4, 'memory_gb': 6}}, ...}
+        # the number of items that can run on each device at the same time depends on get_device_capacity
         self.queue_threads = {}
 
+        # this makes sure that only one thread at a time decides which items start
+        self._queue_schedule_lock = RLock()
+
+        # the queue is woken up whenever something happens that might let items start
+        # (a dependency is done, an item freed its resources etc.) and a dispatcher thread starts the items
+        self._queue_dispatch_event = Event()
+        self._queue_dispatch_thread = None
+
+        # the worker processes that run the items if the queue_worker_processes setting is enabled
+        # (see get_worker_pool)
+        self._worker_pool = None
+
         # this holds other variables that don't need to be part of the queue history,
         # but can be shared between threads
         # the key is the queue id and the value is a dict variable names and values
@@ -46,6 +124,36 @@ class ProcessingQueue:
         # by checking the queue_threads dict
         # self.queue_check_interval = 30 # seconds
 
+    @property
+    def queue_history(self):
+        return self._queue_history
+
+    @queue_history.setter
+    def queue_history(self, value):
+        self._queue_history = value
+        self._index_queue_history()
+
+    def _index_queue_history(self):
+        """
+        This re-generates the queue id index of the queue history
+        """
+
+        self._queue_history_index = {}
+
+        for item in self._queue_history:
+
+            # if there are multiple items with the same queue id, the first one wins (like in the list)
+            if isinstance(item, dict) and 'queue_id' in item:
+                self._queue_history_index.setdefault(item['queue_id'], item)
+
+    def _add_to_queue_history(self, item: dict):
+        """
+        This adds an item to the queue history and to the queue id index
+        """
+
+        self._queue_history.append(item)
+        self._queue_history_index.setdefault(item['queue_id'], item)
+
     def generate_queue_id(self, name: str = None) -> str:
         """
         This function generates a queue id for a task
@@ -62,7 +170,7 @@ class ProcessingQueue:
             if not self.get_item(queue_id=queue_id):
 
                 # add it to the queue history
-                self.queue_history.append({'queue_id': queue_id, 'name': '', 'status': 'pending'})
+                self._add_to_queue_history({'queue_id': queue_id, 'name': '', 'status': 'pending'})
 
                 logger.debug('Added queue id {} to queue history'.format(queue_id))
 
@@ -177,7 +285,7 @@ class ProcessingQueue:
         if not item:
 
             # add the kwargs to the queue history
-            self.queue_history.append(kwargs)
+            self._add_to_queue_history(kwargs)
 
             logger.debug('Added item {} to queue history'.format(queue_id))
 
@@ -190,7 +298,7 @@ class ProcessingQueue:
             self.update_queue_item(**kwargs)
 
         # add the queue id to the queue
-        self.queue.append(queue_id)
+        self._add_to_queue_order(queue_id=queue_id)
 
         logger.debug('Added item {} to queue'.format(queue_id))
 
@@ -198,8 +306,8 @@ class ProcessingQueue:
         if ping:
             self.ping_queue()
 
-        # save the queue to a file
-        self.save_queue_to_file()
+        # save the item to the queue file
+        self.save_queue_soon(queue_id=queue_id)
 
         # throttle for a bit to avoid queue id queue id collisions,
         # if this is a batch
@@ -229,6 +337,9 @@ class ProcessingQueue:
 
             item['dependencies'].append(dependency_id)
 
+            # if the item is already in the queue, it needs to wait for this dependency too
+            self._register_item_dependencies(queue_id=queue_id, dependency_ids=[dependency_id])
+
         # update the item
         self.update_queue_item(**item)
 
@@ -244,7 +355,8 @@ class ProcessingQueue:
         """
 
         # the stuff that we're never supposed to override
-        override_not_allowed = ['queue_id', 'name', 'tasks', 'device', 'task_queue', 'dependencies']
+        # (the status of the dependency would also tell the queue that this item is done)
+        override_not_allowed = ['queue_id', 'name', 'tasks', 'device', 'task_queue', 'dependencies', 'status']
 
         # get the item
         item = self.get_item(queue_id)
@@ -312,27 +424,20 @@ class ProcessingQueue:
         # add the last_update timestamp
         new_item['last_update'] = time.time()
 
-        # find the item index in the queue history according to its queue id
-        for index, item in enumerate(self.queue_history):
-
-            if 'queue_id' in item and item['queue_id'] == queue_id:
-                item_index = index
+        # the status change might let other items start (or fail)
+        if 'status' in kwargs:
+            self._on_item_status_changed(queue_id=queue_id, status=kwargs['status'])
 
-                # replace the item in the queue history
-                self.queue_history[item_index] = new_item
+        # whenever the status is updated, make sure notify all the observers
+        self.toolkit_ops_obj.notify_observers('update_queue_item')
 
-                # whenever the status is updated, make sure notify all the observers
-                self.toolkit_ops_obj.notify_observers('update_queue_item')
+        # save the item to the queue file
+        # (this happens in the background, so that many updates in a short time are written together)
+        if save_to_file:
+            self.save_queue_soon(queue_id=queue_id)
 
-                # save the queue to a file
-                if save_to_file:
-                    self.save_queue_to_file()
-
-                # and return the updated item
-                return new_item
-
-        # let's hope this doesn't happen...
-        return False
+        # and return the updated item
+        return new_item
 
     def reorder_queue(self, new_queue_order) -> bool:
         """
@@ -364,7 +469,9 @@ class ProcessingQueue:
             return True
 
         # re-order the queue
-        self.queue = new_queue_order
+        with self._queue_schedule_lock:
+            self.queue = new_queue_order
+            self._index_queue_order()
 
         # now re-order the QUEUE HISTORY
 
@@ -404,6 +511,9 @@ class ProcessingQueue:
         # now replace the queue history with the remaining items list
         self.queue_history = queue_history
 
+        # the order of the items changed, so the whole queue file needs to be saved
+        self.save_queue_soon(full=True)
+
         return True
 
     def cancel_item(self, queue_id: str):
@@ -419,8 +529,7 @@ class ProcessingQueue:
 
         # remove the item from the queue
         # (to avoid processing it if it's not already being processed)
-        if queue_id in self.queue:
-            self.queue.remove(queue_id)
+        self._remove_from_queue(queue_id=queue_id)
 
         # try to get the item from the queue history
         item = self.get_item(queue_id)
@@ -439,7 +548,7 @@ class ProcessingQueue:
         # if it is, set the status to 'canceling', since we can't remove it from the thread pool
 
         # go through all the threads in queue_threads
-        for thread in self.queue_threads:
+        for thread in list(self.queue_threads.values()):
 
             if isinstance(thread, dict) \
                     and 'queue_id' in thread \
@@ -527,20 +636,11 @@ class ProcessingQueue:
         :return: the item if it is in the queue history, None otherwise
         """
 
-        found_item = None
-
         if queue_id is None:
             return None
 
-        # the queue history is a list of dictionaries, so we need to iterate through it to find the item
-        for item in self.queue_history:
-
-            # if we found the item by its queue id, use it and break the loop
-            if 'queue_id' in item and item['queue_id'] == queue_id:
-                found_item = item
-                break
-
-        return found_item
+        # use the queue id index instead of going through the whole queue history
+        return self._queue_history_index.get(queue_id, None)
 
     def get_status(self, queue_id: str) -> str or None:
         """
@@ -678,9 +778,6 @@ class ProcessingQueue:
             logger.error('Unable to execute tasks for item {} - no tasks were specified'.format(queue_id))
             return False
 
-        # keep track of the device we're using
-        device = kwargs.get('device', None)
-
         # get the item details from the queue history
         item = self.get_item(queue_id=queue_id)
 
@@ -764,15 +861,13 @@ class ProcessingQueue:
                 # stop the execution
                 executed = False
 
-        # remove the thread from the queue threads to free up the device
-        self.remove_thread_from_queue_threads(device=device)
+        # remove the thread from the queue threads to free up the resources on the device
+        self.remove_thread_from_queue_threads(queue_id=queue_id)
 
         # notify all the observers that the queue has been updated
+        # (the queue wakes up by itself when the resources are freed, so we don't need to ping it)
         self.toolkit_ops_obj.notify_observers('update_queue')
 
-        # then ping the queue again
-        self.ping_queue()
-
         # if we get here, the execution was successful
         return executed
 
@@ -825,114 +920,218 @@ class ProcessingQueue:
 
     def ping_queue(self):
         """
-        Checks if there are items left in the queue and executes the first one if there are
+        Starts all the items that are ready (their dependencies are done)
+        and whose device has enough free resources.
+
+        The items that are ready are kept per device in the queue order, so we only look at the first ones,
+        no matter how many items are waiting in the queue or how big the queue history is.
         """
 
-        # if there are no items in the queue, return False
-        if len(self.queue) == 0:
-            logger.debug('No items left in the queue. Try to ping the queue again later.')
-            return False
+        # multiple threads might ping the queue at the same time when their items are done
+        with self._queue_schedule_lock:
 
-        # get the first item in the queue
-        queue_index = 0
-        queue_id = self.queue[queue_index]
-        reorder_queue = False
-
-        # try to start the next item from the queue that can be started
-        while not (can_start := self._item_can_start(queue_id=queue_id)):
-
-            logger.debug('Item {} cannot start. Trying the next one.'.format(queue_id))
-
-            # if we received a None from _item_can_start,
-            # it means that the item doesn't exist anymore relative to when we started the loop
-            # so we shouldn't increment the queue index
-            if can_start is not None:
-                # add +1 to the queue index
-                queue_index += 1
-
-            # check if the queue index is out of range
-            if queue_index >= len(self.queue):
-                # and abort if it is
-                if len(self.queue) == 0:
-                    logger.debug("Queue is empty.")
-                else:
-                    logger.debug('None of the queue items are ready to start. Try again later.')
+            # if there are no items in the queue, return False
+            if len(self.queue) == 0:
+                logger.debug('No items left in the queue. Try to ping the queue again later.')
                 return False
 
-            # get the next item in the queue
-            queue_id = self.queue[queue_index]
+            # remove the threads that finished so that their resources are free again
+            self._remove_finished_threads()
 
+            started_items = 0
 
+            for device, ready_heap in list(self._ready_by_device.items()):
 
-        # todo: fix this
-        """
-        # try to see if we can start this item
-        # and loop through the queue until we find one that we can start
-        # or until we reach the end of the queue
-        # todo: update the item status to failed if we get a None returned from _item_can_start
-        while not self._item_can_start(queue_id=queue_id):
+                while ready_heap:
 
-            # add +1 to the queue index
-            queue_index += 1
+                    position, queue_id = ready_heap[0]
 
-            # and try again (if the queue index is out of range, this will return False)
-            if queue_index >= len(self.queue):
-                logger.debug('Left queue items not ready to start. Try again later.')
-                return False
+                    # skip the items that left the queue or were moved since they were added to the heap
+                    if queue_id not in self._ready_queue_ids or self._queue_positions.get(queue_id, None) != position:
+                        heapq.heappop(ready_heap)
+                        continue
 
-            # get the next item in the queue
-            queue_id = self.queue[queue_index]
+                    # the item can't start (anymore) - if it has to wait for something,
+                    # it will be added back when it's ready
+                    if not self._item_can_start(queue_id=queue_id):
+                        heapq.heappop(ready_heap)
+                        continue
 
-            # mark that we need to reorder the queue
-            reorder_queue = True
+                    # get the item details from the queue history
+                    kwargs = self.get_item(queue_id=queue_id)
 
-        # make sure that we re-order the queue
-        if reorder_queue:
+                    # if the item was moved to another device, it waits in the heap of that device
+                    if kwargs['device'] != device:
+                        heapq.heappop(ready_heap)
+                        self._push_ready_item(queue_id=queue_id)
+                        continue
 
-            # first get the old order
-            # (use a copy of the list to avoid changing the original list due to mutability)
-            new_queue_order = [queue_id for queue_id in self.queue]
+                    # check if the device has enough resources for this item
+                    # (the items that come after it and use the same device need to wait,
+                    # otherwise bigger items might never get to start)
+                    item_resources = self.get_item_resources(item=kwargs)
 
-            # then remove the item from the old order (from whatever position it was in)
-            new_queue_order.pop(queue_index)
+                    if not self.is_device_available(device=device, resources=item_resources):
+                        logger.debug('Device {} busy. Item {} will start later.'.format(device, queue_id))
+                        break
 
-            # and add it back to the beginning of the list
-            new_queue_order.insert(0, queue_id)
+                    heapq.heappop(ready_heap)
 
-            self.reorder_queue(new_queue_order=new_queue_order)
+                    self._start_item_thread(item=kwargs, resources=item_resources)
+
+                    started_items += 1
+
+            if not started_items:
+                logger.debug('None of the queue items are ready to start. Try again later.')
+
+            return started_items > 0
+
+    def wake_queue(self):
+        """
+        This lets the dispatcher thread know that some items might be able to start now
+        (for eg. because a dependency is done or because an item freed up its resources)
         """
 
-        # get the item details from the queue history
-        kwargs = self.get_item(queue_id=queue_id)
+        with self._queue_schedule_lock:
 
-        # check if the device is available
-        if not self.is_device_available(device=kwargs['device']):
-            logger.debug('Device busy. Try again later.')
-            return False
+            # start the dispatcher thread if it's not running
+            if self._queue_dispatch_thread is None or not self._queue_dispatch_thread.is_alive():
+                self._queue_dispatch_thread = Thread(target=self._queue_dispatch_worker, daemon=True)
+                self._queue_dispatch_thread.start()
+
+        self._queue_dispatch_event.set()
+
+    def _queue_dispatch_worker(self):
+        """
+        This runs in the background and starts the items that can start whenever the queue is woken up
+        """
+
+        while True:
+
+            self._queue_dispatch_event.wait()
+            self._queue_dispatch_event.clear()
+
+            try:
+                self.ping_queue()
+
+            except Exception:
+                logger.error('Unable to start the next queue items.', exc_info=True)
+
+    def _start_item_thread(self, item, resources):
+        """
+        This starts a thread that executes the tasks of the item and reserves the resources it needs on its device
+        """
 
         # check all the kwargs and make sure that all their keys are strings
         # otherwise the thread will fail to start
         filtered_kwargs = {}
-        for key, value in kwargs.items():
+        for key, value in item.items():
 
             if isinstance(key, str):
                 filtered_kwargs[key] = value
 
         # create a thread to execute the tasks for this item
-        thread = Thread(target=self.execute_item_tasks, kwargs=filtered_kwargs)
+        thread = Thread(target=self._execute_item_in_thread, kwargs=filtered_kwargs)
 
-        # add the thread to the threads dictionary so that other processes know that the device is busy
-        self.add_thread_to_queue_threads(device=kwargs['device'], queue_id=kwargs['queue_id'], thread=thread)
+        # add the thread to the threads dictionary so that other items know which resources are used
+        self.add_thread_to_queue_threads(
+            device=item['device'], queue_id=item['queue_id'], thread=thread, resources=resources)
 
         # start the thread
         thread.start()
 
         # once the thread has started, we can remove the item from the queue
-        queue_index = self._get_item_queue_index(queue_id=queue_id)
-        if queue_index is not None:
-            self.queue.pop(queue_index)
+        self._remove_from_queue(queue_id=item['queue_id'])
 
-        return True
+    def _execute_item_in_thread(self, **kwargs):
+        """
+        This runs in the item thread and makes sure that the item's resources are freed when it stops
+        (even if the item stops before all its tasks are executed)
+        """
+
+        queue_id = kwargs.get('queue_id', None)
+
+        resources = self.queue_threads.get(queue_id, {}).get('resources', {})
+
+        try:
+
+            # if we have worker processes, the item runs in one of them and this thread only waits for it
+            if (worker_pool := self.get_worker_pool()) is not None \
+                    and self._execute_item_in_worker(worker_pool=worker_pool, resources=resources, **kwargs) \
+                    is not None:
+                return
+
+            # we're not limiting the number of threads torch uses to the item's cpu_threads budget here,
+            # since torch.set_num_threads is process-wide and the items running at the same time in this process
+            # would overwrite each other's budget (only the worker processes apply it, since they run one item each)
+            self.execute_item_tasks(**kwargs)
+
+        finally:
+
+            # if the thread wasn't already removed by execute_item_tasks, remove it (this also wakes the queue)
+            if queue_id in self.queue_threads:
+                self.remove_thread_from_queue_threads(queue_id=queue_id)
+
+    def _execute_item_in_worker(self, worker_pool, queue_id, resources=None, **kwargs):
+        """
+        This sends the item to a worker process and waits for it to finish
+
+        :return: True if all the tasks were executed, False if not,
+                 or None if no worker could run the item (so it needs to run in this process)
+        """
+
+        # cancel item if someone or something requested it
+        if self.cancel_if_canceled(queue_id=queue_id):
+            return False
+
+        item = self.get_item(queue_id=queue_id)
+
+        # pass the data of the dependencies to the item here, since the worker doesn't have the other items
+        for dependency_id in item.get('dependencies', None) or []:
+            self.pass_dependency_data(queue_id=queue_id, dependency_id=dependency_id,
+                                      override=True, save_to_file=False)
+
+        executed = worker_pool.run_item(item=item, resources=resources)
+
+        if executed is None:
+            return None
+
+        # remove the thread from the queue threads to free up the resources on the device
+        self.remove_thread_from_queue_threads(queue_id=queue_id)
+
+        # notify all the observers that the queue has been updated
+        # (the queue wakes up by itself when the resources are freed, so we don't need to ping it)
+        self.toolkit_ops_obj.notify_observers('update_queue')
+
+        return executed
+
+    def get_worker_pool(self):
+        """
+        This returns the pool of worker processes if the queue items should run in separate processes
+        (queue_worker_processes setting) or None if they should run in threads in the app process
+        """
+
+        if not self._get_app_setting('queue_worker_processes', default_if_none=False):
+            return None
+
+        # the standalone app can't start copies of itself as workers
+        if getattr(sys, 'frozen', False):
+            return None
+
+        with self._queue_schedule_lock:
+
+            if self._worker_pool is None:
+
+                # imported here, since the worker module needs this one
+                from .queue_workers import QueueWorkerPool
+
+                self._worker_pool = QueueWorkerPool(processing_queue=self)
+
+            # we need one worker for each item that can run at the same time
+            devices = getattr(self.toolkit_ops_obj, 'queue_devices', None) or ['cpu']
+            self._worker_pool.max_workers = sum([self.get_device_capacity(device)['slots'] for device in devices])
+
+            return self._worker_pool if self._worker_pool.available else None
 
     def _get_item_queue_index(self, queue_id):
         """
@@ -948,105 +1147,349 @@ class ProcessingQueue:
         except ValueError:
             return None
 
-    def _item_can_start(self, queue_id, item_data=None):
+    def _add_to_queue_order(self, queue_id):
         """
-        This determines if a certain item can start based on its dependencies
-        If any of its dependencies has failed, this will return None
+        This adds the item at the end of the queue and, if it has no dependencies to wait for,
+        to the items that are ready to start
         """
 
-        if item_data is None:
-            item_data = self.get_item(queue_id=queue_id)
+        with self._queue_schedule_lock:
 
-        # if the item was canceled, done or failed, it cannot start
-        if 'status' in item_data and item_data['status'] in ['canceled', 'done', 'failed']:
+            # if the item is already in the queue, it keeps its place
+            if queue_id in self._queue_positions:
+                return
+
+            self.queue.append(queue_id)
+
+            self._queue_positions[queue_id] = self._queue_next_position
+            self._queue_next_position += 1
+
+            item = self.get_item(queue_id=queue_id) or {}
+
+            self._register_item_dependencies(queue_id=queue_id, dependency_ids=item.get('dependencies', None) or [])
+
+    def _remove_from_queue(self, queue_id):
+        """
+        This removes the item from the queue and from the items that are ready to start
+        (the items that wait for it stay where they are until it's done or failed)
+        """
+
+        with self._queue_schedule_lock:
 
-            # remove it from the queue
             queue_index = self._get_item_queue_index(queue_id=queue_id)
             if queue_index is not None:
                 self.queue.pop(queue_index)
 
-            return None
+            self._queue_positions.pop(queue_id, None)
+            self._ready_queue_ids.discard(queue_id)
 
-        # if the item has no dependencies, it can start
-        if 'dependencies' not in item_data:
-            return True
+            # the item isn't waiting for anything anymore
+            for dependency_id in self._pending_dependencies.pop(queue_id, None) or []:
+                if dependency_id in self._dependents:
+                    self._dependents[dependency_id].discard(queue_id)
 
-        # if the item has dependencies, check if they are all completed
-        for dependency_id in item_data['dependencies']:
+    def _index_queue_order(self):
+        """
+        This re-generates the positions of the items and the ready items heaps after the queue order changed
+        """
 
-            dependency_item_data = self.get_item(queue_id=dependency_id)
+        with self._queue_schedule_lock:
 
-            # if the dependency has failed or doesn't exist, return None
-            # and mark the current item as failed as well
-            if not dependency_item_data \
-                    or ('status' in dependency_item_data
-                        and dependency_item_data['status'] == 'failed'):
+            self._queue_positions = {queue_id: position for position, queue_id in enumerate(self.queue)}
+            self._queue_next_position = len(self.queue)
 
-                logger.warning('Dependency {} failed or not available. '
-                               'Item {} will fail too.'.format(dependency_id, queue_id))
+            self._ready_queue_ids &= set(self._queue_positions)
 
-                # the current item will also fail
-                self.update_queue_item(queue_id=queue_id, status='failed')
+            self._ready_by_device = {}
+            for queue_id in list(self._ready_queue_ids):
+                self._push_ready_item(queue_id=queue_id)
 
-                # remove it from the queue
-                queue_index = self._get_item_queue_index(queue_id=queue_id)
-                if queue_index is not None:
-                    self.queue.pop(queue_index)
+    def _push_ready_item(self, queue_id):
+        """
+        This adds the item to the ready items of its device
+        """
 
-                return None
+        item = self.get_item(queue_id=queue_id)
 
-            # if the status of the dependency is not in the item data,
-            # it could be that the dependency is still running or has not been started yet
-            elif 'status' not in dependency_item_data or dependency_item_data['status'] != 'done':
-                logger.debug('Dependency {} not completed yet. Try again later.'.format(dependency_id))
-                return False
+        if item is None or queue_id not in self._queue_positions:
+            return
+
+        self._ready_queue_ids.add(queue_id)
+
+        heapq.heappush(self._ready_by_device.setdefault(item.get('device', None), []),
+                       (self._queue_positions[queue_id], queue_id))
+
+    def _register_item_dependencies(self, queue_id, dependency_ids):
+        """
+        This makes the item wait for the dependencies that are not done yet.
+        If none of them need to finish, the item is ready to start.
+        If one of them failed or doesn't exist, the item fails too.
+        """
+
+        with self._queue_schedule_lock:
+
+            # the item is not in the queue (yet), so there's nothing to wait for
+            if queue_id not in self._queue_positions:
+                return
+
+            pending_dependencies = self._pending_dependencies.get(queue_id, set())
+
+            for dependency_id in dependency_ids:
+
+                dependency_item_data = self.get_item(queue_id=dependency_id)
+
+                # if the dependency has failed or doesn't exist, the current item will fail too
+                if not dependency_item_data \
+                        or ('status' in dependency_item_data and dependency_item_data['status'] == 'failed'):
+
+                    logger.warning('Dependency {} failed or not available. '
+                                   'Item {} will fail too.'.format(dependency_id, queue_id))
+
+                    self._remove_from_queue(queue_id=queue_id)
+                    self.update_queue_item(queue_id=queue_id, status='failed')
+
+                    return
+
+                if dependency_item_data.get('status', None) == 'done':
+                    continue
+
+                pending_dependencies.add(dependency_id)
+                self._dependents.setdefault(dependency_id, set()).add(queue_id)
+
+            if pending_dependencies:
+                self._pending_dependencies[queue_id] = pending_dependencies
+
+                # the item might have been ready before it got this dependency
+                self._ready_queue_ids.discard(queue_id)
+
+            elif queue_id not in self._ready_queue_ids:
+                self._push_ready_item(queue_id=queue_id)
+
+    def _on_item_status_changed(self, queue_id, status):
+        """
+        This updates the items that wait for this item when it's done or failed
+        and removes the item from the queue if it can't start anymore
+        """
+
+        if status not in ['done', 'failed', 'canceled']:
+            return
+
+        with self._queue_schedule_lock:
+
+            self._remove_from_queue(queue_id=queue_id)
+
+            # the items that wait for a canceled item keep waiting (it might be queued again)
+            if status == 'canceled':
+                return
+
+            ready_items = 0
+
+            for dependent_id in self._dependents.pop(queue_id, None) or []:
+
+                # the items that were removed from the queue are not waiting anymore
+                if dependent_id not in self._pending_dependencies:
+                    continue
+
+                if status == 'failed':
+                    logger.warning('Dependency {} failed. Item {} will fail too.'.format(queue_id, dependent_id))
+
+                    self._remove_from_queue(queue_id=dependent_id)
+                    self.update_queue_item(queue_id=dependent_id, status='failed')
+
+                    continue
+
+                self._pending_dependencies[dependent_id].discard(queue_id)
+
+                if not self._pending_dependencies[dependent_id]:
+                    del self._pending_dependencies[dependent_id]
+                    self._push_ready_item(queue_id=dependent_id)
+                    ready_items += 1
+
+        # start the items that are ready now
+        if ready_items:
+            self.wake_queue()
+
+    def _item_can_start(self, queue_id, item_data=None):
+        """
+        This determines if a certain item can start based on its status and dependencies
+        If it can never start (it was canceled, done or failed), this will return None
+        """
+
+        if item_data is None:
+            item_data = self.get_item(queue_id=queue_id)
+
+        # if the item was canceled, done or failed, it cannot start
+        if not item_data or ('status' in item_data and item_data['status'] in ['canceled', 'done', 'failed']):
+
+            # remove it from the queue
+            self._remove_from_queue(queue_id=queue_id)
+
+            return None
+
+        # if the item still waits for some of its dependencies, it cannot start yet
+        if self._pending_dependencies.get(queue_id, None):
+            logger.debug('Item {} still waits for its dependencies. Try again later.'.format(queue_id))
+            return False
 
         return True
 
-    def add_thread_to_queue_threads(self, device, queue_id, thread):
+    def add_thread_to_queue_threads(self, device, queue_id, thread, resources: dict = None):
         """
         This function adds a thread to the queue_threads dict
-        (it will replace anything related to that device without checking if the old thread is still running!)
+        together with the resources it reserved on its device
         """
 
-        # if the device is not in the queue_threads dict, add it
-        self.queue_threads[device] = {'queue_id': queue_id, 'thread': thread}
+        self.queue_threads[queue_id] = {
+            'queue_id': queue_id, 'device': device, 'thread': thread, 'resources': resources or {}
+        }
 
         return self.queue_threads
 
-    def remove_thread_from_queue_threads(self, device):
+    def remove_thread_from_queue_threads(self, device=None, queue_id=None):
         """
-        This function removes a thread from the queue_threads dict
+        This function removes a thread from the queue_threads dict (which frees up its resources on the device).
+        If only the device is passed, the thread of the current item on that device is removed
+        (the one that is calling this function, or the ones that are not running anymore).
         """
 
-        if device is None:
-            logger.warning('Unable to remove thread from queue threads - no device specified')
+        if device is None and queue_id is None:
+            logger.warning('Unable to remove thread from queue threads - no device or queue id specified')
+
+        # if the queue id is in the queue_threads dict, remove it
+        if queue_id is not None:
+            self.queue_threads.pop(queue_id, None)
 
-        # if the device is in the queue_threads dict, remove it
-        if device in self.queue_threads:
-            self.queue_threads.pop(device)
+        elif device is not None:
+            for thread_queue_id, queue_thread in list(self.queue_threads.items()):
+                if queue_thread['device'] == device \
+                        and (queue_thread['thread'] is current_thread() or not queue_thread['thread'].is_alive()):
+                    self.queue_threads.pop(thread_queue_id, None)
+
+        # the freed resources might let other items start
+        if self.queue:
+            self.wake_queue()
 
         return self.queue_threads
 
-    def is_device_available(self, device):
+    def _remove_finished_threads(self):
+        """
+        This removes the threads that are not running anymore from the queue_threads dict
+        """
+
+        for queue_id, queue_thread in list(self.queue_threads.items()):
+
+            # the threads that were added but not started yet are not finished
+            if queue_thread['thread'].ident is not None and not queue_thread['thread'].is_alive():
+                self.queue_threads.pop(queue_id, None)
+
+    def _get_app_setting(self, setting_name, default_if_none=None):
+        """
+        This returns an app setting via the toolkit ops object (if there is one)
+        """
+
+        stAI = getattr(self.toolkit_ops_obj, 'stAI', None) if self.toolkit_ops_obj is not None else None
+
+        if stAI is None:
+            return default_if_none
+
+        return stAI.get_app_setting(setting_name=setting_name, default_if_none=default_if_none)
+
+    def get_device_capacity(self, device) -> dict:
         """
-        This function checks if a device is busy processing something by checking the queue_threads dict.
+        This returns the resources available on a device for processing queue items:
+        - slots: how many items can run at the same time
+        - cpu_threads: how many cpu threads all the items can use together (only for the cpu)
+        - memory_gb: how much memory all the items can use together (only for the cpu, None means no limit)
+        """
+
+        if device == 'cpu':
+
+            # the total memory of the machine (if we can find it), minus some for the app and the system
+            memory_gb = None
+            try:
+                memory_gb = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / (1024 ** 3) * 0.8
+            except (ValueError, OSError, AttributeError):
+                pass
+
+            return {
+                'slots': max(1, int(self._get_app_setting('queue_cpu_slots', default_if_none=1))),
+                'cpu_threads': max(1, int(self._get_app_setting('queue_cpu_threads',
+                                                                default_if_none=os.cpu_count() or 1))),
+                'memory_gb': self._get_app_setting('queue_cpu_memory_gb', default_if_none=memory_gb)
+            }
+
+        # for other devices (cuda etc.), we only count the slots
+        return {
+            'slots': max(1, int(self._get_app_setting('queue_gpu_slots', default_if_none=1))),
+            'cpu_threads': None,
+            'memory_gb': None
+        }
+
+    def get_item_resources(self, item: dict) -> dict:
+        """
+        This returns the resources an item needs on its device,
+        depending on its tasks (see task_resource_budgets),
+        unless the item has its own cpu_threads or memory_gb budget
+        """
+
+        tasks = item.get('tasks', None) or []
+        if isinstance(tasks, str):
+            tasks = [tasks]
+
+        # the item needs enough resources for its biggest task
+        task_budgets = [self.task_resource_budgets.get(task, self.task_resource_budgets['default']) for task in tasks] \
+            or [self.task_resource_budgets['default']]
+
+        cpu_threads = item.get('cpu_threads', None) or max([budget['cpu_threads'] for budget in task_budgets])
+        memory_gb = item.get('memory_gb', None) or max([budget['memory_gb'] for budget in task_budgets])
+
+        # an item should never need more than the whole device, otherwise it would never start
+        device_capacity = self.get_device_capacity(item.get('device', None))
+
+        if device_capacity['cpu_threads'] is not None:
+            cpu_threads = min(cpu_threads, device_capacity['cpu_threads'])
+
+        if device_capacity['memory_gb'] is not None:
+            memory_gb = min(memory_gb, device_capacity['memory_gb'])
+
+        return {'slots': 1, 'cpu_threads': cpu_threads, 'memory_gb': memory_gb}
+
+    def is_device_available(self, device, resources: dict = None):
+        """
+        This function checks if a device has enough free resources for an item
+        by looking at the resources of the items in the queue_threads dict.
         There's no way, of course, to know if the device is busy with some other process,
         but this helps keep the queue running smoothly internally.
+
+        :param device: the device to check
+        :param resources: the resources the item needs (see get_item_resources) - if None, we only check the slots
         """
 
-        # if the device is in the queue_threads dict, it's busy
-        if device in self.queue_threads:
+        # remove the threads that finished so that their resources are free again
+        self._remove_finished_threads()
 
-            # check if the thread is still running
-            if self.queue_threads[device]['thread'].is_alive():
+        device_capacity = self.get_device_capacity(device)
 
-                # if it's still running, it's busy
-                return False
+        resources = resources or {'slots': 1}
+
+        # add up the resources used by the items that are running on the device
+        used_resources = {'slots': 0, 'cpu_threads': 0, 'memory_gb': 0}
+        for queue_thread in list(self.queue_threads.values()):
+
+            if queue_thread['device'] != device:
+                continue
+
+            for resource in used_resources:
+                used_resources[resource] += queue_thread['resources'].get(resource, None) or 0
 
-            # if it's not running, it's not busy so remove it from the queue_threads dict
-            else:
-                self.remove_thread_from_queue_threads(device)
+        # check if the item fits in what's left of each resource
+        for resource, capacity in device_capacity.items():
+
+            if capacity is None:
+                continue
+
+            if used_resources[resource] + (resources.get(resource, None) or 0) > capacity:
+                return False
 
         return True
 
@@ -1055,43 +1498,147 @@ class ProcessingQueue:
         This function checks if a queue item is in the queue_threads dict
         """
 
-        for device in self.queue_threads:
-            if queue_id == self.queue_threads[device]['queue_id']:
-                return True
-
-        return False
+        return queue_id in self.queue_threads
 
-    def save_queue_to_file(self):
+    @staticmethod
+    def _get_item_save_data(item: dict) -> dict:
         """
-        This function saves the queue history to the queue file
+        This returns the part of the queue item that we save to the queue file
         """
 
-        # get all the queue items
-        queue_items = self.queue_history
-
-        # if we don't have a list of queue items, create an empty one
-        if not isinstance(queue_items, list):
-            queue_items = []
-
         # we need to clean up the task_queue list before saving it to file
         # because we're unable to serialize the task_queue items with the thread objects
         # but, no worries, when we load the queue from file,
         # the add_to_queue function will dispatch the tasks again as needed
         # also, we don't need the output saved to the file
-        save_queue_items = []
-        for item in queue_items:
-            save_item = {k: v for k, v in item.items() if k not in ('task_queue', 'last_task', 'output')}
-            save_queue_items.append(save_item)
+        return {k: v for k, v in list(item.items()) if k not in ('task_queue', 'last_task', 'output')}
 
-        # save the queue items to the queue json file
-        try:
-            with open(QUEUE_FILE_PATH, 'w') as f:
-                json.dump(save_queue_items, f, indent=4)
+    def save_queue_soon(self, queue_id=None, full=False):
+        """
+        This lets the background writer know that the queue item (or the whole queue) needs to be saved.
+        The changes are written to the queue journal file after queue_save_delay seconds,
+        so many updates of the same item (for eg. progress updates) end up in a single write.
+
+        :param queue_id: the queue id of the item that changed
+        :param full: if True, the whole queue file will be saved (for eg. when the order of the items changed)
+        """
+
+        with self._queue_file_lock:
+
+            if queue_id is not None:
+                self._queue_items_to_save.add(queue_id)
+
+            if full:
+                self._queue_needs_full_save = True
+
+            # start the background writer if it's not running
+            if self._queue_save_thread is None or not self._queue_save_thread.is_alive():
+                self._queue_save_thread = Thread(target=self._queue_save_worker, daemon=True)
+                self._queue_save_thread.start()
+
+        self._queue_save_event.set()
+
+    def _queue_save_worker(self):
+        """
+        This runs in the background and writes the queue changes to disk when it's triggered
+        """
+
+        while True:
+
+            self._queue_save_event.wait()
+
+            # wait a bit so that more changes can pile up before we write them
+            time.sleep(self.queue_save_delay)
+
+            self._queue_save_event.clear()
+
+            self.flush_queue_to_file()
+
+    def flush_queue_to_file(self):
+        """
+        This writes all the queue changes that weren't written yet to disk.
+        The changed items are appended to the queue journal file
+        and the whole queue file is saved once the journal gets too long (or if the order of the items changed).
+        """
+
+        with self._queue_file_lock:
+
+            queue_ids = self._queue_items_to_save
+            self._queue_items_to_save = set()
+
+            if not queue_ids and not self._queue_needs_full_save:
                 return True
 
-        except Exception as e:
-            logger.error('Could not save queue to file: {}'.format(e))
-            return False
+            # save the whole queue file if we need to,
+            # or if the journal would get too long
+            if self._queue_needs_full_save \
+                    or self._queue_journal_lines + len(queue_ids) > self.queue_journal_max_lines:
+                return self.save_queue_to_file()
+
+            try:
+                journal_lines = []
+                for queue_id in queue_ids:
+
+                    # the item might have been removed from the history in the meantime
+                    if (item := self.get_item(queue_id=queue_id)) is None:
+                        continue
+
+                    journal_lines.append(json.dumps(self._get_item_save_data(item)) + '\n')
+
+                with open(QUEUE_JOURNAL_FILE_PATH, 'a') as f:
+                    f.writelines(journal_lines)
+
+                self._queue_journal_lines += len(journal_lines)
+
+                return True
+
+            except Exception as e:
+                logger.error('Could not save queue changes to file: {}'.format(e))
+
+                # try again next time
+                self._queue_items_to_save.update(queue_ids)
+                return False
+
+    def save_queue_to_file(self):
+        """
+        This function saves the queue history to the queue file and empties the queue journal file
+        """
+
+        with self._queue_file_lock:
+
+            # get all the queue items
+            queue_items = self.queue_history
+
+            # if we don't have a list of queue items, create an empty one
+            if not isinstance(queue_items, list):
+                queue_items = []
+
+            # whatever changed until now will be in the queue file
+            self._queue_items_to_save = set()
+            self._queue_needs_full_save = False
+
+            # save the queue items to the queue json file
+            try:
+                save_queue_items = [self._get_item_save_data(item) for item in list(queue_items)]
+
+                # write to a temporary file first, so we never end up with half a queue file
+                temp_file_path = '{}.tmp'.format(QUEUE_FILE_PATH)
+                with open(temp_file_path, 'w') as f:
+                    json.dump(save_queue_items, f, indent=4)
+
+                os.replace(temp_file_path, QUEUE_FILE_PATH)
+
+                # the journal is not needed anymore, since all the changes are in the queue file now
+                with open(QUEUE_JOURNAL_FILE_PATH, 'w'):
+                    pass
+
+                self._queue_journal_lines = 0
+
+                return True
+
+            except Exception as e:
+                logger.error('Could not save queue to file: {}'.format(e))
+                return False
 
     def load_queue_from_file(self):
         """
@@ -1109,6 +1656,41 @@ class ProcessingQueue:
         except Exception as e:
             logger.error('Could not load queue from file: {}'.format(e))
 
+        if not isinstance(queue_history, list):
+            queue_history = []
+
+        # apply the changes from the journal file (if any) on top of the queue file
+        try:
+            if os.path.exists(QUEUE_JOURNAL_FILE_PATH):
+
+                # the positions of the items in the queue history by their queue id
+                item_indexes = {item['queue_id']: index for index, item in enumerate(queue_history)
+                                if isinstance(item, dict) and 'queue_id' in item}
+
+                with open(QUEUE_JOURNAL_FILE_PATH, 'r') as f:
+                    for line in f:
+
+                        try:
+                            item = json.loads(line)
+
+                        # the last line might be incomplete if the app was closed while writing it
+                        except json.decoder.JSONDecodeError:
+                            continue
+
+                        if not isinstance(item, dict) or 'queue_id' not in item:
+                            continue
+
+                        # each line contains the whole item, so it replaces the previous version
+                        if item['queue_id'] in item_indexes:
+                            queue_history[item_indexes[item['queue_id']]] = item
+
+                        else:
+                            item_indexes[item['queue_id']] = len(queue_history)
+                            queue_history.append(item)
+
+        except Exception as e:
+            logger.error('Could not load queue changes from file: {}'.format(e))
+
         return queue_history
 
     def resume_queue_from_file(self):
@@ -1141,6 +1723,7 @@ class ProcessingQueue:
                     # removing this will make sure we don't add it next time we save the queue file
                     if not self.toolkit_ops_obj.stAI.get_app_setting('queue_ignore_finished', True):
                         self.queue_history.pop(idx)
+                        self._index_queue_history()
 
                     continue
 
@@ -1170,6 +1753,9 @@ class ProcessingQueue:
 
                     queue_empty = False
 
+            # save the whole queue file now, so we start with an empty journal
+            self.save_queue_soon(full=True)
+
             # once we finished re-building the queue, we need to ping it
             # it's important to ping it after we're done adding all items to the queue
             # since some items that depend on others might fail if they can't find the other items
@@ -0,0 +1,587 @@
+import pickle
+import atexit
+import argparse
+import multiprocessing
+from threading import Thread, RLock, Condition, current_thread
+
+from storytoolkitai.core.logger import *
+
+import torch
+
+from .processing_queue import ProcessingQueue
+from .transcription import Transcription
+from .projects import Project
+
+
+class QueueWorkerPool:
+    """
+    This runs the processing queue items in separate worker processes instead of threads in the app process,
+    so that the heavy tasks (transcriptions, video indexing etc.) don't compete with the UI for the GIL.
+
+    Each worker builds its own headless ToolkitOps object when it starts and keeps it until it's stopped,
+    so the models loaded by the tasks (whisper, clip etc.) stay in memory between the items it runs.
+
+    The workers send the item changes (status, progress, output etc.) and the observer notifications
+    back to the app over a pipe, where they're applied to the queue history.
+    The app sends the cancel requests to the workers over the same pipe.
+
+    If a worker crashes, only the item it was running fails - the next item will start a new worker.
+    """
+
+    def __init__(self, processing_queue, max_workers=1):
+        """
+        :param processing_queue: the app's processing queue, which receives the item changes from the workers
+        :param max_workers: the max number of worker processes
+        """
+
+        self.processing_queue = processing_queue
+
+        self.max_workers = max_workers
+
+        # the worker processes
+        # each worker is a dict with the process, the app's end of the pipe,
+        # the device and the tasks of the last item it ran (to reuse the workers that already have the models loaded)
+        # and whether it's running an item now
+        self._workers = []
+        self._workers_condition = Condition(RLock())
+
+        # spawn the workers (instead of forking) since the app process has threads running and might use cuda
+        self._mp_context = multiprocessing.get_context('spawn')
+
+        # this is set to False if the workers can't start in this environment,
+        # so the queue goes back to running items in threads
+        self.available = True
+
+        # how often (in seconds) the item thread checks if the item was canceled or if the worker is still alive
+        self.poll_interval = 0.2
+
+        # how long to wait for the workers to stop when the app closes
+        self.stop_timeout = 5
+
+        atexit.register(self.shutdown)
+
+    def run_item(self, item: dict, resources: dict = None):
+        """
+        This sends the item to a worker and waits until the worker is done with it,
+        while applying the changes that the worker sends to the queue history.
+        This is meant to be called from the item's thread.
+
+        :param item: the queue item
+        :param resources: the resources the item reserved on its device (see ProcessingQueue.get_item_resources)
+        :return: True if all the tasks were executed, False if not,
+                 or None if no worker could run the item (so it should run in the app process)
+        """
+
+        queue_id = item['queue_id']
+
+        try:
+            worker = self._acquire_worker(device=item.get('device', None), tasks=item.get('tasks', None))
+
+        except Exception as e:
+            logger.error('Could not start queue worker: {}. Running queue items in the app process instead.'
+                         .format(e))
+
+            self.available = False
+            return None
+
+        # the worker dispatches the tasks again, since we can't send the task functions to another process,
+        # and the data of the dependencies was already passed to the item, so the worker doesn't need them
+        item_data = self.get_picklable_data(item, exclude=('task_queue', 'dependencies'))
+
+        cancel_sent = False
+
+        try:
+            worker['connection'].send(('run', item_data, resources or {}))
+
+            while True:
+
+                # let the worker know if the item was canceled in the meantime
+                if not cancel_sent and self.processing_queue.get_status(queue_id=queue_id) in ['canceling', 'canceled']:
+                    worker['connection'].send(('cancel', queue_id))
+                    cancel_sent = True
+
+                if not worker['connection'].poll(self.poll_interval):
+
+                    # if the worker stopped without letting us know, the loop below will get EOFError,
+                    # but only if there's nothing left in the pipe
+                    if not worker['process'].is_alive() and not worker['connection'].poll():
+                        raise EOFError
+
+                    continue
+
+                message = worker['connection'].recv()
+
+                if message[0] == 'ready':
+                    logger.debug('Queue worker {} is ready.'.format(worker['process'].pid))
+
+                elif message[0] == 'update':
+                    self._apply_item_changes(*message[1:])
+
+                elif message[0] == 'notify':
+                    self._forward_notification(item_queue_id=queue_id, action=message[1])
+
+                elif message[0] == 'done':
+
+                    # the worker saved everything before it let us know it's done
+                    self._reload_changed_files(queue_id=queue_id)
+
+                    self._release_worker(worker, device=item.get('device', None), tasks=item.get('tasks', None))
+
+                    return message[2]
+
+                elif message[0] == 'init_failed':
+                    logger.error('Queue worker could not start: {}. Running queue items in the app process instead.'
+                                 .format(message[1]))
+
+                    # don't try to start more workers if they can't start
+                    self.available = False
+                    self._discard_worker(worker)
+
+                    return None
+
+        except (EOFError, OSError, ValueError):
+
+            # wait a moment for the process to end, so we know its exit code
+            worker['process'].join(timeout=1)
+
+            logger.error('The queue worker running item {} stopped unexpectedly (exit code {}).'
+                         .format(queue_id, worker['process'].exitcode))
+
+            self._discard_worker(worker)
+
+            fail_error = 'The worker process stopped unexpectedly.'
+            self.processing_queue.update_status(queue_id=queue_id, status='failed', fail_error=fail_error)
+
+            # notify on_stop observers
+            if (item := self.processing_queue.get_item(queue_id=queue_id)) is not None:
+                self.processing_queue._notify_on_stop_observer(item=item)
+
+            return False
+
+    def _acquire_worker(self, device, tasks):
+        """
+        This returns an idle worker (preferably one that already ran the same tasks on the same device)
+        or starts a new one, if there are less than max_workers.
+        Otherwise, it waits until one of the workers is done.
+        """
+
+        with self._workers_condition:
+
+            while True:
+
+                # forget the idle workers that stopped
+                for worker in [worker for worker in self._workers
+                               if not worker['busy'] and not worker['process'].is_alive()]:
+                    self._discard_worker(worker)
+
+                idle_workers = [worker for worker in self._workers if not worker['busy']]
+
+                # the workers that have the models for these tasks loaded go first
+                idle_workers.sort(key=lambda worker: (worker['device'] != device, worker['tasks'] != tasks))
+
+                if idle_workers:
+                    worker = idle_workers[0]
+
+                elif len(self._workers) < max(1, self.max_workers):
+                    worker = self._start_worker()
+                    self._workers.append(worker)
+
+                else:
+                    self._workers_condition.wait(timeout=1)
+                    continue
+
+                worker['busy'] = True
+
+                return worker
+
+    def _release_worker(self, worker, device=None, tasks=None):
+
+        with self._workers_condition:
+
+            worker['busy'] = False
+            worker['device'] = device
+            worker['tasks'] = tasks
+
+            self._workers_condition.notify_all()
+
+    def _start_worker(self):
+        """
+        This starts a new worker process and returns the worker dict
+        """
+
+        app_connection, worker_connection = self._mp_context.Pipe(duplex=True)
+
+        # the workers are not daemonic because some tasks start their own process pools
+        # (they stop by themselves when the app's end of the pipe is closed)
+        process = self._mp_context.Process(
+            target=queue_worker_main, args=(worker_connection,), name='StoryToolkitAI queue worker', daemon=False)
+
+        process.start()
+
+        # the app only needs its own end of the pipe
+        worker_connection.close()
+
+        logger.debug('Started queue worker {}.'.format(process.pid))
+
+        return {'process': process, 'connection': app_connection, 'device': None, 'tasks': None, 'busy': False}
+
+    def _discard_worker(self, worker):
+        """
+        This removes the worker from the pool and makes sure its process is stopped
+        """
+
+        with self._workers_condition:
+
+            if worker in self._workers:
+                self._workers.remove(worker)
+
+            try:
+                worker['connection'].close()
+            except OSError:
+                pass
+
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+
+            self._workers_condition.notify_all()
+
+    def shutdown(self):
+        """
+        This stops all the workers (it's called when the app exits)
+        """
+
+        with self._workers_condition:
+            workers = list(self._workers)
+
+        for worker in workers:
+            try:
+                worker['connection'].send(('stop',))
+            except (OSError, ValueError):
+                pass
+
+        for worker in workers:
+
+            worker['process'].join(timeout=self.stop_timeout)
+
+            self._discard_worker(worker)
+
+    @staticmethod
+    def get_picklable_data(item: dict, exclude=()) -> dict:
+        """
+        This returns the part of the item that can be sent to another process
+        """
+
+        item_data = {}
+
+        for key, value in list(item.items()):
+
+            if not isinstance(key, str) or key in exclude:
+                continue
+
+            try:
+                pickle.dumps(value)
+
+            except Exception:
+                logger.debug('Not sending {} of queue item {} to the worker.'.format(key, item.get('queue_id', None)))
+                continue
+
+            item_data[key] = value
+
+        return item_data
+
+    def _apply_item_changes(self, queue_id, changed_data: dict, removed_keys: list, save_to_file=True):
+        """
+        This applies the item changes sent by a worker to the item in the app's queue history
+        """
+
+        if (item := self.processing_queue.get_item(queue_id=queue_id)) is None:
+            return
+
+        for key in removed_keys:
+            item.pop(key, None)
+
+        # the values are sent pickled, so the worker can compare them with what it sent before
+        changed_data = {key: pickle.loads(value) for key, value in changed_data.items()}
+
+        self.processing_queue.update_queue_item(queue_id=queue_id, save_to_file=save_to_file, **changed_data)
+
+    def _forward_notification(self, item_queue_id, action):
+        """
+        This notifies the observers in the app process about an action that happened in a worker
+        """
+
+        self._reload_changed_files(queue_id=item_queue_id, action=action)
+
+        self.processing_queue.toolkit_ops_obj.notify_observers(action)
+
+    def _reload_changed_files(self, queue_id, action=None):
+        """
+        The workers save the transcriptions and projects they changed,
+        so we need to reload them in the app process too, if they're loaded here.
+        The ones that have unsaved changes in the app process are not reloaded.
+        """
+
+        item = self.processing_queue.get_item(queue_id=queue_id) or {}
+
+        transcription_file_paths = list(item.get('transcription_file_paths', None) or [])
+        if item.get('transcription_file_path', None):
+            transcription_file_paths.append(item['transcription_file_path'])
+
+        transcription_path_ids = {Transcription.get_transcription_path_id(transcription_file_path=file_path)
+                                  for file_path in transcription_file_paths if isinstance(file_path, str)}
+
+        # for eg. update_transcription_{path_id} or update_transcription_groups_{path_id}
+        if action is not None and action.startswith('update_transcription_'):
+            transcription_path_ids.add(action.rsplit('_', 1)[-1])
+
+        for transcription_path_id in transcription_path_ids:
+
+            if transcription_path_id not in Transcription._instances:
+                continue
+
+            transcription = Transcription._instances.get(transcription_path_id)
+
+            if transcription is None or transcription.is_dirty() or transcription._save_timer is not None:
+                continue
+
+            transcription.reload_from_file()
+
+        # the transcriptions might have been linked to projects
+        if action is None or action == 'project_changed':
+
+            for project in list(Project._instances.values()):
+
+                if project.is_dirty or project._save_timer is not None:
+                    continue
+
+                project.load_from_path(project_path=project.project_path)
+
+
+class WorkerProcessingQueue(ProcessingQueue):
+    """
+    This is the processing queue used inside the queue worker processes.
+    It only holds the item the worker is running and it sends the item changes to the app over the pipe,
+    instead of saving them to the queue file.
+    """
+
+    def __init__(self, toolkit_ops_obj=None, connection=None):
+
+        super().__init__(toolkit_ops_obj=toolkit_ops_obj)
+
+        self.connection = connection
+        self._connection_lock = RLock()
+
+        # the item data that was last sent to the app (pickled values by key),
+        # so that we only send what changed
+        self._sent_item_data = {}
+
+    def send(self, message):
+
+        with self._connection_lock:
+
+            try:
+                self.connection.send(message)
+
+            except (OSError, ValueError) as e:
+                logger.error('Could not send message to the app: {}'.format(e))
+
+    def update_queue_item(self, queue_id, save_to_file=True, **kwargs):
+
+        new_item = super().update_queue_item(queue_id, save_to_file=save_to_file, **kwargs)
+
+        if new_item:
+            self._send_item_changes(queue_id=queue_id, keys=list(kwargs.keys()), save_to_file=save_to_file)
+
+        return new_item
+
+    def _send_item_changes(self, queue_id, keys, save_to_file=True):
+        """
+        This sends the values that changed since the last time to the app
+        """
+
+        item = self.get_item(queue_id=queue_id)
+
+        sent_data = self._sent_item_data.setdefault(queue_id, {})
+
+        changed_data = {}
+        for key in keys:
+
+            # the app takes care of its own update timestamps
+            if key in ('queue_id', 'task_queue', 'last_update') or key not in item:
+                continue
+
+            try:
+                pickled_value = pickle.dumps(item[key])
+            except Exception:
+                continue
+
+            if sent_data.get(key, None) != pickled_value:
+                sent_data[key] = pickled_value
+                changed_data[key] = pickled_value
+
+        # for eg. update_status removes the progress
+        removed_keys = [key for key in sent_data if key not in item]
+        for key in removed_keys:
+            del sent_data[key]
+
+        if changed_data or removed_keys:
+            self.send(('update', queue_id, changed_data, removed_keys, save_to_file))
+
+    def forward_notification(self, action):
+        """
+        This replaces the notify_observers method of the worker's toolkit ops object,
+        so that the observers in the app get notified instead
+        """
+
+        # the app's queue notifies these by itself when it applies the changes
+        if action in ('update_queue_item', 'update_queue'):
+            return
+
+        # the observers might read the files, so save them first
+        self.save_pending_files()
+
+        self.send(('notify', action))
+
+    @staticmethod
+    def save_pending_files():
+        """
+        This saves the transcriptions and projects that are waiting for their save timers right away
+        """
+
+        for instance in Transcription._instances.values() + list(Project._instances.values()):
+
+            if getattr(instance, '_save_timer', None) is not None:
+                instance.save_soon(sec=0)
+
+    def run_item(self, item_data: dict, resources: dict):
+        """
+        This executes the tasks of an item that was sent by the app
+        """
+
+        queue_id = item_data['queue_id']
+
+        item = dict(item_data)
+        item['task_queue'] = self.task_dispatcher(tasks=item.get('tasks', None))
+
+        self._add_to_queue_history(item)
+
+        # this is what the app already knows about the item
+        self._sent_item_data[queue_id] = {key: pickle.dumps(value) for key, value in item_data.items()}
+
+        self.add_thread_to_queue_threads(
+            device=item.get('device', None), queue_id=queue_id, thread=current_thread(), resources=resources)
+
+        # limit the number of threads torch uses in this process to the item's budget
+        # (this is process-wide, but the worker only runs one item at a time, see QueueWorkerPool._acquire_worker)
+        if item.get('device', None) == 'cpu' and resources.get('cpu_threads', None):
+            torch.set_num_threads(int(resources['cpu_threads']))
+
+        executed = False
+
+        try:
+            executed = self.execute_item_tasks(**item)
+
+        except Exception:
+            logger.error('Unable to execute tasks for queue item {}'.format(queue_id), exc_info=True)
+            self.update_status(queue_id=queue_id, status='failed')
+
+        finally:
+
+            self.remove_thread_from_queue_threads(queue_id=queue_id)
+
+            # make sure that the app can read the results
+            self.save_pending_files()
+
+            # the worker only keeps the item while it's running it
+            self.queue_history = [queue_item for queue_item in self.queue_history if queue_item is not item]
+            self._sent_item_data.pop(queue_id, None)
+
+            self.send(('done', queue_id, bool(executed)))
+
+    def cancel_from_app(self, queue_id):
+        """
+        This sets the item to 'canceling', so that the tasks stop when they check for it
+        """
+
+        if self.get_status(queue_id=queue_id) not in [None, 'done', 'failed', 'canceled', 'canceling']:
+            self.set_to_canceled(queue_id=queue_id)
+
+    def serve(self):
+        """
+        This runs the items that the app sends until the app closes the pipe or asks the worker to stop
+        """
+
+        self.send(('ready',))
+
+        while True:
+
+            try:
+                message = self.connection.recv()
+
+            # the app closed the pipe
+            except (EOFError, OSError):
+                break
+
+            if message[0] == 'run':
+                # the items run in their own thread, so we can still receive cancel requests
+                # (it's a daemon thread, so the worker doesn't wait for it if the app is gone)
+                Thread(target=self.run_item, args=message[1:], daemon=True).start()
+
+            elif message[0] == 'cancel':
+                self.cancel_from_app(queue_id=message[1])
+
+            elif message[0] == 'stop':
+                break
+
+        # don't lose the changes that are waiting for their save timers
+        self.save_pending_files()
+
+    def ping_queue(self):
+        # the worker doesn't schedule items, the app does
+        return False
+
+    def save_queue_soon(self, queue_id=None, full=False):
+        # the app saves the queue
+        return None
+
+    def flush_queue_to_file(self):
+        return True
+
+    def save_queue_to_file(self):
+        return True
+
+
+def queue_worker_main(connection):
+    """
+    This is the main function of the queue worker processes.
+    It builds a headless ToolkitOps object (which keeps the models loaded between items)
+    and then runs the items that the app sends.
+    """
+
+    try:
+        from storytoolkitai.core.storytoolkitai import StoryToolkitAI
+        from storytoolkitai.core.toolkit_ops.toolkit_ops import ToolkitOps
+
+        # the worker runs like the CLI (no update checks, no API thread, no queue resume)
+        worker_args = argparse.Namespace(mode='cli', skip_update_check=True, force_update_check=False)
+
+        stAI = StoryToolkitAI(args=worker_args)
+
+        toolkit_ops_obj = ToolkitOps(stAI=stAI, disable_resolve_api=True)
+
+        worker_queue = WorkerProcessingQueue(toolkit_ops_obj=toolkit_ops_obj, connection=connection)
+
+        toolkit_ops_obj.processing_queue = worker_queue
+        toolkit_ops_obj.notify_observers = worker_queue.forward_notification
+
+    except Exception as e:
+        logger.error('Could not start queue worker.', exc_info=True)
+
+        try:
+            connection.send(('init_failed', str(e)))
+        except (OSError, ValueError):
+            pass
+
+        return
+
+    worker_queue.serve()
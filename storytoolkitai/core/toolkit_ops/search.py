@@ -1,25 +1,33 @@
 import os
+import sys
 import time
 import json
 import re
 import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 from typing import List, Union, Callable
 from torch import nn, Tensor, device
 import numpy as np
 from numpy import ndarray
 
-import pickle
+from threading import Lock
+
+from filelock import FileLock
 
 from storytoolkitai.core.logger import logger
 from sentence_transformers import SentenceTransformer, util
 from sentence_transformers.SentenceTransformer import logging, batch_to_device, trange
 import torch
 
-from .transcription import Transcription, TranscriptionSegment, TranscriptionUtils
+from .transcription import Transcription, TranscriptionSegment, TranscriptionReader
 from .textanalysis import TextAnalysis
+from . import search_corpus
+from .instance_registry import InstanceRegistry
 
 from .videoanalysis import ClipIndex, cv2
+from .video_index_manifest import VideoIndexManifest
 
 
 class ToolkitSearch:
@@ -47,8 +55,8 @@ class ToolkitSearch:
 
 class SearchItem(ToolkitSearch):
 
-    # we'll use this dict to store all the search items
-    _instances = {}
+    # we'll use this registry to store the search items
+    _instances = InstanceRegistry(name='search_items')
 
     def __new__(cls, **kwargs):
 
@@ -61,14 +69,17 @@ class SearchItem(ToolkitSearch):
             search_file_path_id = cls.get_search_file_path_id(kwargs.get('search_file_paths', None))
 
         # now look to see if this search item already exists in the instances
-        if search_file_path_id is not None and search_file_path_id in cls._instances:
-            return cls._instances[search_file_path_id]
+        if search_file_path_id is not None \
+                and (instance := cls._instances.get(search_file_path_id)) is not None:
+            return instance
 
         # otherwise we create a new instance
         instance = super().__new__(cls)
 
-        # and we store it in the instances dict
-        cls._instances[search_file_path_id] = instance
+        # and we store it in the instances registry
+        # (the size of the search files is a rough estimate of how much memory the search item will use)
+        cls._instances.put(
+            search_file_path_id, instance, size=InstanceRegistry.file_size(kwargs.get('search_file_paths', None)))
 
         # then we return the instance
         return instance
@@ -81,12 +92,12 @@ class SearchItem(ToolkitSearch):
         in the instances dict
         """
 
-        # remove the old search_file_path_id from the instances dict
-        if old_search_file_path_id in self._instances:
-            del self._instances[old_search_file_path_id]
+        # remove the old search_file_path_id from the instances registry
+        self._instances.remove(old_search_file_path_id, instance=self)
 
-        # add the new search_file_path_id to the instances dict
-        self._instances[self._search_file_path_id] = self
+        # add the new search_file_path_id to the instances registry
+        self._instances.put(
+            self._search_file_path_id, self, size=InstanceRegistry.file_size(self._search_file_paths))
 
     def __init__(self, toolkit_ops_obj, **kwargs):
 
@@ -247,7 +258,10 @@ class TextSearch(SearchItem):
     This is used for text searches
     """
 
-    _instances = {}
+    _instances = InstanceRegistry(name='text_searches')
+
+    # we only use a process pool to extract the phrases if we need to process at least this many files
+    min_files_for_process_pool = 16
 
     def __init__(self, **kwargs):
 
@@ -270,20 +284,37 @@ class TextSearch(SearchItem):
 
         self._embedder = None
 
-        # for caching we use the hash of the search corpus in the name of the cache file
-        # this means that if the search corpus changes, the cache file will be different
-        # but it also means that no matter which file paths are used for the search,
-        # the cache file will be the same given the same search corpus
-        self._search_corpus_hash = None
+        # the embeddings are cached per phrase (see TextEmbeddingCache),
+        # so if only a few phrases of the search corpus change, only those will need to be encoded again
+        # and no matter which file paths are used for the search, the same phrases will use the same embeddings
+        self._embedding_cache = None
 
         self._search_corpus_cache_dir = kwargs.get('search_corpus_cache_dir', None)
-        self.corpus_cache_file_path = kwargs.get('corpus_cache_file_path', None)
 
         self._use_analyzer = kwargs.get('use_analyzer', False)
 
         self._use_embedding_cache = kwargs.get('use_embedding_cache', True)
         self._use_analyzer_cache = kwargs.get('use_analyzer_cache', True)
 
+        # the phrases extracted from each file are cached using the file's modification time and size
+        self._use_corpus_cache = kwargs.get('use_corpus_cache', True)
+
+        # for large corpora we can use an approximate nearest neighbour index instead of scoring every phrase
+        # (if this is None, we'll use the index only if search_ann_min_corpus_size is set in the config
+        # and the corpus is larger than that)
+        self._use_ann_index = kwargs.get('use_ann_index', None)
+        self._ann_index = None
+
+        # the hashes of the corpus phrases and the key of the ann index (calculated once for each corpus)
+        self._search_corpus_phrase_hashes = None
+        self._ann_index_key = None
+
+        # this is True if the last search used the ann index, so the results might be incomplete
+        self.last_search_approximate = False
+
+        # the inverse norms of the corpus embeddings (see _get_inverse_norms)
+        self._search_embeddings_inverse_norms = None
+
         # if there is a search corpus cache directory set in the config, use that
         default_search_cache_dir = \
             self.stAI.get_app_setting(setting_name='default_search_cache_dir', default_if_none='')
@@ -367,32 +398,78 @@ class TextSearch(SearchItem):
             # sort the search file paths alphabetically
             search_file_paths.sort()
 
-            # take each file path and load the search data
+            # the phrases and the association of each file
+            # (the association indexes are relative to the phrases of the file)
+            file_corpus_data = {}
+
+            # the files that weren't found in the cache
+            uncached_file_paths = []
+
             for s_file_path in search_file_paths:
 
-                # decide what to do based on the file extension
+                # if there is an exact file with the .transcription.json extension in the search file paths
+                # skip the text file
+                # todo: check if it's the same as the current file by comparing the text with the segments' text
+                #  do a length comparison first, then if the length is the same, do a character comparison
+                #  but remove all the spaces and the punctuation marks first when doing the comparisons
+                # (we're making the assumption that said .txt file might have been saved with the transcription file)
+                if s_file_path.endswith('.txt') \
+                        and s_file_path.replace('.txt', '.transcription.json') in search_file_paths:
+                    logger.debug('Skipping {}. Transcription file counterpart is included '
+                                 'in the current file list.'.format(s_file_path))
+                    continue
+
+                # use the phrases from the cache if the file hasn't changed since it was cached
+                cached_corpus_data = search_corpus.load_file_cache(
+                    self._search_corpus_cache_dir, s_file_path, **self._get_corpus_cache_options()) \
+                    if self._use_corpus_cache else None
+
+                if cached_corpus_data is not None:
+                    file_corpus_data[s_file_path] = cached_corpus_data
+                else:
+                    uncached_file_paths.append(s_file_path)
+
+            logger.debug('Using cached phrases for {} files, extracting phrases from {} files.'
+                         .format(len(file_corpus_data), len(uncached_file_paths)))
+
+            # TextAnalysis needs spaCy, so we're running it only in this process
+            if ta is not None:
+                for s_file_path in uncached_file_paths:
+                    file_corpus_data[s_file_path] = self._process_file(s_file_path, text_analysis=ta)
+
+            else:
+                file_corpus_data.update(self._process_files_in_pool(uncached_file_paths))
+
+            # cache the phrases of the files we just processed
+            if self._use_corpus_cache:
+                for s_file_path in uncached_file_paths:
+                    if s_file_path in file_corpus_data:
+                        search_corpus.save_file_cache(
+                            self._search_corpus_cache_dir, s_file_path, *file_corpus_data[s_file_path],
+                            **self._get_corpus_cache_options())
 
-                # if it's TRANSCRIPTION FILE
-                if s_file_path.endswith('.transcription.json'):
+            # now add the phrases of each file to the search corpus (in the same order as the files)
+            for s_file_path in search_file_paths:
 
-                    search_corpus_phrases, search_corpus_assoc \
-                        = self._process_transcription_file(s_file_path, search_corpus_phrases, search_corpus_assoc,
-                                                           text_analysis=ta)
+                if s_file_path not in file_corpus_data:
+                    continue
 
-                # if it's a TEXT FILE
-                elif s_file_path.endswith('.txt'):
+                file_phrases, file_assoc = file_corpus_data[s_file_path]
 
-                    search_corpus_phrases, search_corpus_assoc \
-                        = self._process_text_file(s_file_path, search_corpus_phrases, search_corpus_assoc,
-                                                  search_file_paths)
+                # the association indexes are relative to the file phrases,
+                # so we need to offset them by the number of phrases already in the corpus
+                corpus_offset = len(search_corpus_phrases)
 
-                # if it's a PROJECT FILE
-                elif s_file_path.endswith('project.json'):
+                search_corpus_phrases.extend(file_phrases)
 
-                    search_corpus_phrases, search_corpus_assoc = \
-                        self._process_project_file(s_file_path, search_corpus_phrases, search_corpus_assoc)
+                for file_phrase_idx, phrase_assoc in file_assoc.items():
+                    search_corpus_assoc[corpus_offset + file_phrase_idx] = phrase_assoc
 
         self._search_corpus_phrases = search_corpus_phrases
+
+        # the phrases changed, so their hashes need to be calculated again
+        self._search_corpus_phrase_hashes = None
+        self._ann_index_key = None
         self._search_corpus_assoc = search_corpus_assoc
 
         # flag that the search corpus has been prepared
@@ -400,6 +477,81 @@ class TextSearch(SearchItem):
 
         return self._search_corpus_phrases, self._search_corpus_assoc
 
+    def _get_corpus_cache_options(self):
+        """
+        These are the options that change the phrases extracted from each file,
+        so they need to be part of the corpus cache key
+        """
+
+        return {
+            'use_analyzer': self._use_analyzer,
+            'min_phrase_length': self._get_min_phrase_length()
+        }
+
+    def _get_min_phrase_length(self):
+        return int(self.stAI.get_app_setting(setting_name='search_corpus_min_length', default_if_none=2))
+
+    def _process_file(self, file_path, text_analysis=None):
+        """
+        Extracts the phrases and the search corpus association from a single file, in this process
+        :return: a list of phrases and the search corpus association dict (with indexes relative to the phrases)
+        """
+
+        if file_path.endswith('.transcription.json') and text_analysis is not None:
+            return self._process_transcription_file(file_path, [], {}, text_analysis=text_analysis)
+
+        return search_corpus.process_file(file_path, min_phrase_length=self._get_min_phrase_length())
+
+    def _process_files_in_pool(self, file_paths: list):
+        """
+        Extracts the phrases and the search corpus association from multiple files using a process pool
+        (or in this process, if there are only a few files or if the pool is not available)
+
+        :return: a dict with the phrases and the search corpus association of each file
+        """
+
+        file_corpus_data = {}
+
+        if not file_paths:
+            return file_corpus_data
+
+        max_workers = int(self.stAI.get_app_setting(
+            setting_name='search_corpus_workers', default_if_none=max(1, min(8, (os.cpu_count() or 1) - 1))))
+
+        min_phrase_length = self._get_min_phrase_length()
+
+        # starting the processes takes a while, so it's only worth it for many files
+        # (also, the standalone version can't start new python processes like this)
+        if max_workers > 1 and len(file_paths) >= self.min_files_for_process_pool \
+                and not getattr(sys, 'frozen', False):
+
+            logger.debug('Extracting phrases from {} files using {} processes.'
+                         .format(len(file_paths), min(max_workers, len(file_paths))))
+
+            try:
+                # we're using spawn to avoid forking the threads of the app
+                with ProcessPoolExecutor(max_workers=min(max_workers, len(file_paths)),
+                                         mp_context=multiprocessing.get_context('spawn')) as executor:
+
+                    for file_path, file_data in zip(
+                            file_paths,
+                            executor.map(search_corpus.process_file, file_paths,
+                                         [min_phrase_length] * len(file_paths))):
+                        file_corpus_data[file_path] = file_data
+
+                return file_corpus_data
+
+            except Exception:
+                logger.warning('Could not extract phrases using multiple processes. Trying again in this process.',
+                               exc_info=True)
+
+                file_corpus_data = {}
+
+        for file_path in file_paths:
+            file_corpus_data[file_path] = self._process_file(file_path)
+
+        return file_corpus_data
+
     def _process_transcription_file(self, transcription_file_path, search_corpus_phrases, search_corpus_assoc,
                                     text_analysis=None):
 
@@ -426,10 +578,14 @@ class TextSearch(SearchItem):
                         = text_analysis.detect_language(''.join(
                         [segment.text for segment in transcription.get_segments()]))
 
-                    # if we know the language of the transcription
-                    if transcription_language is not None:
+                    # if we know the language of the transcription (and it's not the one that's already saved)
+                    if transcription_language is not None and transcription_language != transcription.language:
                         transcription.set('language', transcription_language)
-                        transcription.save_soon()
+
+                        # save it right away, since the cached phrases of the file are only saved after this
+                        # and they're keyed by the modification time of the file
+                        # (a later save would make them look outdated)
+                        transcription.save_soon(sec=0)
 
                 else:
                     transcription_language = transcription.language
@@ -468,240 +624,11 @@ class TextSearch(SearchItem):
 
             # if we're not using the analyzer, just use the segments as they are
             else:
-                text_analysis = None
                 filtered_transcription_segments = segments_as_dict
 
-            transcription_file_path = transcription_file_path
-
-            logger.debug('Adding {} to the search corpus.'.format(transcription_file_path))
-
-            # does this transcription file contain timecodes?
-            timecode_data = transcription.get_timecode_data()
-
-            # group the segment texts into phrases using punctuation as dividers
-            # instead of how they're currently segmented
-            # once they are grouped, add them to the search corpus
-            # plus add them to the search corpus association list so we know
-            # from which transcription file and from which segment they came from originally
-
-            # initialize the current phrase and the previous phrase
-            current_phrase = ''
-            previous_phrase = ''
-
-            # loop through the segments of this transcription file
-            for segment_index, segment in enumerate(filtered_transcription_segments):
-
-                # skip speaker meta segments (but allow other meta segments, like notes)
-                if 'meta' in segment and segment['meta'] and 'category' in segment and segment['category'] == 'speaker':
-                    continue
-
-                filtered_segment_index = None
-
-                # if there is a segment index in the segment
-                # it means that these segments may have been filtered
-                if 'idx' in segment:
-
-                    # so let's use the first segment index as the segment index for the results
-                    filtered_segment_index = segment['idx'][0]
-
-                    # and if there is a filtered segment index, use that instead
-                    # note: all_lines is a list of all the lines that are connected to this segment
-                    # therefore, all_lines below will take this value too
-                    # (+1 on each index to compensate for line numbers)
-                    if filtered_segment_index is not None:
-                        segment_index = filtered_segment_index
-
-                # first remember the transcription file path and the segment index
-                # if this is a new phrase (i.e. the current phrase is empty)
-                if current_phrase == '':
-                    # this is the segment index relative to the whole search corpus that
-                    # contains all the transcription file segments (not just the current transcription file)
-                    general_segment_index = len(search_corpus_phrases)
-
-                    timecode = None \
-                        if not timecode_data \
-                        else TranscriptionUtils.seconds_to_timecode(
-                        segment['start'],
-                        transcription.timeline_fps, transcription.timeline_start_tc
-                    )
-
-                    search_corpus_assoc[general_segment_index] = {
-                        'transcription_file_path': transcription_file_path,
-                        'name': transcription.name
-                        if transcription.name else os.path.basename(transcription_file_path),
-                        'segment': segment['text'],
-                        'segment_index': segment_index,
-                        'start': segment['start'],
-                        'timecode': timecode,
-                        'all_lines': [int(segment_index) + 1]
-                        if 'idx' not in segment
-                        else [sgm + 1 for sgm in segment['idx']],
-                        'type': 'transcription'
-                    }
-
-                # otherwise, if this is not a new phrase
-                else:
-                    # just append the current segment index to the list of all lines
-                    search_corpus_assoc[general_segment_index]['all_lines'].append(
-                        int(segment_index) + 1)
-
-                # add the segment text to the current phrase
-                # but only if it's longer than 2 chars to avoid adding stuff that is meaningless
-                # like punctuation marks
-                if 'text' in segment and type(segment['text']) is str:
-
-                    # keep adding segments to the current phrase until we find a punctuation mark
-
-                    # first get the segment text
-                    segment_text = str(segment['text'])
-
-                    # add the segment to the current phrase
-                    current_phrase += segment_text.strip() + ' '
-
-                    # if a punctuation mark exists in the last 5 characters of the segment text
-                    # it means that the current phrase is complete
-                    # also split if this is a meta segment
-                    if re.search(r'[\.\?\!]{1}\s*$', segment_text[-5:])\
-                            or ('meta' in segment and segment['meta']):
-                        # "close" the current phrase by adding it to the search corpus
-                        search_corpus_phrases.append(current_phrase.strip())
-
-                        # and remember it as the previous phrase
-                        previous_phrase = current_phrase
-
-                        # then empty the current phrase
-                        current_phrase = ''
-
-            if transcription.transcript_groups:
-
-                # take each transcript group
-                for transcript_group in transcription.transcript_groups:
-                    general_segment_index = len(search_corpus_phrases)
-
-                    # and add the transcript group name and group notes to the search corpus association
-                    search_corpus_assoc[general_segment_index] = {
-                        'file_path': transcription_file_path,
-                        'transcription_name': transcription.name
-                        if transcription.name else os.path.basename(transcription_file_path),
-                        'type': 'transcript_group',
-                        'group_name': transcript_group
-                    }
-
-                    # and add the transcript group name to the search corpus phrases
-                    search_corpus_phrases.append(
-                        transcription.transcript_groups[transcript_group]['name']
-                        + ': '
-                        + transcription.transcript_groups[transcript_group]['notes']
-                    )
-
-        return search_corpus_phrases, search_corpus_assoc
-
-    def _process_text_file(self, text_file_path, search_corpus_phrases, search_corpus_assoc, search_file_paths):
-
-        # if there is an exact file with the .transcription.json extension in _search_file_paths
-        # todo: check if it's the same as the current file by comparing the text with the segments' text
-        #  do a length comparison first, then if the length is the same, do a character comparison
-        #  but remove all the spaces and the punctuation marks first when doing the comparisons
-        # (we're making the assumption that said .txt file might have been saved with the transcription file)
-
-        if text_file_path.replace('.txt', '.transcription.json') in search_file_paths:
-            # also remove it from the search file paths list
-            # search_file_paths.remove(text_file_path)
-
-            logger.debug('Skipping {}. Transcription file counterpart is included '
-                         'in the current file list.'.format(text_file_path))
-            return search_corpus_phrases, search_corpus_assoc
-
-        # first read the file
-        with open(text_file_path, 'r', encoding='utf-8') as f:
-            file_text = f.read()
-
-        # split the text into phrases using punctuation or double new lines as dividers
-        phrases = re.split(r'[\.\?\!]{1}\s+|[\.\?\!]{1}$|[\n]{2,}', file_text)
-
-        # then add each phrase to the search corpus
-        for phrase_index, phrase in enumerate(phrases):
-
-            # but only if it's longer than x characters
-            # to avoid adding stuff that is most likely meaningless
-            # like punctuation marks
-            if len(phrase) > self.stAI.get_app_setting(
-                    setting_name='search_corpus_min_length', default_if_none=2):
-
-                # remember the text file path and the phrase number
-                # this is the phrase index relative to the whole search corpus that
-                general_segment_index = len(search_corpus_phrases)
-
-                # add the phrase to the search corpus
-                search_corpus_phrases.append(phrase.strip())
-
-                # add the phrase to the search corpus association list
-                search_corpus_assoc[general_segment_index] = {'file_path': text_file_path,
-                                                              'text': phrase.strip(),
-                                                              'phrase_index': phrase_index,
-                                                              'type': 'text'
-                                                              }
-
-        return search_corpus_phrases, search_corpus_assoc
-
-    def _process_project_file(self, project_file_path, search_corpus_phrases, search_corpus_assoc):
-
-        # read it as a json file
-        with open(project_file_path, 'r', encoding='utf-8') as f:
-            project_file_data = json.load(f)
-
-        # first check if it contains the project name
-        if 'name' not in project_file_data or 'timelines' not in project_file_data:
-            logger.warning('Project file {} is not in the right format. Skipping.'
-                           .format(project_file_path))
-
-            return search_corpus_phrases, search_corpus_assoc
-
-        # take each timeline and add all its markers to the search corpus
-        for timeline_name in project_file_data['timelines']:
-
-            timeline = project_file_data['timelines'][timeline_name]
-
-            # if the timeline has markers
-            if 'markers' in timeline and type(timeline['markers']) is dict:
-
-                timeline_fps = timeline.get('timeline_fps', None)
-                timeline_start_tc = timeline.get('timeline_start_tc', None)
-
-                # loop through the markers
-                for marker in timeline['markers']:
-
-                    # add the marker name and note to the search corpus
-                    if timeline['markers'][marker].get('name', None) or timeline['markers'][marker].get('note', None):
-
-                        marker_name = timeline['markers'][marker].get('name', None) + '\n' \
-                            if timeline['markers'][marker].get('name', None) else ''
-
-                        marker_content = "{} {}".format(marker_name, timeline['markers'][marker].get('note', None))
-
-                        # don't add if it's empty
-                        if marker_content == " ":
-                            continue
-
-                        # add the marker name to the search corpus
-                        search_corpus_phrases.append(marker_content)
-
-                        # remember the project file path and the marker name
-                        # this is the marker index relative to the whole search corpus that
-                        general_segment_index = len(search_corpus_phrases)
-
-                        # add the marker to the search corpus association list
-                        search_corpus_assoc[general_segment_index] = {'file_path': project_file_path,
-                                                                      'text': marker_content,
-                                                                      'timeline': timeline_name,
-                                                                      'project': project_file_data[
-                                                                          'name'],
-                                                                      'timeline_fps': timeline_fps,
-                                                                      'timeline_start_tc': timeline_start_tc,
-                                                                      'marker_index': marker,
-                                                                      'type': 'marker'
-                                                                      }
-
+            search_corpus.process_transcription_segments(
+                transcription, transcription_file_path, filtered_transcription_segments,
+                search_corpus_phrases, search_corpus_assoc)
 
         return search_corpus_phrases, search_corpus_assoc
 
@@ -790,12 +717,16 @@ class TextSearch(SearchItem):
             self.search_model = None
 
             # clear the search corpus embeddings
-            if self._search_embeddings:
+            if self._search_embeddings is not None:
                 self._search_embeddings = None
 
-            # clear other search corpus data to force them to be re-created
-            self._search_corpus_hash = None
-            self.corpus_cache_file_path = None
+            # the embedding cache is specific to each model, so we need to get another one
+            self._embedding_cache = None
+
+            # the same goes for the ann index
+            self._ann_index = None
+            self._ann_index_key = None
+            self._search_embeddings_inverse_norms = None
 
             # assign the new model name
             self.model_name = model_name
@@ -896,102 +827,70 @@ class TextSearch(SearchItem):
     @property
     def cache_exists(self):
         """
-        Returns True if the search corpus cache file exists
+        Returns True if the embeddings of all the phrases in the search corpus are in the cache
         :return:
         """
 
-        if self.corpus_cache_file_path is None:
-            self._get_corpus_cache_file_path()
-
-        return os.path.exists(self.corpus_cache_file_path)
-
-    def _get_corpus_cache_file_path(self):
-        """
-        Returns the path to the cache file where we will store the search corpus embeddings
-        """
+        # we can't know which phrases we need if the corpus is not prepared
+        if not self._is_prepared or self._search_corpus_phrases is None:
+            return False
 
-        # compute a hash of the search corpus + the search type + the search model
-        # we will use this to name the file where we will store the search corpus embeddings for later use
-        # this means that if anything changes in this search corpus, we will need to re-encode it
-        # it also means that we might have a lot of orphaned cache files if we don't clean them up...
-        if self._search_corpus_hash is None:
-            self._search_corpus_hash = hashlib.md5(
-                str('{}--{}--{}'.format(
-                    str(self._search_corpus_phrases), self.search_type, self.model_name)).encode('utf-8')
-            ).hexdigest()
+        embedding_cache = self._get_embedding_cache()
 
-        self.corpus_cache_file_path = \
-            os.path.join(self._search_corpus_cache_dir, 'search_{}.pkl'.format(self._search_corpus_hash))
+        if embedding_cache is None:
+            return False
 
-        return self.corpus_cache_file_path
+        return not embedding_cache.get_missing(self._get_corpus_phrase_hashes())
 
-    def save_corpus_embeddings_to_file(self, embeddings, model, file_path=None):
+    def _get_embedding_cache(self):
         """
-        This function saves the corpus embeddings to a file,
-        but changes the device to cpu temporarily to make the embedding file compatible with all systems
+        Returns the embedding cache for the current model and search corpus cache directory
         """
 
-        # only save the embeddings if they and the model are valid
-        if embeddings is None:
-            logger.warning('Cannot save encoded corpus to file - invalid embeddings.')
-            return
-
-        if model is None:
-            logger.warning('Cannot save encoded corpus to file - invalid model.')
-            return
+        if self._embedding_cache is None:
 
-        # if no file path was passed, try to use the one from the class
-        if file_path is None:
-            file_path = self.corpus_cache_file_path
+            if self._search_corpus_cache_dir is None:
+                return None
 
-        if file_path is None:
-            logger.warning('Cannot save encoded corpus to file - no cache file path specified.')
-            return
+            self._embedding_cache = \
+                TextEmbeddingCache(cache_dir=self._search_corpus_cache_dir, model_name=self.model_name)
 
-        try:
+        return self._embedding_cache
 
-            # check if the directory exists
-            if not os.path.exists(os.path.dirname(file_path)):
-                # otherwise, create it
-                os.makedirs(os.path.dirname(file_path))
+    def _get_phrase_source(self, corpus_idx: int):
+        """
+        Returns the (file path, segment) of a phrase in the search corpus, using the search corpus association
+        """
 
-            # get the current device of the embedder
-            model_device = model.device
+        if self._search_corpus_assoc is None or corpus_idx not in self._search_corpus_assoc:
+            return None, None
 
-            # move the model to the cpu for saving to ensure compatibility with all systems
-            if str(model_device) != 'cpu':
-                # move the model to the cpu
-                logger.debug('Moving embedder from "{}" to cpu temporarily to save embeddings to file.'
-                             .format(model_device))
-                model.to('cpu')
+        phrase_assoc = self._search_corpus_assoc[corpus_idx]
 
-                # get the embeddings from the model again
-                embeddings = embeddings.to('cpu')
+        if phrase_assoc['type'] == 'transcription':
+            return phrase_assoc['transcription_file_path'], phrase_assoc['segment_index']
 
-            # save the corpus embeddings to a file
-            with open(file_path, 'wb') as f:
-                pickle.dump(embeddings, f)
+        elif phrase_assoc['type'] == 'marker':
+            return phrase_assoc['file_path'], phrase_assoc['marker_index']
 
-            # save a json file next to the pickle file with the same name
-            # that contains the file list and full path of all the files in the corpus
-            # this is useful in case we want to clean up the corpus cache directory
-            with open('{}.json'.format(file_path), 'w') as f:
-                json.dump(self._search_file_paths, f, indent=4)
+        elif phrase_assoc['type'] == 'transcript_group':
+            return phrase_assoc['file_path'], phrase_assoc['group_name']
 
-            logger.debug('Saved encoded search corpus to {}'.format(file_path))
+        return phrase_assoc.get('file_path', None), phrase_assoc.get('phrase_index', None)
 
-            # move the model back to the original device
-            if str(model_device) != 'cpu':
-                logger.debug('Moving model back to {}.'.format(model_device))
-                model.to(model_device)
-                embeddings = embeddings.to(model_device)
+    def _get_corpus_phrase_hashes(self):
+        """
+        Returns the hashes of the search corpus phrases, in the same order as the phrases
+        """
 
-            return True
+        if self._search_corpus_phrase_hashes is None \
+                or len(self._search_corpus_phrase_hashes) != self.corpus_size:
+            self._search_corpus_phrase_hashes = \
+                [TextEmbeddingCache.get_phrase_hash(phrase) for phrase in self._search_corpus_phrases]
 
-        except Exception as e:
+            self._ann_index_key = None
 
-            logger.error('Could not save search embeddings to file:'.format(file_path), exc_info=True)
-            return False
+        return self._search_corpus_phrase_hashes
 
     def embed_corpus(self, batch_process_callback: callable = None):
 
@@ -1029,58 +928,55 @@ class TextSearch(SearchItem):
             self._search_corpus_cache_dir = os.path.join(os.path.dirname(self._search_file_paths[0]), 'cache')
 
         # if we haven't loaded the search corpus embeddings in the memory cache,
-        # check if we have them in a file (only if caching is enabled)
-        if self._use_embedding_cache \
-                and self._search_embeddings is None \
-                and os.path.exists(self._get_corpus_cache_file_path()):
+        # use the embedding cache (only if caching is enabled)
+        if self._use_embedding_cache and self._search_embeddings is None:
 
-            # get the current device of the embedder
-            transformer_embedder_device = self._embedder.device
+            embedding_cache = self._get_embedding_cache()
 
-            # if the embedder device is not cpu, move it to cpu temporarily
-            # to ensure compatibility with all systems - basically the embeddings saved to files must be on cpu
-            if str(transformer_embedder_device) != 'cpu':
-                logger.debug('Moving embedder from "{}" to "cpu" temporarily to load embeddings from file.'
-                             .format(transformer_embedder_device))
-                self._embedder.to('cpu')
+            phrase_hashes = self._get_corpus_phrase_hashes()
 
-            logger.debug('Loading encoded search corpus from {}'.format(self.corpus_cache_file_path))
+            # only the phrases that were never encoded before need to be encoded now
+            missing_hashes = embedding_cache.get_missing(phrase_hashes)
 
-            # if the try fails, we can assume that the cache file is corrupted
-            try:
+            if missing_hashes:
 
-                # load the corpus embeddings from the file
-                with open(self.corpus_cache_file_path, 'rb') as f:
-                    corpus_embeddings = pickle.load(f)
+                logger.debug('Encoding {} new phrases out of {} in the search corpus.'
+                             .format(len(missing_hashes), len(phrase_hashes)))
 
-                # move the embeddings from the file to the same device as the model
-                corpus_embeddings = corpus_embeddings.to(transformer_embedder_device)
+                # get the phrases and their sources for the missing hashes
+                corpus_idx_by_hash = {}
+                for corpus_idx, phrase_hash in enumerate(phrase_hashes):
+                    corpus_idx_by_hash.setdefault(phrase_hash, corpus_idx)
 
-                # move the embedder back to the original device
-                if str(transformer_embedder_device) != 'cpu':
-                    self._embedder.to(transformer_embedder_device)
+                missing_phrases = \
+                    [self._search_corpus_phrases[corpus_idx_by_hash[phrase_hash]] for phrase_hash in missing_hashes]
+                missing_sources = \
+                    [self._get_phrase_source(corpus_idx_by_hash[phrase_hash]) for phrase_hash in missing_hashes]
 
-                # touch the file to update the last modified time
-                # this will be useful if we want to ever clean up the cache
-                # (e.g. delete files unused for 90 days)
-                os.utime(self.corpus_cache_file_path, None)
+                missing_embeddings = self._embedder.encode(
+                    missing_phrases, convert_to_tensor=True,
+                    show_progress_bar=True, batch_progress_callback=batch_process_callback)
 
-                # add the corpus embeddings to the memory cache
-                self._search_embeddings = corpus_embeddings
+                if missing_embeddings is False:
+                    return None
 
-            except:
+                logger.debug('Encoded search corpus.')
 
-                logger.warning('Could not load encoded search corpus from file: {}'
-                               .format(self.corpus_cache_file_path),
-                               exc_info=True)
+                # add the new embeddings to the cache and save them for later use
+                if not embedding_cache.add(missing_hashes, missing_embeddings, sources=missing_sources):
+                    return None
+
+            else:
+                logger.info('Using search corpus embeddings from cache.')
 
-                # move the embedder back to the original device
-                if str(transformer_embedder_device) != 'cpu':
-                    self._embedder.to(transformer_embedder_device)
+            # assemble the corpus embeddings from the cache, on the same device as the model
+            corpus_embeddings = embedding_cache.get_embeddings(phrase_hashes, target_device=self._embedder.device)
 
-        # if we haven't found the search corpus embeddings in the memory cache or in a file
-        # then we need to encode it now
-        if self._search_embeddings is None:
+            if corpus_embeddings is None:
+                return None
+
+        # if we're not using the cache and we don't have the embeddings in memory, we need to encode them now
+        elif self._search_embeddings is None:
 
             corpus_embeddings = self._embedder.encode(
                 self._search_corpus_phrases, convert_to_tensor=True,
@@ -1091,30 +987,92 @@ class TextSearch(SearchItem):
 
             logger.debug('Encoded search corpus.')
 
-            # add the embeddings to the memory cache
-            self._search_embeddings = corpus_embeddings
-
-            # save the embeddings to the file cache for later use
-            if self._use_embedding_cache:
-                self.save_corpus_embeddings_to_file(corpus_embeddings, model=self._embedder)
-
         else:
-            # load the embeddings from the cache
+            # load the embeddings from the memory cache
             corpus_embeddings = self._search_embeddings
 
-            logger.info('Using search corpus embeddings from cache.')
+            logger.info('Using search corpus embeddings from memory.')
 
         # if start_search_time is not None:
         #     logger.debug('Time: ' + str(time.time() - start_search_time))
 
+        # if the embeddings changed, the ann index needs to change too
+        if corpus_embeddings is not self._search_embeddings:
+            self._ann_index = None
+            self._search_embeddings_inverse_norms = None
+
         self._search_embeddings = corpus_embeddings
 
         return True
 
-    def search_semantic(self, **kwargs):
+    def _should_use_ann_index(self):
         """
-        This function searches for a search term in a search corpus and returns the results.
-        :return:
+        Returns True if we should search the corpus using the approximate nearest neighbour index
+        """
+
+        if self._use_ann_index is not None:
+            return self._use_ann_index
+
+        # the ann index is disabled by default, since its results are approximate
+        ann_min_corpus_size = self.stAI.get_app_setting(setting_name='search_ann_min_corpus_size',
+                                                        default_if_none=0)
+
+        return bool(ann_min_corpus_size) and self.corpus_size >= int(ann_min_corpus_size)
+
+    def _get_ann_index_file_path(self):
+        """
+        Returns the path of the file where we store the ann index for the current search corpus
+        (next to the embedding cache)
+        """
+
+        phrase_hashes = self._get_corpus_phrase_hashes()
+
+        if self._ann_index_key is None:
+            self._ann_index_key = hashlib.md5(
+                '{}--{}'.format(self.model_name, ''.join(phrase_hashes)).encode('utf-8')
+            ).hexdigest()
+
+        return os.path.join(self._search_corpus_cache_dir, 'ann_{}.npz'.format(self._ann_index_key))
+
+    def _get_ann_index(self):
+        """
+        Returns the ann index for the current search corpus,
+        either from memory, from the cache file, or by building it now
+        """
+
+        if self._ann_index is not None:
+            return self._ann_index
+
+        if self._search_embeddings is None:
+            return None
+
+        ann_index_file_path = self._get_ann_index_file_path() if self._use_embedding_cache else None
+
+        if ann_index_file_path is not None:
+            self._ann_index = \
+                TextSearchANNIndex.load(ann_index_file_path, target_device=self._search_embeddings.device)
+
+        # make sure that the index from the file matches the corpus
+        if self._ann_index is not None and self._ann_index.size != self.corpus_size:
+            logger.warning('Ignoring search index from {} - it doesn\'t match the search corpus.'
+                           .format(ann_index_file_path))
+            self._ann_index = None
+
+        if self._ann_index is None:
+
+            logger.debug('Building search index for {} phrases.'.format(self.corpus_size))
+
+            self._ann_index = TextSearchANNIndex.build(self._search_embeddings, inverse_norms=self._get_inverse_norms())
+
+            if ann_index_file_path is not None:
+                self._ann_index.save(ann_index_file_path)
+
+        return self._ann_index
+
+    def _prepare_semantic_search(self):
+        """
+        Makes sure that the search corpus is prepared and embedded before a semantic search
+        :return: True if we can search, False otherwise
         """
 
         # if the search corpus is empty, try to prepare it
@@ -1122,25 +1080,118 @@ class TextSearch(SearchItem):
             # prepare the search corpus
             self.prepare_search_corpus()
 
-        if self.query is None or self.query == '':
-            logger.warning('Query empty.')
-            return [], 0
-
         # if the corpus is empty, abort
         if not self._search_corpus_phrases:
             logger.debug('Text search corpus empty.')
-            return [], 0
+            return False
 
         logger.debug('Performing semantic search on {} phrases.'.format(len(self._search_corpus_phrases)))
 
         # embed the search corpus if it's not already embedded
         if self.embed_corpus() is None:
+            return False
+
+        return True
+
+    def _get_inverse_norms(self):
+        """
+        Returns the inverse norms of the corpus embeddings,
+        so we can normalize each block of the corpus when scoring it,
+        instead of keeping a normalized float32 copy of the whole corpus in memory
+        """
+
+        if self._search_embeddings_inverse_norms is None and self._search_embeddings is not None:
+            self._search_embeddings_inverse_norms = get_inverse_norms(self._search_embeddings)
+
+        return self._search_embeddings_inverse_norms
+
+    def _search_semantic_queries(self, queries: list, top_k: int):
+        """
+        Encodes all the queries in one batch and finds the top_k closest phrases for all of them at once
+        :param queries: a list of query strings
+        :param top_k: how many results to find for each query
+        :return: a list of (scores, corpus indexes) tensors, one for each query
+        """
+
+        # encode all the queries in one go
+        query_embeddings = self._embedder.encode(
+            queries, convert_to_tensor=True, show_progress_bar=False, normalize_embeddings=True)
+
+        logger.debug('Encoded {} {}.'.format(len(queries), 'query' if len(queries) == 1 else 'queries'))
+
+        if self.start_search_time is not None:
+            logger.debug('Time: ' + str(time.time() - self.start_search_time))
+
+        corpus_embeddings = self._search_embeddings
+        inverse_norms = self._get_inverse_norms()
+        query_embeddings = query_embeddings.to(device=corpus_embeddings.device, dtype=torch.float32)
+
+        self.last_search_approximate = self._should_use_ann_index()
+
+        # use the ann index for large corpora
+        if self.last_search_approximate:
+
+            logger.info('Searching {} phrases using the approximate search index - some results might be missing.'
+                        .format(self.corpus_size))
+
+            ann_index = self._get_ann_index()
+
+            # the number of clusters to search in the ann index - this trades speed for recall
+            ann_n_probe = int(self.stAI.get_app_setting(setting_name='search_ann_n_probe', default_if_none=8))
+
+            # the ann index only scores the phrases in the clusters closest to each query
+            return ann_index.search(
+                query_embeddings=query_embeddings, corpus_embeddings=corpus_embeddings,
+                top_k=top_k, n_probe=ann_n_probe, inverse_norms=inverse_norms
+            )
+
+        # since both the queries and the corpus blocks are normalized,
+        # the cosine similarity for all the queries is a (queries x block) matrix multiplication for each block,
+        # and we keep the highest top_k scores for each query as we go through the blocks
+        top_values = None
+        top_indices = None
+        for block_start in range(0, len(corpus_embeddings), SCORE_BLOCK_SIZE):
+
+            block_rows = slice(block_start, block_start + SCORE_BLOCK_SIZE)
+
+            cos_scores = query_embeddings @ get_normalized_rows(corpus_embeddings, inverse_norms, block_rows).T
+            block_results = torch.topk(cos_scores, k=min(top_k, cos_scores.shape[1]), dim=1, sorted=True)
+
+            if top_values is None:
+                top_values, top_indices = block_results.values, block_results.indices + block_start
+                continue
+
+            # merge the results of this block with the results so far
+            values = torch.cat([top_values, block_results.values], dim=1)
+            indices = torch.cat([top_indices, block_results.indices + block_start], dim=1)
+
+            merged_results = torch.topk(values, k=min(top_k, values.shape[1]), dim=1, sorted=True)
+
+            top_values = merged_results.values
+            top_indices = torch.gather(indices, 1, merged_results.indices)
+
+        return list(zip(top_values, top_indices))
+
+    def search_semantic(self, **kwargs):
+        """
+        This function searches for a search term in a search corpus and returns the results.
+        :return:
+        """
+
+        if self.query is None or self.query == '':
+            logger.warning('Query empty.')
+            return [], 0
+
+        if not self._prepare_semantic_search():
             return [], 0
 
         # if the query is string, consider that the query consists of a single search term
         # otherwise, consider that the query is a list of search terms
         queries = [self.query] if isinstance(self.query, str) else self.query
 
+        # remove whitespaces from the queries
+        queries = [query.strip() for query in queries]
+
         # reset the search results
         search_results = []
 
@@ -1151,30 +1202,12 @@ class TextSearch(SearchItem):
         # it's either the max_results parameter or the length of the search corpus,
         # whatever is smaller
         top_k = min(self.max_results, len(self._search_corpus_phrases))
-        for query in queries:
-
-            # remove whitespaces from the query
-            query = query.strip()
-
-            query_embedding = self._embedder.encode(query, convert_to_tensor=True, show_progress_bar=True)
-
-            logger.debug('Encoded the query.')
 
-            if self.start_search_time is not None:
-                logger.debug('Time: ' + str(time.time() - self.start_search_time))
-
-            # we use cosine-similarity and torch.topk to find the highest top_k scores
-            cos_scores = util.cos_sim(query_embedding, self._search_embeddings)[0]
-            top_results = torch.topk(cos_scores, k=top_k, sorted=True)
+        for top_results in self._search_semantic_queries(queries=queries, top_k=top_k):
 
             # reverse the results so that they are in descending order
             if kwargs.get('order') == 'desc':
-                top_results = (top_results[0].tolist()[::-1], top_results[1].tolist()[::-1])
-
-            logger.debug('Found results.')
-
-            if self.start_search_time is not None:
-                logger.debug('Time: ' + str(time.time() - self.start_search_time))
+                top_results = (top_results[0].flip(0), top_results[1].flip(0))
 
             # compile the search results
             # but take the source file into consideration
@@ -1190,11 +1223,61 @@ class TextSearch(SearchItem):
                         score=score
                     )
 
+        logger.debug('Found results.')
+
+        if self.start_search_time is not None:
+            logger.debug('Time: ' + str(time.time() - self.start_search_time))
+
         self._search_results = search_results
         self._top_k = top_k
 
         return search_results, top_k
 
+    def search_many(self, queries: list, max_results: int = None):
+        """
+        Searches the corpus semantically for many queries at once (for eg. a list of story beats)
+        All the queries are encoded and scored in one batch, so the latency stays about the same
+        regardless of the number of queries.
+
+        :param queries: a list of query strings
+        :param max_results: the maximum number of results for each query (defaults to self.max_results)
+        :return: a list with the search results for each query (in the same order as the queries) and the top_k
+        """
+
+        # remove the empty queries
+        queries = [query.strip() for query in queries if query and query.strip()]
+
+        if not queries:
+            logger.warning('Query empty.')
+            return [], 0
+
+        if not self._prepare_semantic_search():
+            return [], 0
+
+        top_k = min(max_results if max_results is not None else self.max_results, len(self._search_corpus_phrases))
+
+        logger.info('Finding the closest sentences in the corpus for {} queries.'.format(len(queries)))
+
+        search_results = []
+        for query, top_results in zip(queries, self._search_semantic_queries(queries=queries, top_k=top_k)):
+
+            query_results = []
+            for score, idx in zip(top_results[0], top_results[1]):
+
+                if str(self._search_corpus_phrases[idx]) != '':
+                    self.add_search_result(
+                        search_results=query_results,
+                        query=query,
+                        search_corpus_phrases=self._search_corpus_phrases,
+                        search_corpus_assoc=self._search_corpus_assoc,
+                        idx=idx.item(),
+                        score=score
+                    )
+
+            search_results.append(query_results)
+
+        return search_results, top_k
+
     @staticmethod
     def add_search_result(search_results, query, search_corpus_phrases, search_corpus_assoc, idx, score):
         """
@@ -1298,23 +1381,685 @@ class TextSearch(SearchItem):
         return True
 
 
-class SearchablePhrase:
+class TextEmbeddingCache:
     """
-    This class represents a searchable phrase.
+    This is a content-addressed store for the embeddings of search phrases.
+
+    Each embedding is stored under the hash of its phrase, and each store is specific to one model,
+    which means that when a file of the search corpus changes, only the new or changed phrases need to be encoded,
+    while all the other embeddings are picked up from the store.
+
+    The embeddings are kept in a flat float16 matrix file which is only appended to and memory-mapped when read,
+    next to an index file that is also only appended to, with one json line for the phrase hash and the source
+    (file path, segment) of each row. Since both files only grow, we only need to read the lines
+    that were added to the index since we last read it (for eg. by another process).
     """
 
-    def __init__(self, search_phrase, corpus_idx, source_file_path, source_file_type):
+    # we're keeping one instance per cache file path so that all the search items using the same cache
+    # directory and model share the same embeddings in memory
+    _instances = InstanceRegistry(name='text_embedding_caches')
 
-        # the phrase itself
-        self.search_phrase = search_phrase
+    # this is how the embeddings are stored in the matrix file
+    embeddings_dtype = np.float16
 
-        # the index of the phrase in the corpus
-        self.corpus_idx = corpus_idx
+    def __new__(cls, cache_dir, model_name):
 
-        # the index/indexes of the object/item in the source file
-        self.source_file_idx = None
+        file_path = cls.get_cache_file_path(cache_dir=cache_dir, model_name=model_name)
 
-        # the objects that composed this phrase
+        if (instance := cls._instances.get(file_path)) is not None:
+            return instance
+
+        instance = super().__new__(cls)
+        cls._instances.put(file_path, instance, size=InstanceRegistry.file_size('{}.jsonl'.format(file_path)))
+
+        return instance
+
+    def __init__(self, cache_dir, model_name):
+
+        # prevent initializing the instance more than once if it was already initialized
+        if hasattr(self, '_initialized') and self._initialized:
+            return
+
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.file_path = self.get_cache_file_path(cache_dir=cache_dir, model_name=model_name)
+        self.index_file_path = '{}.jsonl'.format(self.file_path)
+
+        # this locks the store for the other processes while we're adding embeddings
+        self.lock_file_path = '{}.lock'.format(self.file_path)
+
+        # the hash of the phrase on each row of the matrix
+        self._phrase_hashes = []
+
+        # this maps each phrase hash to its row in the matrix
+        self._phrase_rows = {}
+
+        # the source of the phrase on each row, as [source file index, segment] (see _source_files)
+        self._row_sources = []
+        self._source_files = []
+        self._source_file_idx = {}
+
+        # the dimension of the embeddings (we'll know it when we load or add the first embeddings)
+        self._dim = None
+
+        # how much of the index file we've already read (bytes)
+        self._index_offset = 0
+
+        # the memory-mapped matrix (opened on demand)
+        self._embeddings = None
+
+        self._is_loaded = False
+
+        # the store might be used by the queue and the UI at the same time
+        self._lock = Lock()
+
+        self._initialized = True
+
+    @staticmethod
+    def get_cache_file_path(cache_dir, model_name):
+        """
+        Returns the path of the matrix file where we store the embeddings for this model
+        """
+
+        model_name_hash = hashlib.md5(str(model_name).encode('utf-8')).hexdigest()
+
+        return os.path.join(cache_dir, 'embeddings_{}.f16'.format(model_name_hash))
+
+    @staticmethod
+    def get_phrase_hash(phrase: str):
+        """
+        Returns the hash we use to address the embedding of a phrase
+        """
+        return hashlib.md5(str(phrase).encode('utf-8')).hexdigest()
+
+    @property
+    def size(self):
+        """
+        This returns the number of embeddings in the store
+        """
+        return len(self._phrase_hashes)
+
+    def _reset(self):
+
+        self._phrase_hashes = []
+        self._phrase_rows = {}
+        self._row_sources = []
+        self._source_files = []
+        self._source_file_idx = {}
+        self._dim = None
+        self._index_offset = 0
+        self._embeddings = None
+
+    def _get_matrix(self):
+        """
+        Returns the memory-mapped embeddings matrix (or None if the store is empty)
+        """
+
+        if self._embeddings is None and self.size > 0:
+            # copy-on-write, so torch can use the memory-mapped rows without copying them
+            self._embeddings = np.memmap(self.file_path, dtype=self.embeddings_dtype, mode='c',
+                                         shape=(self.size, self._dim))
+
+        return self._embeddings
+
+    def load(self):
+        """
+        Loads the index of the store from the cache (only once per session)
+        """
+
+        with self._lock:
+
+            if self._is_loaded:
+                return True
+
+            self._is_loaded = True
+
+            if not os.path.isfile(self.index_file_path) or not os.path.isfile(self.file_path):
+                return False
+
+            logger.debug('Loading search embeddings index from {}'.format(self.index_file_path))
+
+            if not self._read_index():
+                return False
+
+            # touch the file to update the last modified time
+            # this will be useful if we want to ever clean up the cache
+            # (e.g. delete files unused for 90 days)
+            try:
+                os.utime(self.file_path, None)
+            except OSError:
+                pass
+
+        return True
+
+    def _read_index(self):
+        """
+        Reads the lines that were added to the index file since we last read it
+        (other processes might have added embeddings to the store in the meantime)
+        :return: True if the index was read, False otherwise
+        """
+
+        # if the try fails, we can assume that the cache files are corrupted
+        try:
+            with open(self.index_file_path, 'rb') as f:
+                f.seek(self._index_offset)
+                index_tail = f.read()
+
+            # an interrupted append might have left a partial line at the end, so we only read the complete lines
+            index_tail = index_tail[:index_tail.rfind(b'\n') + 1]
+
+            if not index_tail:
+                return True
+
+            matrix_rows = None
+            previous_size = self.size
+
+            for index_line in index_tail.splitlines():
+
+                try:
+                    index_entry = json.loads(index_line)
+                except ValueError:
+                    continue
+
+                # the first line of the index describes the matrix
+                if 'model_name' in index_entry:
+
+                    if index_entry['model_name'] != self.model_name:
+                        logger.warning('Ignoring search embeddings from {} - they belong to a different model.'
+                                       .format(self.file_path))
+                        self._reset()
+                        return False
+
+                    self._dim = index_entry['dim']
+
+                    itemsize = np.dtype(self.embeddings_dtype).itemsize
+                    matrix_rows = os.path.getsize(self.file_path) // (self._dim * itemsize)
+
+                # each source file gets the next index
+                elif 'source_file' in index_entry:
+                    self._source_file_idx[index_entry['source_file']] = len(self._source_files)
+                    self._source_files.append(index_entry['source_file'])
+
+                elif 'row' in index_entry:
+
+                    row = index_entry['row']
+
+                    if matrix_rows is None:
+                        itemsize = np.dtype(self.embeddings_dtype).itemsize
+                        matrix_rows = os.path.getsize(self.file_path) // (self._dim * itemsize)
+
+                    # the rows are only added to the index after they're written to the matrix file,
+                    # so this should only happen if the matrix file was changed by something else
+                    # (or if the line was already read)
+                    if row >= matrix_rows or row < self.size:
+                        logger.debug('Ignoring search embeddings row {} from {}.'.format(row, self.file_path))
+                        continue
+
+                    # the rows that were appended without making it into the index are skipped
+                    while self.size < row:
+                        self._phrase_hashes.append(None)
+                        self._row_sources.append([None, None])
+
+                    self._phrase_rows[index_entry['hash']] = row
+                    self._phrase_hashes.append(index_entry['hash'])
+                    self._row_sources.append([index_entry.get('file', None), index_entry.get('segment', None)])
+
+            self._index_offset += len(index_tail)
+
+            # the matrix has grown, so we need to map it again
+            if self.size != previous_size:
+                self._embeddings = None
+
+        except Exception:
+            logger.warning('Could not load search embeddings from file: {}'.format(self.file_path), exc_info=True)
+
+            self._reset()
+
+            return False
+
+        return True
+
+    def get_missing(self, phrase_hashes: list):
+        """
+        Returns the unique phrase hashes from the list that don't have an embedding in the store yet
+        """
+
+        self.load()
+
+        missing_hashes = []
+        seen_hashes = set()
+        for phrase_hash in phrase_hashes:
+            if phrase_hash not in self._phrase_rows and phrase_hash not in seen_hashes:
+                missing_hashes.append(phrase_hash)
+                seen_hashes.add(phrase_hash)
+
+        return missing_hashes
+
+    def get_source(self, phrase_hash: str):
+        """
+        Returns the (file path, segment) from which the phrase was first added to the store
+        """
+
+        if phrase_hash not in self._phrase_rows:
+            return None, None
+
+        file_idx, segment = self._row_sources[self._phrase_rows[phrase_hash]]
+
+        return self._source_files[file_idx] if file_idx is not None else None, segment
+
+    def add(self, phrase_hashes: list, embeddings: Tensor, sources: list = None):
+        """
+        Adds the embeddings of the phrase hashes to the store and appends them to the cache file
+
+        :param phrase_hashes: the hashes of the phrases
+        :param embeddings: the embeddings of the phrases, in the same order as the hashes
+        :param sources: a list of (file path, segment) for each phrase
+        """
+
+        if len(phrase_hashes) != len(embeddings):
+            logger.error('Cannot add embeddings to the cache - the number of phrases and embeddings differ.')
+            return False
+
+        self.load()
+
+        embeddings = embeddings.detach().cpu().numpy().astype(self.embeddings_dtype)
+
+        # check if the directory exists, otherwise create it
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        # other processes (the queue workers or another instance of the app) might append to the same store,
+        # so the appends must happen under a lock that works across processes
+        with self._lock, FileLock(self.lock_file_path):
+
+            # read what the other processes added since we last read the index
+            if os.path.isfile(self.index_file_path) and os.path.isfile(self.file_path):
+                if not self._read_index():
+                    return False
+
+            if self._dim is not None and embeddings.shape[1] != self._dim:
+                logger.error('Cannot add embeddings to the cache - the embedding size differs from the cache.')
+                return False
+
+            new_rows = []
+            new_hashes = set()
+            for phrase_idx, phrase_hash in enumerate(phrase_hashes):
+
+                # skip the phrases that are already in the store
+                if phrase_hash in self._phrase_rows or phrase_hash in new_hashes:
+                    continue
+
+                new_rows.append(phrase_idx)
+                new_hashes.add(phrase_hash)
+
+            if not new_rows:
+                return True
+
+            try:
+                # close the memory map before writing to the file
+                self._embeddings = None
+
+                row_bytes = embeddings.shape[1] * np.dtype(self.embeddings_dtype).itemsize
+
+                # only append to the file (never truncate it), so the rows of the index always stay valid
+                with open(self.file_path, 'ab') as f:
+
+                    file_size = f.seek(0, os.SEEK_END)
+
+                    # an interrupted append might have left a partial row at the end, so complete it with zeros
+                    if file_size % row_bytes:
+                        f.write(bytes(row_bytes - file_size % row_bytes))
+
+                    # the new rows start after the rows that are already in the file
+                    first_row = -(-file_size // row_bytes)
+
+                    f.write(np.ascontiguousarray(embeddings[new_rows]).tobytes())
+
+                index_lines = []
+
+                # a new index starts with the description of the matrix
+                if self._index_offset == 0:
+                    index_lines.append({
+                        'model_name': self.model_name,
+                        'dtype': np.dtype(self.embeddings_dtype).name,
+                        'dim': embeddings.shape[1]
+                    })
+
+                self._dim = embeddings.shape[1]
+
+                # the rows that were appended without making it into the index are skipped
+                while self.size < first_row:
+                    self._phrase_hashes.append(None)
+                    self._row_sources.append([None, None])
+
+                for phrase_idx in new_rows:
+
+                    phrase_hash = phrase_hashes[phrase_idx]
+
+                    source_file, segment = sources[phrase_idx] if sources else (None, None)
+
+                    if source_file is not None and source_file not in self._source_file_idx:
+                        self._source_file_idx[source_file] = len(self._source_files)
+                        self._source_files.append(source_file)
+                        index_lines.append({'source_file': source_file})
+
+                    file_idx = self._source_file_idx[source_file] if source_file is not None else None
+
+                    index_lines.append({'row': self.size, 'hash': phrase_hash, 'file': file_idx, 'segment': segment})
+
+                    self._phrase_rows[phrase_hash] = self.size
+                    self._phrase_hashes.append(phrase_hash)
+                    self._row_sources.append([file_idx, segment])
+
+                self._append_to_index(index_lines)
+
+            except Exception:
+                logger.error('Could not save search embeddings to file: {}'.format(self.file_path), exc_info=True)
+
+                # the index in memory might no longer match the files, so read it again next time
+                self._reset()
+                self._is_loaded = False
+
+                return False
+
+            logger.debug('Saved {} search embeddings to {}'.format(self.size, self.file_path))
+
+            return True
+
+    def _append_to_index(self, index_lines):
+        """
+        Appends the lines to the index file
+        (the rows in the matrix file are only valid after they were added to the index)
+        """
+
+        with open(self.index_file_path, 'ab') as f:
+
+            index_size = f.seek(0, os.SEEK_END)
+
+            # end the partial line that an interrupted append might have left, so it's skipped when reading
+            if index_size > self._index_offset:
+                f.write(b'\n')
+
+            f.write(''.join(['{}\n'.format(json.dumps(index_line)) for index_line in index_lines]).encode('utf-8'))
+
+            self._index_offset = f.tell()
+
+    def get_embeddings(self, phrase_hashes: list, target_device=None):
+        """
+        Assembles the embeddings of the phrase hashes into a single float16 tensor (in the same order)
+        When the phrases follow the order of the store, the tensor is a view of the memory-mapped matrix,
+        so nothing is copied in memory (the rows are converted to float32 in blocks when scoring)
+        """
+
+        self.load()
+
+        with self._lock:
+
+            try:
+                rows = np.array([self._phrase_rows[phrase_hash] for phrase_hash in phrase_hashes], dtype=np.int64)
+            except KeyError:
+                logger.error('Cannot assemble embeddings - some phrases are missing from the cache.')
+                return None
+
+            if len(rows) == 0:
+                return None
+
+            embeddings_matrix = self._get_matrix()
+
+            # if the rows follow the same order as the matrix, we can simply slice it
+            if np.all(np.diff(rows) == 1):
+                embeddings = embeddings_matrix[rows[0]:rows[-1] + 1]
+            else:
+                embeddings = embeddings_matrix[rows]
+
+            embeddings = torch.from_numpy(embeddings)
+
+        if target_device is not None:
+            embeddings = embeddings.to(target_device)
+
+        return embeddings
+
+
+# the number of corpus embeddings that are converted to float32 and scored at once
+SCORE_BLOCK_SIZE = 65536
+
+
+def get_inverse_norms(embeddings: Tensor, block_size: int = SCORE_BLOCK_SIZE):
+    """
+    Returns the inverse of the L2 norm of each embedding (as float32), calculated block by block
+    """
+
+    inverse_norms = torch.empty(len(embeddings), dtype=torch.float32, device=embeddings.device)
+
+    for block_start in range(0, len(embeddings), block_size):
+        block = embeddings[block_start:block_start + block_size].float()
+        inverse_norms[block_start:block_start + block_size] = \
+            1 / torch.linalg.norm(block, dim=1).clamp_min(1e-12)
+
+    return inverse_norms
+
+
+def get_normalized_rows(embeddings: Tensor, inverse_norms: Tensor, rows):
+    """
+    Returns the normalized float32 copy of some rows of the embeddings
+    :param embeddings: the embeddings (any float type)
+    :param inverse_norms: the inverse norms of the embeddings (or None if they're already normalized)
+    :param rows: a slice or a tensor with the rows
+    """
+
+    if inverse_norms is None:
+        return embeddings[rows].float()
+
+    return embeddings[rows].float() * inverse_norms[rows].unsqueeze(1)
+
+
+class TextSearchANNIndex:
+    """
+    This is an inverted file (IVF) index for approximate nearest neighbour searches over normalized embeddings.
+
+    The embeddings are grouped into clusters around centroids (using spherical k-means),
+    so when we search, we only need to score the embeddings from the n_probe clusters closest to the query,
+    instead of the entire corpus. More probes means better recall, but slower searches.
+    """
+
+    def __init__(self, centroids: Tensor = None, list_offsets: Tensor = None, list_rows: Tensor = None):
+
+        # the normalized centroid of each cluster
+        self.centroids = centroids
+
+        # the rows of the corpus embeddings grouped by cluster,
+        # where the rows of cluster i are list_rows[list_offsets[i]:list_offsets[i+1]]
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+
+    @property
+    def n_lists(self):
+        return len(self.centroids) if self.centroids is not None else 0
+
+    @property
+    def size(self):
+        return len(self.list_rows) if self.list_rows is not None else 0
+
+    @staticmethod
+    def _assign(embeddings: Tensor, centroids: Tensor, chunk_size: int = SCORE_BLOCK_SIZE, inverse_norms=None):
+        """
+        Returns the index of the closest centroid for each embedding (processed in chunks to save memory)
+        """
+
+        assignments = torch.empty(len(embeddings), dtype=torch.long, device=embeddings.device)
+
+        for chunk_start in range(0, len(embeddings), chunk_size):
+            chunk = get_normalized_rows(embeddings, inverse_norms, slice(chunk_start, chunk_start + chunk_size))
+            assignments[chunk_start:chunk_start + chunk_size] = torch.argmax(chunk @ centroids.T, dim=1)
+
+        return assignments
+
+    @classmethod
+    def build(cls, embeddings: Tensor, n_lists: int = None, n_iter: int = 10, max_train_size: int = 262144,
+              seed: int = 0, inverse_norms: Tensor = None):
+        """
+        Builds the index from the corpus embeddings
+
+        :param embeddings: the corpus embeddings (normalized, unless the inverse norms are passed)
+        :param n_lists: the number of clusters (by default, the square root of the corpus size)
+        :param n_iter: the number of k-means iterations
+        :param max_train_size: the maximum number of embeddings used to train the centroids
+        :param seed: the random seed used to pick the initial centroids and the training sample
+        :param inverse_norms: the inverse norms of the embeddings (see get_inverse_norms)
+        :return: the index
+        """
+
+        corpus_size = len(embeddings)
+
+        if n_lists is None:
+            n_lists = int(np.sqrt(corpus_size))
+
+        n_lists = max(1, min(n_lists, corpus_size))
+
+        generator = torch.Generator().manual_seed(seed)
+
+        # train the centroids on a sample of the corpus
+        if corpus_size > max_train_size:
+            train_rows = torch.randperm(corpus_size, generator=generator)[:max_train_size].to(embeddings.device)
+            train_embeddings = get_normalized_rows(embeddings, inverse_norms, train_rows)
+        else:
+            train_embeddings = get_normalized_rows(embeddings, inverse_norms, slice(None))
+
+        initial_rows = torch.randperm(len(train_embeddings), generator=generator)[:n_lists].to(embeddings.device)
+        centroids = train_embeddings[initial_rows].clone()
+
+        for _ in range(n_iter):
+
+            assignments = cls._assign(train_embeddings, centroids)
+
+            # the new centroids are the normalized sums of the embeddings in each cluster
+            new_centroids = torch.zeros_like(centroids)
+            new_centroids.index_add_(0, assignments, train_embeddings)
+
+            # re-seed the empty clusters with random embeddings
+            counts = torch.bincount(assignments, minlength=n_lists)
+            empty_lists = torch.nonzero(counts == 0).flatten()
+            if len(empty_lists) > 0:
+                reseed_rows = torch.randint(len(train_embeddings), (len(empty_lists),), generator=generator)
+                new_centroids[empty_lists] = train_embeddings[reseed_rows.to(embeddings.device)]
+
+            centroids = torch.nn.functional.normalize(new_centroids, p=2, dim=1)
+
+        # now assign the entire corpus to the clusters
+        assignments = cls._assign(embeddings, centroids, inverse_norms=inverse_norms)
+
+        list_rows = torch.argsort(assignments, stable=True)
+        counts = torch.bincount(assignments, minlength=n_lists)
+        list_offsets = torch.zeros(n_lists + 1, dtype=torch.long, device=embeddings.device)
+        list_offsets[1:] = torch.cumsum(counts, dim=0)
+
+        return cls(centroids=centroids, list_offsets=list_offsets, list_rows=list_rows)
+
+    def search(self, query_embeddings: Tensor, corpus_embeddings: Tensor, top_k: int, n_probe: int = 8,
+               inverse_norms: Tensor = None):
+        """
+        Searches the closest top_k corpus embeddings for each query
+
+        :param query_embeddings: the normalized query embeddings (Q x dim)
+        :param corpus_embeddings: the same corpus embeddings used to build the index
+        :param top_k: the number of results per query
+        :param n_probe: how many clusters to search for each query
+        :param inverse_norms: the inverse norms of the corpus embeddings (if they're not normalized)
+        :return: a list of (scores, corpus rows) tensors, one for each query
+        """
+
+        n_probe = max(1, min(n_probe, self.n_lists))
+
+        # find the closest clusters for all the queries at once
+        probed_lists = torch.topk(query_embeddings @ self.centroids.T, k=n_probe, dim=1).indices.tolist()
+
+        list_offsets = self.list_offsets.tolist()
+
+        results = []
+        for query_embedding, query_lists in zip(query_embeddings, probed_lists):
+
+            # gather the corpus rows from the probed clusters
+            candidate_rows = torch.cat(
+                [self.list_rows[list_offsets[list_idx]:list_offsets[list_idx + 1]] for list_idx in query_lists])
+
+            candidate_scores = get_normalized_rows(corpus_embeddings, inverse_norms, candidate_rows) @ query_embedding
+
+            top_results = torch.topk(candidate_scores, k=min(top_k, len(candidate_rows)), sorted=True)
+
+            results.append((top_results.values, candidate_rows[top_results.indices]))
+
+        return results
+
+    def save(self, file_path):
+        """
+        Saves the index to a .npz file
+        """
+
+        try:
+            # check if the directory exists, otherwise create it
+            if not os.path.exists(os.path.dirname(file_path)):
+                os.makedirs(os.path.dirname(file_path))
+
+            # write to a temporary file first, so we never end up with half an index
+            temp_file_path = '{}.tmp.npz'.format(file_path)
+            np.savez(temp_file_path,
+                     centroids=self.centroids.cpu().numpy(),
+                     list_offsets=self.list_offsets.cpu().numpy(),
+                     list_rows=self.list_rows.cpu().numpy())
+            os.replace(temp_file_path, file_path)
+
+            logger.debug('Saved search index with {} clusters to {}'.format(self.n_lists, file_path))
+
+        except Exception:
+            logger.error('Could not save search index to file: {}'.format(file_path), exc_info=True)
+            return False
+
+        return True
+
+    @classmethod
+    def load(cls, file_path, target_device=None):
+        """
+        Loads the index from a .npz file
+        """
+
+        if not os.path.isfile(file_path):
+            return None
+
+        try:
+            with np.load(file_path) as index_data:
+                index = cls(centroids=torch.from_numpy(index_data['centroids']),
+                            list_offsets=torch.from_numpy(index_data['list_offsets']),
+                            list_rows=torch.from_numpy(index_data['list_rows']))
+
+        except Exception:
+            logger.warning('Could not load search index from file: {}'.format(file_path), exc_info=True)
+            return None
+
+        if target_device is not None:
+            index.centroids = index.centroids.to(target_device)
+            index.list_offsets = index.list_offsets.to(target_device)
+            index.list_rows = index.list_rows.to(target_device)
+
+        return index
+
+
+class SearchablePhrase:
+    """
+    This class represents a searchable phrase.
+    """
+
+    def __init__(self, search_phrase, corpus_idx, source_file_path, source_file_type):
+
+        # the phrase itself
+        self.search_phrase = search_phrase
+
+        # the index of the phrase in the corpus
+        self.corpus_idx = corpus_idx
+
+        # the index/indexes of the object/item in the source file
+        self.source_file_idx = None
+
+        # the objects that composed this phrase
         self.source_objects = None
 
         # the file path of the source file
@@ -1329,7 +2074,7 @@ class SearchablePhrase:
 
 class VideoSearch(SearchItem, ClipIndex):
 
-    _instances = {}
+    _instances = InstanceRegistry(name='video_searches')
 
     def __init__(self, *args, **kwargs):
 
@@ -1380,7 +2125,8 @@ class VideoSearch(SearchItem, ClipIndex):
             if not VideoSearch.is_file_searchable(search_file_path):
                 continue
 
-            transcription = Transcription(transcription_file_path=search_file_path)
+            # we only need the video index path, so there's no need to load the segments
+            transcription = TranscriptionReader(transcription_file_path=search_file_path, header_only=True)
 
             # get the video indexing path
             video_indexing_path = transcription.video_index_path
@@ -1413,6 +2159,19 @@ class VideoSearch(SearchItem, ClipIndex):
             logger.debug('Cannot load index paths - the path list is empty.')
             return
 
+        # load the indexes through the video index manifest,
+        # so we don't have to parse the metadata and load the embeddings of each video again
+        try:
+            shards = VideoIndexManifest.from_settings(self.stAI).get_shards(self.search_file_paths)
+
+        except Exception:
+            logger.error('Cannot load video indexes from manifest. Loading them directly.', exc_info=True)
+            shards = None
+
+        if shards is not None:
+            self.load_shards(shards)
+            return
+
         # load the index paths
         self.load_into_instance(npy_paths=self.search_file_paths)
 
@@ -0,0 +1,389 @@
+"""
+This extracts the search corpus phrases from the files used in text searches.
+
+These functions don't depend on the search models, so they can also run in other processes
+(see TextSearch.prepare_search_corpus) without loading torch or the sentence transformers.
+"""
+
+import os
+import re
+import json
+import hashlib
+
+from storytoolkitai.core.logger import logger
+
+from .transcription import TranscriptionReader, TranscriptionUtils
+
+
+def process_file(file_path, min_phrase_length=2):
+    """
+    Extracts the phrases and the search corpus association from a single file
+
+    The indexes in the association are relative to the phrases of this file only,
+    so they need to be offset when the phrases are added to the corpus.
+
+    :param file_path: the path of the file
+    :param min_phrase_length: the phrases of text files shorter than this are ignored
+    :return: a list of phrases and the search corpus association dict
+    """
+
+    search_corpus_phrases = []
+    search_corpus_assoc = {}
+
+    # decide what to do based on the file extension
+
+    # if it's TRANSCRIPTION FILE
+    if file_path.endswith('.transcription.json'):
+        return process_transcription_file(file_path, search_corpus_phrases, search_corpus_assoc)
+
+    # if it's a TEXT FILE
+    elif file_path.endswith('.txt'):
+        return process_text_file(file_path, search_corpus_phrases, search_corpus_assoc,
+                                 min_phrase_length=min_phrase_length)
+
+    # if it's a PROJECT FILE
+    elif file_path.endswith('project.json'):
+        return process_project_file(file_path, search_corpus_phrases, search_corpus_assoc)
+
+    return search_corpus_phrases, search_corpus_assoc
+
+
+def process_transcription_file(transcription_file_path, search_corpus_phrases, search_corpus_assoc):
+    """
+    Adds the phrases of a transcription file to the search corpus, using the segments as they are
+    """
+
+    # we only need the text of the transcription, so we don't need to load the entire object
+    transcription = TranscriptionReader(transcription_file_path=transcription_file_path)
+
+    if not transcription.is_transcription_file:
+        logger.warning('Transcription file {} is not in the right format. Skipping.'
+                       .format(transcription_file_path))
+        return search_corpus_phrases, search_corpus_assoc
+
+    if transcription.has_segments:
+
+        process_transcription_segments(transcription, transcription_file_path, transcription.iter_segments(),
+                                       search_corpus_phrases, search_corpus_assoc)
+
+    return search_corpus_phrases, search_corpus_assoc
+
+
+def process_transcription_segments(transcription, transcription_file_path, segments,
+                                   search_corpus_phrases, search_corpus_assoc):
+    """
+    Groups the segments of a transcription into phrases and adds them to the search corpus
+
+    :param transcription: the Transcription or TranscriptionReader object
+    :param transcription_file_path: the path of the transcription file
+    :param segments: the segments as dicts (either straight from the transcription or filtered by TextAnalysis)
+    :param search_corpus_phrases: the phrases list to add to
+    :param search_corpus_assoc: the association dict to add to
+    """
+
+    logger.debug('Adding {} to the search corpus.'.format(transcription_file_path))
+
+    # does this transcription file contain timecodes?
+    timecode_data = transcription.get_timecode_data()
+
+    # group the segment texts into phrases using punctuation as dividers
+    # instead of how they're currently segmented
+    # once they are grouped, add them to the search corpus
+    # plus add them to the search corpus association list so we know
+    # from which transcription file and from which segment they came from originally
+
+    # initialize the current phrase
+    current_phrase = ''
+
+    # loop through the segments of this transcription file
+    for segment_index, segment in enumerate(segments):
+
+        # skip speaker meta segments (but allow other meta segments, like notes)
+        if 'meta' in segment and segment['meta'] and 'category' in segment and segment['category'] == 'speaker':
+            continue
+
+        filtered_segment_index = None
+
+        # if there is a segment index in the segment
+        # it means that these segments may have been filtered
+        if 'idx' in segment:
+
+            # so let's use the first segment index as the segment index for the results
+            filtered_segment_index = segment['idx'][0]
+
+            # and if there is a filtered segment index, use that instead
+            # note: all_lines is a list of all the lines that are connected to this segment
+            # therefore, all_lines below will take this value too
+            # (+1 on each index to compensate for line numbers)
+            if filtered_segment_index is not None:
+                segment_index = filtered_segment_index
+
+        # first remember the transcription file path and the segment index
+        # if this is a new phrase (i.e. the current phrase is empty)
+        if current_phrase == '':
+            # this is the segment index relative to the whole search corpus that
+            # contains all the transcription file segments (not just the current transcription file)
+            general_segment_index = len(search_corpus_phrases)
+
+            timecode = None \
+                if not timecode_data \
+                else TranscriptionUtils.seconds_to_timecode(
+                segment['start'],
+                transcription.timeline_fps, transcription.timeline_start_tc
+            )
+
+            # keep the timecode as a string, so the association can be cached and sent between processes
+            if timecode is not None:
+                timecode = str(timecode)
+
+            search_corpus_assoc[general_segment_index] = {
+                'transcription_file_path': transcription_file_path,
+                'name': transcription.name
+                if transcription.name else os.path.basename(transcription_file_path),
+                'segment': segment['text'],
+                'segment_index': segment_index,
+                'start': segment['start'],
+                'timecode': timecode,
+                'all_lines': [int(segment_index) + 1]
+                if 'idx' not in segment
+                else [sgm + 1 for sgm in segment['idx']],
+                'type': 'transcription'
+            }
+
+        # otherwise, if this is not a new phrase
+        else:
+            # just append the current segment index to the list of all lines
+            search_corpus_assoc[general_segment_index]['all_lines'].append(
+                int(segment_index) + 1)
+
+        # add the segment text to the current phrase
+        # but only if it's longer than 2 chars to avoid adding stuff that is meaningless
+        # like punctuation marks
+        if 'text' in segment and type(segment['text']) is str:
+
+            # keep adding segments to the current phrase until we find a punctuation mark
+
+            # first get the segment text
+            segment_text = str(segment['text'])
+
+            # add the segment to the current phrase
+            current_phrase += segment_text.strip() + ' '
+
+            # if a punctuation mark exists in the last 5 characters of the segment text
+            # it means that the current phrase is complete
+            # also split if this is a meta segment
+            if re.search(r'[\.\?\!]{1}\s*$', segment_text[-5:])\
+                    or ('meta' in segment and segment['meta']):
+                # "close" the current phrase by adding it to the search corpus
+                search_corpus_phrases.append(current_phrase.strip())
+
+                # then empty the current phrase
+                current_phrase = ''
+
+    if transcription.transcript_groups:
+
+        # take each transcript group
+        for transcript_group in transcription.transcript_groups:
+            general_segment_index = len(search_corpus_phrases)
+
+            # and add the transcript group name and group notes to the search corpus association
+            search_corpus_assoc[general_segment_index] = {
+                'file_path': transcription_file_path,
+                'transcription_name': transcription.name
+                if transcription.name else os.path.basename(transcription_file_path),
+                'type': 'transcript_group',
+                'group_name': transcript_group
+            }
+
+            # and add the transcript group name to the search corpus phrases
+            search_corpus_phrases.append(
+                transcription.transcript_groups[transcript_group]['name']
+                + ': '
+                + transcription.transcript_groups[transcript_group]['notes']
+            )
+
+    return search_corpus_phrases, search_corpus_assoc
+
+
+def process_text_file(text_file_path, search_corpus_phrases, search_corpus_assoc, min_phrase_length=2):
+    """
+    Adds the phrases of a text file to the search corpus
+    """
+
+    # first read the file
+    with open(text_file_path, 'r', encoding='utf-8') as f:
+        file_text = f.read()
+
+    # split the text into phrases using punctuation or double new lines as dividers
+    phrases = re.split(r'[\.\?\!]{1}\s+|[\.\?\!]{1}$|[\n]{2,}', file_text)
+
+    # then add each phrase to the search corpus
+    for phrase_index, phrase in enumerate(phrases):
+
+        # but only if it's longer than x characters
+        # to avoid adding stuff that is most likely meaningless
+        # like punctuation marks
+        if len(phrase) > min_phrase_length:
+
+            # remember the text file path and the phrase number
+            # this is the phrase index relative to the whole search corpus that
+            general_segment_index = len(search_corpus_phrases)
+
+            # add the phrase to the search corpus
+            search_corpus_phrases.append(phrase.strip())
+
+            # add the phrase to the search corpus association list
+            search_corpus_assoc[general_segment_index] = {'file_path': text_file_path,
+                                                          'text': phrase.strip(),
+                                                          'phrase_index': phrase_index,
+                                                          'type': 'text'
+                                                          }
+
+    return search_corpus_phrases, search_corpus_assoc
+
+
+def process_project_file(project_file_path, search_corpus_phrases, search_corpus_assoc):
+    """
+    Adds the timeline markers of a project file to the search corpus
+    """
+
+    # read it as a json file
+    with open(project_file_path, 'r', encoding='utf-8') as f:
+        project_file_data = json.load(f)
+
+    # first check if it contains the project name
+    if 'name' not in project_file_data or 'timelines' not in project_file_data:
+        logger.warning('Project file {} is not in the right format. Skipping.'
+                       .format(project_file_path))
+
+        return search_corpus_phrases, search_corpus_assoc
+
+    # take each timeline and add all its markers to the search corpus
+    for timeline_name in project_file_data['timelines']:
+
+        timeline = project_file_data['timelines'][timeline_name]
+
+        # if the timeline has markers
+        if 'markers' in timeline and type(timeline['markers']) is dict:
+
+            timeline_fps = timeline.get('timeline_fps', None)
+            timeline_start_tc = timeline.get('timeline_start_tc', None)
+
+            # loop through the markers
+            for marker in timeline['markers']:
+
+                # add the marker name and note to the search corpus
+                if timeline['markers'][marker].get('name', None) or timeline['markers'][marker].get('note', None):
+
+                    marker_name = timeline['markers'][marker].get('name', None) + '\n' \
+                        if timeline['markers'][marker].get('name', None) else ''
+
+                    marker_content = "{} {}".format(marker_name, timeline['markers'][marker].get('note', None))
+
+                    # don't add if it's empty
+                    if marker_content == " ":
+                        continue
+
+                    # remember the project file path and the marker name
+                    # this is the marker index relative to the whole search corpus that
+                    general_segment_index = len(search_corpus_phrases)
+
+                    # add the marker name to the search corpus
+                    search_corpus_phrases.append(marker_content)
+
+                    # add the marker to the search corpus association list
+                    search_corpus_assoc[general_segment_index] = {'file_path': project_file_path,
+                                                                  'text': marker_content,
+                                                                  'timeline': timeline_name,
+                                                                  'project': project_file_data[
+                                                                      'name'],
+                                                                  'timeline_fps': timeline_fps,
+                                                                  'timeline_start_tc': timeline_start_tc,
+                                                                  'marker_index': marker,
+                                                                  'type': 'marker'
+                                                                  }
+
+    return search_corpus_phrases, search_corpus_assoc
+
+
+def get_file_cache_path(cache_dir, file_path, **cache_options):
+    """
+    Returns the path of the cache file for the phrases extracted from a file
+
+    :param cache_dir: the search corpus cache directory
+    :param file_path: the path of the source file
+    :param cache_options: any other options that change the extracted phrases (for eg. use_analyzer)
+    """
+
+    cache_id = hashlib.md5(
+        json.dumps({'file_path': os.path.abspath(file_path), **cache_options}, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+
+    return os.path.join(cache_dir, 'corpus_{}.json'.format(cache_id))
+
+
+def _get_file_signature(file_path):
+    """
+    We use the modification time and the size of the file to know if it changed since it was cached
+    """
+
+    file_stat = os.stat(file_path)
+
+    return [file_stat.st_mtime_ns, file_stat.st_size]
+
+
+def load_file_cache(cache_dir, file_path, **cache_options):
+    """
+    Returns the cached phrases and association of a file, or None if the file changed since it was cached
+    """
+
+    cache_file_path = get_file_cache_path(cache_dir, file_path, **cache_options)
+
+    if not os.path.isfile(cache_file_path):
+        return None
+
+    try:
+        with open(cache_file_path, 'r', encoding='utf-8') as f:
+            cache_data = json.load(f)
+
+        if cache_data.get('signature', None) != _get_file_signature(file_path):
+            return None
+
+        # json turns the integer keys into strings, so we need to turn them back
+        search_corpus_assoc = {int(idx): phrase_assoc for idx, phrase_assoc in cache_data['assoc'].items()}
+
+        return cache_data['phrases'], search_corpus_assoc
+
+    except Exception:
+        logger.debug('Could not load search corpus cache file {}.'.format(cache_file_path), exc_info=True)
+        return None
+
+
+def save_file_cache(cache_dir, file_path, search_corpus_phrases, search_corpus_assoc, **cache_options):
+    """
+    Saves the phrases and association extracted from a file to the cache
+    """
+
+    cache_file_path = get_file_cache_path(cache_dir, file_path, **cache_options)
+
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        # write to a temporary file first, so we never end up with half a cache file
+        temp_file_path = '{}.tmp'.format(cache_file_path)
+        with open(temp_file_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'file_path': file_path,
+                'signature': _get_file_signature(file_path),
+                'phrases': search_corpus_phrases,
+                'assoc': search_corpus_assoc
+            }, f)
+
+        os.replace(temp_file_path, cache_file_path)
+
+    except Exception:
+        logger.debug('Could not save search corpus cache file {}.'.format(cache_file_path), exc_info=True)
+        return False
+
+    return True
@@ -50,7 +50,7 @@ def speaker_changed(segment1_embedding, segment2_embedding, threshold=0.3):
 
 def detect_speaker_changes(
         segments, audio_file_path, threshold=0.3, device_name=None, time_intervals=None, speaker_id_offset=0,
-        step_by_step=False):
+        step_by_step=False, audio_cache=None):
     """
     Detect speaker changes in a list of segments and adds the speaker_id to the segments.
 
@@ -64,6 +64,8 @@ def detect_speaker_changes(
             - if None, the entire audio file will be used
     :param: speaker_id_offset: the offset to use for the speaker IDs (default: 0)
     :param: step_by_step: if True, the function will yield the segments and speaker embeddings after each iteration
+    :param: audio_cache: the AudioCache to read the decoded audio from (default: None)
+            - if None, or if the audio can't be cached, the audio is read from the source file
     """
 
     if segments is None or not isinstance(segments, list) or len(segments) == 0:
@@ -101,12 +103,23 @@ def detect_speaker_changes(
     model = PretrainedSpeakerEmbedding("speechbrain/spkrec-ecapa-voxceleb", device=torch.device(torch_device))
     audio = Audio(sample_rate=16000, mono="downmix")
 
-    # try to see if we can handle the audio file natively
+    # use the cached audio if it's already there (the crops are then just views of the memory-mapped audio)
+    cached_audio_array = audio_cache.get_cached_audio(audio_file_path) if audio_cache is not None else None
+
+    if cached_audio_array is not None:
+        audio_file = {"waveform": torch.from_numpy(cached_audio_array).unsqueeze(0),
+                      "sample_rate": audio_cache.sample_rate}
+
+    # otherwise, try to see if we can handle the audio file natively
     # for that, we just perform a test crop of a second
-    try:
-        audio.crop(audio_file_path, Segment(0, 1))
-        audio_file = audio_file_path
-    except:
+    else:
+        try:
+            audio.crop(audio_file_path, Segment(0, 1))
+            audio_file = audio_file_path
+        except:
+            audio_file = None
+
+    if audio_file is None:
 
         logger.debug('Falling back to Librosa for {} due to audio format.'
                      .format(os.path.basename(audio_file_path)))
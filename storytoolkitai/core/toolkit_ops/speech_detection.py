@@ -0,0 +1,252 @@
+import math
+from threading import Lock
+
+import numpy as np
+import torch
+
+from storytoolkitai.core.logger import logger
+
+
+class SpeechDetector:
+    """
+    This detects the speech in the audio using the Silero VAD model (ONNX).
+
+    The model is loaded only once per process and then it's reused for all the queue items
+    (the model keeps its state between the windows of the audio, so only one detection can run at a time).
+
+    The audio is read in chunks and a batch of chunks is analyzed at once:
+    each chunk is a row in the batch, so the model analyzes one window of each chunk in a single call,
+    instead of one window of the audio at a time.
+    """
+
+    _instance = None
+    _instance_lock = Lock()
+
+    # the number of samples the model analyzes at once (for 16kHz audio)
+    window_size_samples = 512
+
+    def __new__(cls):
+
+        with cls._instance_lock:
+
+            # only one detector per process
+            if cls._instance is None:
+                cls._instance = super(SpeechDetector, cls).__new__(cls)
+
+        return cls._instance
+
+    def __init__(self):
+
+        # prevent initializing the instance more than once
+        if hasattr(self, '_initialized') and self._initialized:
+            return
+
+        self._vad_model = None
+
+        # the model can only be used by one detection at a time
+        self._lock = Lock()
+
+        self._initialized = True
+
+    @property
+    def vad_model(self):
+        """
+        This loads the VAD model the first time it's needed
+        """
+
+        if self._vad_model is None:
+
+            with self._instance_lock:
+
+                if self._vad_model is None:
+
+                    try:
+                        self._vad_model, _ = torch.hub.load(
+                            repo_or_dir='snakers4/silero-vad', model='silero_vad', force_reload=False,
+                            onnx=True, trust_repo=True, verbose=False)
+
+                    except (PermissionError, FileNotFoundError):
+                        logger.error(
+                            'Could not load the VAD model. There might be an issue with your cache folder. ',
+                            exc_info=True
+                        )
+
+                        logger.error('Try running the tool with Administrator rights '
+                                     'or try deleting the cache folder mentioned in the error.')
+
+                        # pass the error to whatever called this function
+                        raise
+
+        return self._vad_model
+
+    def get_speech_probabilities(self, chunks, sample_rate=16_000):
+        """
+        This returns the speech probability of each window of each chunk
+        (the chunks are analyzed together, as the rows of a batch)
+
+        :param chunks: a list of mono float32 audio arrays
+        :param sample_rate: the sample rate of the audio
+        :return: a list with an array of probabilities for each chunk
+        """
+
+        window_size_samples = self.window_size_samples
+
+        # pad the chunks with silence to the same number of windows
+        window_count = max([math.ceil(len(chunk) / window_size_samples) for chunk in chunks])
+
+        batch = np.zeros((len(chunks), window_count * window_size_samples), dtype=np.float32)
+        for row, chunk in enumerate(chunks):
+            batch[row, :len(chunk)] = chunk
+
+        batch = torch.from_numpy(batch)
+
+        probabilities = np.empty((len(chunks), window_count), dtype=np.float32)
+
+        with self._lock, torch.no_grad():
+
+            # each chunk starts with a clean state
+            self.vad_model.reset_states()
+
+            for window_index in range(window_count):
+
+                window_start = window_index * window_size_samples
+
+                probabilities[:, window_index] = self.vad_model(
+                    batch[:, window_start:window_start + window_size_samples], sample_rate).reshape(-1).numpy()
+
+        return [probabilities[row, :math.ceil(len(chunk) / window_size_samples)]
+                for row, chunk in enumerate(chunks)]
+
+    def get_speech_timestamps(self, probabilities, audio_length, sample_rate=16_000,
+                              threshold=0.5, speech_pad_ms=30, min_speech_duration_ms=250,
+                              min_silence_duration_ms=100):
+        """
+        This turns the speech probabilities of the windows of an audio chunk into the speech timestamps
+        (just like the get_speech_timestamps function that comes with the Silero VAD model)
+
+        :param probabilities: the speech probability of each window
+        :param audio_length: the number of samples in the audio chunk
+        :return: a list of [start_sample, end_sample] lists
+        """
+
+        window_size_samples = self.window_size_samples
+
+        negative_threshold = threshold - 0.15
+        min_speech_samples = sample_rate * min_speech_duration_ms / 1000
+        min_silence_samples = sample_rate * min_silence_duration_ms / 1000
+        speech_pad_samples = int(sample_rate * speech_pad_ms / 1000)
+
+        speeches = []
+        current_speech = None
+        temp_end = 0
+
+        for window_index, probability in enumerate(probabilities):
+
+            window_start = window_size_samples * window_index
+
+            # the speech continues after a short silence
+            if probability >= threshold and temp_end:
+                temp_end = 0
+
+            if probability >= threshold and current_speech is None:
+                current_speech = [window_start, None]
+                continue
+
+            if probability < negative_threshold and current_speech is not None:
+
+                if not temp_end:
+                    temp_end = window_start
+
+                # the silence is too short to end the speech
+                if window_start - temp_end < min_silence_samples:
+                    continue
+
+                current_speech[1] = temp_end
+
+                if current_speech[1] - current_speech[0] > min_speech_samples:
+                    speeches.append(current_speech)
+
+                current_speech = None
+                temp_end = 0
+
+        # the speech goes until the end of the chunk
+        if current_speech is not None and audio_length - current_speech[0] > min_speech_samples:
+            current_speech[1] = audio_length
+            speeches.append(current_speech)
+
+        # pad the speeches (but don't let them overlap)
+        for speech_index, speech in enumerate(speeches):
+
+            if speech_index == 0:
+                speech[0] = max(0, speech[0] - speech_pad_samples)
+
+            if speech_index != len(speeches) - 1:
+
+                silence_duration = speeches[speech_index + 1][0] - speech[1]
+
+                if silence_duration < 2 * speech_pad_samples:
+                    speech[1] += silence_duration // 2
+                    speeches[speech_index + 1][0] = max(0, speeches[speech_index + 1][0] - silence_duration // 2)
+
+                else:
+                    speech[1] = min(audio_length, speech[1] + speech_pad_samples)
+                    speeches[speech_index + 1][0] = max(0, speeches[speech_index + 1][0] - speech_pad_samples)
+
+            else:
+                speech[1] = min(audio_length, speech[1] + speech_pad_samples)
+
+        return speeches
+
+    def detect(self, audio_stream, batch_size=16, progress_callback=None, **kwargs):
+        """
+        This detects the speech in the audio read by an AudioStreamReader (or an AudioArrayReader)
+
+        :param audio_stream: the audio reader
+        :param batch_size: how many chunks of the audio to analyze at once
+        :param progress_callback: this is called with the progress (0-100) after each batch,
+                                  if it returns something falsy, the detection is canceled
+        :param kwargs: threshold, speech_pad_ms etc. (see get_speech_timestamps)
+        :return: a list of [start_time, end_time] (seconds), or None if the detection was canceled
+        """
+
+        sample_rate = audio_stream.sample_rate
+        total_duration = audio_stream.duration
+
+        speech_timestamps = []
+
+        def detect_batch(batch):
+
+            for (chunk_start, chunk), chunk_probabilities \
+                    in zip(batch, self.get_speech_probabilities([chunk for _, chunk in batch], sample_rate)):
+
+                speech_timestamps.extend(
+                    [[(chunk_start + start_sample) / sample_rate, (chunk_start + end_sample) / sample_rate]
+                     for start_sample, end_sample
+                     in self.get_speech_timestamps(chunk_probabilities, len(chunk), sample_rate, **kwargs)]
+                )
+
+            if progress_callback is None:
+                return True
+
+            last_chunk_start, last_chunk = batch[-1]
+            progress = min(100, int((last_chunk_start + len(last_chunk)) / sample_rate / total_duration * 100)) \
+                if total_duration else 0
+
+            return progress_callback(progress)
+
+        batch = []
+        for chunk_start, chunk in audio_stream:
+
+            batch.append((chunk_start, chunk))
+
+            if len(batch) >= batch_size:
+
+                if not detect_batch(batch):
+                    return None
+
+                batch = []
+
+        if batch and not detect_batch(batch):
+            return None
+
+        return speech_timestamps
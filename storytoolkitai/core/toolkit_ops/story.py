@@ -12,14 +12,20 @@ from threading import Timer
 from timecode import Timecode
 
 from storytoolkitai.core.logger import logger
-from .transcription import Transcription
+from .transcription import TranscriptionReader
 from .media import MediaItem
+from .instance_registry import InstanceRegistry
 from storytoolkitai.core.toolkit_ops.timecode import sec_to_tc, tc_to_sec
 
 
 class Story:
-    
-    _instances = {}
+
+    # the stories that were loaded, so we don't load the same file twice
+    # (the registry only keeps the most recently used clean stories alive)
+    _instances = InstanceRegistry(
+        name='stories',
+        pin_check=lambda instance: instance.is_dirty() or instance._save_timer is not None
+    )
     
     def __new__(cls, *args, **kwargs):
         """
@@ -31,15 +37,18 @@ class Story:
         story_path_id = cls.get_story_path_id(*args, **kwargs)
 
         # if the story file path is already loaded in an instance, we return that instance
-        if story_path_id in cls._instances:
+        if (instance := cls._instances.get(story_path_id)) is not None:
 
-            return cls._instances[story_path_id]
+            return instance
 
         # otherwise we create a new instance
         instance = super().__new__(cls)
 
-        # and we store it in the instances dict
-        cls._instances[story_path_id] = instance
+        # and we store it in the instances registry
+        cls._instances.put(
+            story_path_id, instance,
+            size=InstanceRegistry.file_size(kwargs.get('story_file_path', None) or (args[0] if args else None))
+        )
 
         # then we return the instance
         return instance
@@ -109,16 +118,6 @@ class Story:
         # add this to know that we already initialized this instance
         self._initialized = True
 
-    def __del__(self):
-        """
-        Make sure we remove this from the instances dict when it's deleted
-        """
-
-        # if we're deleting the instance that is stored in the instances dict
-        # we remove it from the dict, so we don't have a reference to a deleted object
-        if self.__class__._instances[self.story_path_id] == self:
-            del self.__class__._instances[self.story_path_id]
-
     @property
     def language(self):
         return self._language
@@ -187,6 +186,16 @@ class Story:
     def set_dirty(self, value=True):
         self._dirty = value
 
+    def pin(self):
+        """
+        This keeps the story alive in the instances registry until it's unpinned
+        (for eg. while it's open in a window), so we keep getting this instance for its file
+        """
+        return self._instances.pin(self._story_path_id)
+
+    def unpin(self):
+        self._instances.unpin(self._story_path_id)
+
     def set(self, key: str or dict, value=None):
         """
         We use this to set some of the attributes of the story.
@@ -1122,7 +1131,8 @@ class StoryUtils:
 
                 # try to use the transcription timeline name as the file name
                 try:
-                    source_transcription = Transcription(transcription_file_path=line.transcription_file_path)
+                    source_transcription = TranscriptionReader(
+                        transcription_file_path=line.transcription_file_path, header_only=True)
 
                     if source_transcription.timeline_name:
                         file_name = source_transcription.timeline_name
@@ -10,6 +10,7 @@ from threading import Thread
 
 import torch
 import storytoolkitai.integrations.mots_whisper as whisper
+from storytoolkitai.integrations.mots_faster_whisper import FasterWhisperModel, WHISPER_ENGINES
 from whisper import tokenizer as whisper_tokenizer
 
 from transformers import pipeline
@@ -32,6 +33,7 @@ from .projects import Project, get_projects_from_path, ProjectUtils
 from .transcription import Transcription, TranscriptionSegment, TranscriptionUtils
 from .story import Story, StoryLine, StoryUtils
 from .document import Document
+from .instance_registry import InstanceRegistry
 from .processing_queue import ProcessingQueue
 from .search import ToolkitSearch, SearchItem, TextSearch, VideoSearch, cv2
 from .assistant import ToolkitAssistant, AssistantUtils
@@ -48,7 +50,11 @@ import numpy as np
 
 from .monitor import Monitor
 from .videoanalysis import ClipIndex
+from .video_index_manifest import VideoIndexManifest
 from .media import MediaItem, VideoFileClip, AudioFileClip
+from .audio_stream import AudioStreamReader, AudioArrayReader, StreamedAudioSegments
+from .audio_cache import AudioCache
+from .speech_detection import SpeechDetector
 
 
 def is_arm64_mac():
@@ -276,6 +282,11 @@ class ToolkitOps:
         # use this to store the whisper model later
         self.whisper_model = None
 
+        # the engine that runs the whisper model (openai or ctranslate2)
+        # this can also be changed for each transcription, see _initialize_whisper_transcribe
+        self.whisper_engine = self.stAI.get_app_setting(setting_name='whisper_engine', default_if_none='openai')
+        self.whisper_engine_model_path = None
+
         # load the whisper model from the config
         # we're recommending the medium model for better accuracy vs. time it takes to process
         # if in doubt use the large model but that will need more time
@@ -297,6 +308,18 @@ class ToolkitOps:
         # it's very likely that the model will not be loaded here, but in the SearchItem, for each search
         self.s_semantic_search_model = None
 
+        # limit how many loaded transcriptions, stories, documents and search items we keep in memory
+        # (dirty items and items that are still used somewhere else are kept regardless of these limits)
+        InstanceRegistry.configure(
+            max_items=self.stAI.get_app_setting(setting_name='instance_cache_max_items', default_if_none=64),
+            max_size=int(self.stAI.get_app_setting(setting_name='instance_cache_max_size_mb', default_if_none=512))
+            * 1024 * 1024
+        )
+
+        # save the transcription files in the compact format if the user wants it
+        Transcription.compact_file_format = \
+            bool(self.stAI.get_app_setting(setting_name='transcription_compact_format', default_if_none=False))
+
         # add observers so that we can trigger certain actions when something else happens
         # this dictionary will hold all the actions and their observers (for e.g. from the UI)
         self._observers = {}
@@ -741,15 +764,15 @@ class ToolkitOps:
 
                 kwargs['item_type'] = 'transcription'
 
-                speaker_detection_queue_id = self.processing_queue.add_to_queue(**kwargs)
-
-                # add the generated queue id to the list to the queued list
-                all_added_queue_ids.append(speaker_detection_queue_id)
-
                 # add the main transcription queue item as a dependency to the speaker detection queue item
                 # this way, when the transcription is done, the speaker detection item will start
                 # and retrieve all the data from the transcription queue item
-                self.processing_queue.add_dependency(queue_id=speaker_detection_queue_id, dependency_id=next_queue_id)
+                # (the dependency is added together with the item, so the item never starts before it)
+                speaker_detection_queue_id = self.processing_queue.add_to_queue(
+                    **{**kwargs, 'dependencies': [next_queue_id]})
+
+                # add the generated queue id to the list to the queued list
+                all_added_queue_ids.append(speaker_detection_queue_id)
 
             # if we need to group questions, add the group questions tasks too
             if kwargs.get('transcription_group_questions', False):
@@ -760,15 +783,15 @@ class ToolkitOps:
 
                 kwargs['item_type'] = 'transcription'
 
-                group_questions_queue_id = self.processing_queue.add_to_queue(**kwargs)
-
-                # add the generated queue id to the list to the queued list
-                all_added_queue_ids.append(group_questions_queue_id)
-
                 # add the main transcription queue item as a dependency to the group questions queue item
                 # this way, when the transcription is done, the group questions item will start
                 # and retrieve all the all the data from the transcription queue item
-                self.processing_queue.add_dependency(queue_id=group_questions_queue_id, dependency_id=next_queue_id)
+                # (the dependency is added together with the item, so the item never starts before it)
+                group_questions_queue_id = self.processing_queue.add_to_queue(
+                    **{**kwargs, 'dependencies': [next_queue_id]})
+
+                # add the generated queue id to the list to the queued list
+                all_added_queue_ids.append(group_questions_queue_id)
 
         # return the queue ids
         return all_added_queue_ids
@@ -879,6 +902,15 @@ class ToolkitOps:
 
         return sorted(available_languages)
 
+    @staticmethod
+    def get_instance_cache_stats():
+        """
+        This returns the hits, misses, evictions etc. of the loaded transcriptions, stories, documents
+        and search items registries, so we can tune the instance cache limits
+        """
+
+        return InstanceRegistry.get_all_stats()
+
     def torch_device_type_select(self, device=None):
         '''
         A standardized way of selecting the right Torch device type
@@ -967,44 +999,65 @@ class ToolkitOps:
 
         sample_rate = kwargs.get('sample_rate', 16_000)
 
-        # Removes silences from the audio file.
-        # This results in better transcription quality, without hallucinations.
-        try:
-            vad_model, utils = torch.hub.load(repo_or_dir='snakers4/silero-vad', model='silero_vad', force_reload=False,
-                                              onnx=True, trust_repo=True, verbose=False)
-            (get_speech_timestamps, _, read_audio, _, collect_chunks) = utils
-
-        except (PermissionError, FileNotFoundError):
-            logger.error(
-                'Could not load the VAD model. There might be an issue with your cache folder. ',
-                exc_info=True
-            )
-
-            logger.error('Try running the tool with Administrator rights '
-                         'or try deleting the cache folder mentioned in the error.')
-
-            # pass the error to whatever called this function
-            raise
-
-        # convert the audio_segment to a torch tensor
         # if the audio segment is a list containing the start time, end time and the audio array,
         #  we only take the audio array
         if isinstance(audio_segment, list) and len(audio_segment) == 3:
-            audio_segment_torch = torch.from_numpy(audio_segment[2])
-        else:
-            audio_segment_torch = torch.from_numpy(audio_segment)
+            audio_segment = audio_segment[2]
+
+        # the audio is already in memory, so the chunks are just views of the array
+        return self.get_speech_intervals_from_stream(
+            AudioArrayReader(np.asarray(audio_segment, dtype=np.float32), sample_rate=sample_rate, chunk_duration=60),
+            **kwargs)
 
-        speech_timestamps = get_speech_timestamps(audio_segment_torch, vad_model,
-                                                  sampling_rate=sample_rate,
-                                                  window_size_samples=512,
-                                                  speech_pad_ms=kwargs.get('silence_threshold', 200),
-                                                  threshold=kwargs.get('silence_threshold', 0.5),
-                                                  )
+    def get_speech_intervals_from_stream(self, audio_stream, queue_id=None, **kwargs):
+        """
+        Returns the start and end times of the segments of speech in the audio decoded by an AudioStreamReader,
+        but it runs the speech detection on batches of audio chunks as they're decoded,
+        so the audio of the whole file is never kept in memory
+
+        The VAD model is loaded only once and then it's reused by all the queue items (see SpeechDetector).
+
+        :param audio_stream: the AudioStreamReader (or AudioArrayReader)
+        :param queue_id: the queue item (to report the progress and to stop if it was canceled)
+        :return: a list of start and end times of the segments of speech, or None if the queue item was canceled
+        """
+
+        def detection_progress(progress):
+
+            if queue_id is None:
+                return True
+
+            # cancel speech detection if user requested it
+            if self.processing_queue.cancel_if_canceled(queue_id=queue_id):
+                return False
+
+            self.processing_queue.update_queue_item(queue_id=queue_id, save_to_file=False, progress=progress)
+
+            return True
+
+        # stop before loading the model if the item was canceled in the meantime
+        if not detection_progress(0):
+            return None
+
+        speech_timestamps = SpeechDetector().detect(
+            audio_stream,
+            batch_size=self.stAI.get_app_setting(setting_name='vad_batch_size', default_if_none=16),
+            progress_callback=detection_progress,
+            speech_pad_ms=kwargs.get('silence_threshold', 200),
+            threshold=kwargs.get('silence_threshold', 0.5)
+        )
+
+        # the speech detection was canceled
+        if speech_timestamps is None:
+            return None
+
+        if queue_id is not None:
+            self.processing_queue.update_queue_item(queue_id=queue_id, save_to_file=False, progress='')
 
-        # convert speech_timestamps to seconds using the sample rate
-        # the speech_timestamps format is [{'start': start_time, 'end': end_time], ...]
-        speech_timestamps = [[speech_timestamp['start'] / sample_rate, speech_timestamp['end'] / sample_rate]
-                             for speech_timestamp in speech_timestamps]
+        # the speech that continues in the next chunk is combined with it below
+        return self._combine_speech_intervals(speech_timestamps, **kwargs)
+
+    def _combine_speech_intervals(self, speech_timestamps, **kwargs):
 
         # if there are no speech_timestamps, return an empty list
         if not speech_timestamps:
@@ -1664,7 +1717,8 @@ class ToolkitOps:
             device_name=kwargs.get('device', None),
             time_intervals=kwargs.get('time_intervals', None),
             speaker_id_offset=speaker_id_offset,
-            step_by_step=True
+            step_by_step=True,
+            audio_cache=self.get_audio_cache()
         ):
             processed_segments += 1
 
@@ -1768,16 +1822,85 @@ class ToolkitOps:
 
         # the total duration of the audio is the sum of the durations of each audio segment
         # the duration of each audio segment is the end time minus the start time
-        total_duration = sum([audio_segment[1] - audio_segment[0] for audio_segment in audio_segments])
+        # (the streamed segments are only decoded while we go through them, so we use their time intervals)
+        if isinstance(audio_segments, StreamedAudioSegments):
+            total_duration = audio_segments.total_duration
+        else:
+            total_duration = sum([audio_segment[1] - audio_segment[0] for audio_segment in audio_segments])
 
-        # transcribe each audio segment
-        previous_progress = 0
-        next_segment_id = 0 if not transcription else transcription.generate_new_segment_id()
-        for audio_segment in audio_segments:
+        # only send to whisper the options that it knows
+        decoding_options = self.whisper_options(**other_options.get('whisper_options', {}))
 
-            if len(audio_segment) != 3:
-                logger.warning('Audio segment must be a list of [start, end, audio]')
-                continue
+        # do not send an empty string as the language
+        if 'language' in decoding_options and (
+                not isinstance(decoding_options['language'], str)
+                or decoding_options['language'] is None
+                or decoding_options['language'] == ''
+        ):
+            del decoding_options['language']
+
+        def valid_audio_segments():
+
+            for audio_segment in audio_segments:
+
+                if len(audio_segment) != 3:
+                    logger.warning('Audio segment must be a list of [start, end, audio]')
+                    continue
+
+                # pre process the audio segment
+                yield self.pre_process_audio_segment(audio_segment, **other_options)
+
+        def transcribe_one_by_one():
+
+            # get the progress of the transcription so far,
+            # so we can pass it to the next audio segment for the progress calculation
+            previous_progress = 0
+
+            for audio_segment in valid_audio_segments():
+
+                # run whisper transcribe on the audio segment
+                segment_result = self.whisper_model.transcribe(
+                    audio_segment[2],
+                    task=task,
+                    verbose=True,
+                    queue_id=queue_id,
+                    toolkit_ops_obj=self,
+                    total_duration=total_duration,
+                    audio_segment_duration=audio_segment[1] - audio_segment[0],
+                    previous_progress=previous_progress,
+                    **decoding_options
+                )
+
+                yield audio_segment, segment_result
+
+                previous_progress = self.transcription_progress(queue_id)
+
+        # when we have more than one segment, whisper can decode the windows of multiple segments together
+        # (but the windows are no longer conditioned on the previous text of their segment)
+        whisper_batch_size = self.stAI.get_app_setting(setting_name='whisper_batch_size', default_if_none=1)
+
+        if isinstance(whisper_batch_size, int) and whisper_batch_size > 1:
+
+            logger.debug('Transcribing in batches of up to {} audio segments.'.format(whisper_batch_size))
+
+            transcribed_segments = self.whisper_model.transcribe_batched(
+                valid_audio_segments(),
+                batch_size=whisper_batch_size,
+                task=task,
+                verbose=True,
+                queue_id=queue_id,
+                toolkit_ops_obj=self,
+                total_duration=total_duration,
+                previous_progress=0,
+                **decoding_options
+            )
+
+        else:
+            transcribed_segments = transcribe_one_by_one()
+
+        # process the result of each audio segment
+        next_segment_id = 0 if not transcription else transcription.generate_new_segment_id()
+        for audio_segment, result in transcribed_segments:
 
             # the start and end times of the audio segment which we will use to offset the results below
             audio_segment_start = audio_segment[0]
@@ -1787,32 +1910,6 @@ class ToolkitOps:
             if transcription is not None:
                 transcription.delete_segments_between(start=audio_segment_start, end=audio_segment_end)
 
-            # pre process the audio segment
-            audio_segment = self.pre_process_audio_segment(audio_segment, **other_options)
-
-            # only send to whisper the options that it knows
-            decoding_options = self.whisper_options(**other_options.get('whisper_options', {}))
-
-            # do not send an empty string as the language
-            if 'language' in decoding_options and (
-                    not isinstance(decoding_options['language'], str)
-                    or decoding_options['language'] is None
-                    or decoding_options['language'] == ''
-            ):
-                del decoding_options['language']
-
-            # run whisper transcribe on the audio segment
-            result = self.whisper_model.transcribe(audio_segment[2],
-                                                   task=task,
-                                                   verbose=True,
-                                                   queue_id=queue_id,
-                                                   toolkit_ops_obj=self,
-                                                   total_duration=total_duration,
-                                                   audio_segment_duration=audio_segment[1] - audio_segment[0],
-                                                   previous_progress=previous_progress,
-                                                   **decoding_options
-                                                   )
-
             # remove word timestamps from final transcription until we implement word-based editing
             other_options['post_remove_word_timestamps'] = \
                 other_options.get('post_remove_word_timestamps', True)
@@ -1820,10 +1917,6 @@ class ToolkitOps:
             # post process the result for this audio segment
             result = self.post_process_whisper_result(audio_segment[2], result, **other_options)
 
-            # get the progress of the transcription so far,
-            # so we can pass it to the next audio segment for the progress calculation
-            previous_progress = self.transcription_progress(queue_id)
-
             # now process the result and add the original start time offset
             # to each transcript segment start and end times
 
@@ -1912,6 +2005,23 @@ class ToolkitOps:
             audio_segments, new_time_intervals = self.split_audio_by_intervals(audio_array, time_intervals, sr)
             return audio_segments, new_time_intervals
 
+        new_time_intervals = self.exclude_intervals(time_intervals, excluded_time_intervals)
+
+        # split the audio array by the new time intervals
+        audio_segments, new_time_intervals = self.split_audio_by_intervals(audio_array, new_time_intervals, sr)
+
+        return audio_segments, new_time_intervals
+
+    @staticmethod
+    def exclude_intervals(time_intervals, excluded_time_intervals):
+        """
+        Removes the excluded_time_intervals from the time_intervals
+        and returns the remaining time intervals
+        """
+
+        if not (excluded_time_intervals and time_intervals):
+            return time_intervals
+
         # sort the time intervals by start time
         excluded_time_intervals.sort(key=lambda x: x[0])
 
@@ -1949,10 +2059,7 @@ class ToolkitOps:
             # add the temp intervals to the new time intervals
             new_time_intervals.extend(temp_intervals)
 
-        # split the audio array by the new time intervals
-        audio_segments, new_time_intervals = self.split_audio_by_intervals(audio_array, new_time_intervals, sr)
-
-        return audio_segments, new_time_intervals
+        return new_time_intervals
 
     def _initialize_whisper_transcribe(self, queue_id=None, **other_options):
         """
@@ -1967,15 +2074,36 @@ class ToolkitOps:
 
             torch_device_changed = True
 
-        # load OpenAI Whisper model
-        # if it wasn't loaded before, if the model name changed (via other_options) or if the torch device changed
+        # the engine and the engine model path can be passed for each transcription,
+        # otherwise we use the ones from the config
+        whisper_engine = other_options.get('whisper_engine', None) \
+            or self.stAI.get_app_setting(setting_name='whisper_engine', default_if_none='openai')
+
+        if whisper_engine not in WHISPER_ENGINES:
+            logger.warning('Unknown Whisper engine {}. Using openai instead.'.format(whisper_engine))
+            whisper_engine = 'openai'
+
+        # the CTranslate2 engine can load a converted (for eg. int8 quantized) model from a local path
+        whisper_engine_model_path = (
+            other_options.get('whisper_engine_model_path', None)
+            or self.stAI.get_app_setting(setting_name='whisper_ct2_model_path', default_if_none=None)
+        ) if whisper_engine == 'ctranslate2' else None
+
+        # load the Whisper model
+        # if it wasn't loaded before, if the model name changed (via other_options), if the torch device changed
+        # or if the engine (or the engine model) changed
         if self.whisper_model is None \
                 or ('model_name' in other_options and self.whisper_model_name != other_options['model_name']) \
-                or torch_device_changed:
+                or torch_device_changed \
+                or self.whisper_engine != whisper_engine \
+                or self.whisper_engine_model_path != whisper_engine_model_path:
 
             # use the model name that was passed in the call or the one that's already set
             self.whisper_model_name = other_options.get('model_name', self.whisper_model_name)
 
+            self.whisper_engine = whisper_engine
+            self.whisper_engine_model_path = whisper_engine_model_path
+
             # update the status of the item in the queue
             self.processing_queue.update_queue_item(queue_id=queue_id, status='loading {} model'
                                                     .format(self.whisper_model_name))
@@ -1985,11 +2113,20 @@ class ToolkitOps:
                 return None
 
             # if the Whisper transformer model was never downloaded, log that we're downloading it
+            # each engine downloads its own model files, so we keep track of the downloads separately
+            # (the openai engine keeps the setting name it always had)
+            # but nothing is downloaded if the ctranslate2 engine loads a model from a local path
+            model_downloaded_setting_name = 'whisper_model_downloaded_{}'.format(self.whisper_model_name) \
+                if self.whisper_engine == 'openai' \
+                else 'whisper_model_downloaded_{}_{}'.format(self.whisper_engine, self.whisper_model_name)
+
+            if self.whisper_engine_model_path and os.path.exists(self.whisper_engine_model_path):
+                model_downloaded_setting_name = None
+
             model_downloaded_before = True
-            if self.stAI.get_app_setting(setting_name='whisper_model_downloaded_{}'
-                    .format(self.whisper_model_name),
-                                         default_if_none=False
-                                         ) is False:
+            if model_downloaded_setting_name is not None \
+                    and self.stAI.get_app_setting(setting_name=model_downloaded_setting_name,
+                                                  default_if_none=False) is False:
                 logger.warning('The whisper {} model may need to be downloaded and could take a while '
                                'depending on the Internet connection speed. '
                                .format(self.whisper_model_name)
@@ -2004,9 +2141,11 @@ class ToolkitOps:
             if self.processing_queue.cancel_if_canceled(queue_id=queue_id):
                 return None
 
-            logger.info('Loading Whisper {} model.'.format(self.whisper_model_name))
+            logger.info('Loading Whisper {} model using the {} engine.'
+                        .format(self.whisper_model_name, self.whisper_engine))
             try:
-                self.whisper_model = whisper.load_model(self.whisper_model_name, device=self.torch_device)
+                self.whisper_model = self._load_whisper_model()
+
             except Exception as e:
                 fail_error = 'Error loading Whisper {} model: {}'.format(self.whisper_model_name, e)
                 logger.error(fail_error)
@@ -2014,12 +2153,16 @@ class ToolkitOps:
                 # update the status of the item in the transcription log
                 self.processing_queue.update_queue_item(queue_id=queue_id, status='failed', fail_error=fail_error)
 
+                # make sure we try to load the model again for the next transcription
+                self.whisper_model = None
+
+                return None
+
             # once the model has been loaded, we can note that in the app settings
             # this is a wat to keep track if the model has been downloaded or not
             # but it's not 100% reliable and we may need to find a better way to do this in the future
             if not model_downloaded_before:
-                self.stAI.save_config(setting_name='whisper_model_downloaded_{}'.format(self.whisper_model_name),
-                                      setting_value=True)
+                self.stAI.save_config(setting_name=model_downloaded_setting_name, setting_value=True)
 
             # let the user know if the whisper model is multilingual or english-only
             logger.info('Selected Whisper model "{}" is {}.'.format(
@@ -2033,12 +2176,49 @@ class ToolkitOps:
 
         return True
 
+    def _load_whisper_model(self):
+        """
+        This loads the Whisper model using the current engine:
+         - openai: the PyTorch model (see mots_whisper)
+         - ctranslate2: the CTranslate2 model (for eg. int8 weights for faster CPU transcriptions),
+           either from the whisper_engine_model_path or the one that faster-whisper downloads for the model name
+        """
+
+        if self.whisper_engine == 'ctranslate2':
+
+            # CTranslate2 only runs on CPU or CUDA
+            device = 'cuda' if str(self.torch_device).startswith('cuda') else 'cpu'
+
+            return FasterWhisperModel(
+                self.whisper_engine_model_path or self.whisper_model_name,
+                device=device,
+                compute_type=self.stAI.get_app_setting(setting_name='whisper_ct2_compute_type',
+                                                       default_if_none='int8'),
+                cpu_threads=self.stAI.get_app_setting(setting_name='whisper_ct2_cpu_threads', default_if_none=0)
+            )
+
+        return whisper.load_model(self.whisper_model_name, device=self.torch_device)
+
     def _split_audio_into_segments(self, audio_file_path, queue_id=None, **kwargs):
         """
         This splits the audio into segments that are suitable for Whisper
         It also takes into consideration any inclusion or exclusion intervals
         """
 
+        # use the cached audio or decode the audio only when it's needed,
+        # instead of loading the whole file in memory
+        audio_stream = self.get_audio_stream(audio_file_path)
+
+        if audio_stream is not None:
+
+            split_result = self._split_audio_stream_into_segments(audio_stream, queue_id=queue_id, **kwargs)
+
+            if split_result is not False:
+                return split_result
+
+            logger.warning('Cannot stream the audio of {}. Loading the whole file instead.'
+                           .format(os.path.basename(audio_file_path)))
+
         # load audio file as array using librosa
         # this should work for most audio formats
         try:
@@ -2089,7 +2269,11 @@ class ToolkitOps:
             logger.info('Pre-detecting speech intervals in {}.'.format(kwargs.get('name', 'audio file')))
 
             # perform speech detection
-            time_intervals = self.get_speech_intervals(audio_array)
+            time_intervals = self.get_speech_intervals(audio_array, queue_id=queue_id)
+
+            # the speech detection was canceled
+            if time_intervals is None:
+                return None, None
 
             # fail if no speech was detected
             if len(time_intervals) == 0:
@@ -2145,6 +2329,163 @@ class ToolkitOps:
 
         return audio_segments, time_intervals
 
+    def get_audio_cache(self):
+        """
+        This returns the AudioCache with the decoded audio of the source files (if it's enabled in the settings)
+        """
+
+        if not self.stAI.get_app_setting(setting_name='audio_cache_enabled', default_if_none=True):
+            return None
+
+        return AudioCache.from_settings(self.stAI)
+
+    def get_audio_stream(self, audio_file_path, sample_rate=16_000):
+        """
+        This returns a reader for the audio of the file:
+        an AudioArrayReader over the cached audio (if the cache is enabled and the audio was already cached),
+        or an AudioStreamReader which decodes the file while it's read (if streaming is enabled)
+        - if the cache is enabled, the streamed audio is also cached while it's read (see CachingAudioStream),
+        or None if the audio can't be read this way (so it needs to be loaded the old way)
+        """
+
+        audio_cache = self.get_audio_cache()
+
+        if audio_cache is not None and sample_rate == audio_cache.sample_rate:
+
+            # only use the audio that's already cached, we don't want to wait for the whole file to be decoded
+            audio_array = audio_cache.get_cached_audio(audio_file_path)
+
+            if audio_array is not None:
+                return AudioArrayReader(audio_array, sample_rate=sample_rate, path=audio_file_path)
+
+        if self.stAI.get_app_setting(setting_name='transcription_stream_audio', default_if_none=True):
+
+            audio_stream = AudioStreamReader(audio_file_path, sample_rate=sample_rate)
+
+            if audio_stream.backend is not None:
+
+                # fill the cache while the audio is streamed
+                if audio_cache is not None:
+                    return audio_cache.get_caching_stream(audio_stream)
+
+                return audio_stream
+
+        return None
+
+    def _split_audio_stream_into_segments(self, audio_stream, queue_id=None, **kwargs):
+        """
+        This works just like _split_audio_into_segments, but the audio is read in chunks
+        from an AudioStreamReader (or from the cached audio using an AudioArrayReader):
+        the speech detection runs on each chunk as it's decoded,
+        and the segments are cut from the audio stream only when they're transcribed (see StreamedAudioSegments)
+        so the memory we need depends on the length of the segments, not on the length of the file.
+
+        :return: the audio segments and the time intervals,
+                 (None, None) if the transcription can't continue, or False if the audio can't be streamed
+        """
+
+        # TIME INTERVALS PRE-PROCESSING starts here
+
+        # assume no time intervals
+        time_intervals = None
+
+        # if pre_detect_speech is True, detect speech intervals in the audio
+        if kwargs.get('pre_detect_speech', None):
+
+            # update the status of the item in the transcription log
+            self.processing_queue.update_queue_item(queue_id=queue_id, status='pre-detecting speech')
+
+            logger.info('Pre-detecting speech intervals in {}.'.format(kwargs.get('name', 'audio file')))
+
+            # the chunks of the audio are analyzed in batches by the speech detector
+            time_intervals = self.get_speech_intervals_from_stream(
+                audio_stream.with_chunk_duration(60), queue_id=queue_id)
+
+            # the speech detection was canceled
+            if time_intervals is None:
+                return None, None
+
+            # fail if no speech was detected
+            if len(time_intervals) == 0:
+                fail_error = 'No speech was detected in {}.'.format(kwargs.get('name', 'audio file'))
+                logger.info(fail_error)
+
+                # update the queue item status
+                if queue_id is not None:
+                    self.processing_queue.update_queue_item(queue_id=queue_id, status='failed', fail_error=fail_error)
+
+                return None, None
+
+        # if time_intervals was passed from the request, take them into consideration
+        # but only if they are not boolean (True or False)
+        if kwargs.get('time_intervals', None) \
+                and type(kwargs.get('time_intervals', None)) is not bool:
+
+            # if no time intervals were set before, use the ones from the request
+            if time_intervals is None:
+                time_intervals = kwargs['time_intervals']
+            else:
+                # intersect the time intervals from the request
+                # with the previously had time intervals (from speech for eg.)
+                time_intervals = \
+                    self.combine_overlapping_intervals(kwargs.get('time_intervals'), time_intervals)
+
+        # sort the time intervals and combine the overlapping ones (just like split_audio_by_intervals does)
+        if time_intervals and isinstance(time_intervals, list):
+            time_intervals = self.combine_intervals(sorted(time_intervals, key=lambda x: x[0]), 0)
+        else:
+            time_intervals = None
+
+        # exclude time intervals that need to be excluded
+        if kwargs.get('excluded_time_intervals', None) \
+                and type(kwargs.get('excluded_time_intervals', None)) is not bool:
+
+            # if we're transcribing the whole audio, we need to know where it ends
+            if time_intervals is None:
+
+                if not audio_stream.duration:
+                    return False
+
+                time_intervals = [[0, audio_stream.duration]]
+
+            time_intervals = self.exclude_intervals(time_intervals, kwargs.get('excluded_time_intervals'))
+
+            # nothing is left to transcribe
+            if not time_intervals:
+                fail_error = 'Nothing left to transcribe in {} after excluding the time intervals.'\
+                    .format(kwargs.get('name', 'audio file'))
+                logger.info(fail_error)
+
+                # update the queue item status
+                if queue_id is not None:
+                    self.processing_queue.update_queue_item(queue_id=queue_id, status='failed', fail_error=fail_error)
+
+                return None, None
+
+        # last chance to cancel if user requested it
+        # before the transcription process starts
+        if self.processing_queue.cancel_if_canceled(queue_id=queue_id):
+            return None, None
+
+        # in case no time intervals were set, this will go through the whole audio
+        # (the segments are only split if a transcription_max_segment_duration is set in the settings,
+        # since the splits are made at fixed times, regardless of the speech)
+        audio_segments = StreamedAudioSegments(
+            audio_stream, time_intervals,
+            max_segment_duration=self.stAI.get_app_setting(
+                setting_name='transcription_max_segment_duration') or None
+        )
+
+        time_intervals = audio_segments.time_intervals
+
+        if len(time_intervals) > 1:
+            logger.debug('Split audio {} into {} segments: {}'.format(
+                kwargs.get('name', 'from file'),
+                len(time_intervals),
+                ', '.join([str(float(x[0]))+'-'+str(float(x[1])) for x in time_intervals])))
+
+        return audio_segments, time_intervals
+
     def whisper_transcribe(self, name: str = None, audio_file_path: str = None, task=None,
                            target_dir=None, queue_id=None, return_path=False, **other_options) -> bool or str:
         """
@@ -2894,6 +3235,31 @@ class ToolkitOps:
 
         queue_id = kwargs.get('queue_id', None)
 
+        # detect, analyze and index the video while decoding it only once
+        if self.stAI.get_app_setting(setting_name='video_indexing_single_pass', default_if_none=True):
+
+            def single_pass_progress(**progress_kwargs):
+
+                # cancel indexing if user requested it
+                if self.processing_queue.cancel_if_canceled(queue_id=queue_id):
+                    return None
+
+                progress = int(
+                    int(progress_kwargs.get('current_frame_index', 1))
+                    / max(int(progress_kwargs.get('total_frames', 1)), 1) * 100)
+
+                # update status+progress
+                self.processing_queue.update_queue_item(queue_id=queue_id, status='indexing', progress=progress)
+
+                return True
+
+            if not index.index_video_single_pass(
+                    path=video_file_path, detection_options=detection_options,
+                    skip_empty=2, frame_progress_callback=single_pass_progress, **indexing_options):
+                return None
+
+            return self._save_video_index(index, transcription, transcription_file_path, **kwargs)
+
         def detect_progress(**progress_kwargs):
 
             # calculate the current progress in percent based on where we are in the total number of frames
@@ -2913,8 +3279,11 @@ class ToolkitOps:
             return True
 
         # STAGE 1 - detect scenes
-        shot_indexes = \
-            index.get_scene_changes(frame_progress_callback=detect_progress, **detection_options)
+        # (the ffmpeg backend streams small grayscale frames instead of seeking through the full size frames)
+        decode_backend = self.stAI.get_app_setting(setting_name='video_decode_backend', default_if_none='opencv')
+
+        shot_indexes = index.get_scene_changes(
+            frame_progress_callback=detect_progress, **{'decode_backend': decode_backend, **detection_options})
 
         def analyze_progress(**progress_kwargs):
 
@@ -2973,6 +3342,13 @@ class ToolkitOps:
                 skip_empty=2, frame_progress_callback=index_progress, **indexing_options):
             return None
 
+        return self._save_video_index(index, transcription, transcription_file_path, **kwargs)
+
+    def _save_video_index(self, index, transcription, transcription_file_path, **kwargs):
+        """
+        This saves the embeddings of an indexed video and adds the index paths to its transcription(s)
+        """
+
         # cancel indexing if user requested it
         if self.processing_queue.cancel_if_canceled(queue_id=kwargs.get('queue_id', None)):
             return None
@@ -2996,6 +3372,9 @@ class ToolkitOps:
         # this is the path to the numpy file which contains the embeddings
         numpy_file_path = embedding_paths[0]
 
+        # add (or refresh) this video in the video index manifest, so the searches can use it right away
+        VideoIndexManifest.from_settings(self.stAI).add_shard(numpy_file_path)
+
         # if 'transcription_file_paths' exists in kwargs, add the video index paths to all the transcriptions
         # this should be the case if the user transcribed and translated the video before indexing it
         # therefore creating more than one transcription file
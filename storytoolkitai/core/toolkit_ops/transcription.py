@@ -10,19 +10,32 @@ import time
 from datetime import datetime
 import re
 import yaml
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
 from threading import Timer
 
 from timecode import Timecode
 
 from storytoolkitai.core.logger import logger
 from storytoolkitai.core.toolkit_ops.timecode import sec_to_tc
+from .instance_registry import InstanceRegistry
 
 from storytoolkitai import USER_DATA_PATH
 
 
 class Transcription:
 
-    _instances = {}
+    # the transcriptions that were loaded, so we don't load the same file twice
+    # (the registry only keeps the most recently used clean transcriptions alive)
+    _instances = InstanceRegistry(
+        name='transcriptions',
+        pin_check=lambda instance: instance.is_dirty() or instance._save_timer is not None
+    )
+
+    # if this is True, the transcriptions are saved without indentation and with column based word timings
+    # which is much faster to write for long transcriptions with word timings
+    # (the files are still JSON and the regular format is still loaded fine)
+    compact_file_format = False
 
     def __new__(cls, *args, **kwargs):
         """
@@ -30,21 +43,22 @@ class Transcription:
         and returns that instance if it is.
         """
 
+        transcription_file_path = kwargs.get('transcription_file_path', None) or args[0]
+
         # we use the transcription file path as the id for the instance
-        transcription_path_id = cls.get_transcription_path_id(
-            transcription_file_path=kwargs.get('transcription_file_path', None) or args[0]
-        )
+        transcription_path_id = cls.get_transcription_path_id(transcription_file_path=transcription_file_path)
 
         # if the transcription file path is already loaded in an instance, we return that instance
-        if transcription_path_id in cls._instances:
+        if (instance := cls._instances.get(transcription_path_id)) is not None:
 
-            return cls._instances[transcription_path_id]
+            return instance
 
         # otherwise we create a new instance
         instance = super().__new__(cls)
 
-        # and we store it in the instances dict
-        cls._instances[transcription_path_id] = instance
+        # and we store it in the instances registry
+        cls._instances.put(
+            transcription_path_id, instance, size=InstanceRegistry.file_size(transcription_file_path))
 
         # then we return the instance
         return instance
@@ -66,10 +80,30 @@ class Transcription:
         self._name = None
 
         self._segments = []
-        self._segment_ids = {}
+
+        # the sort keys of the segments (in the same order as the segments),
+        # so we can use bisect to find segments by their start time
+        self._segment_keys = []
+
+        # the segments by their id
+        self._segments_by_id = {}
+
+        # the segment ids by their index in the segments list (generated only when needed, see segment_ids)
+        self._segment_ids = None
+
+        # these help us generate new segment ids and find the segments between two time points
+        self._max_segment_id = None
+        self._max_segment_duration = 0
+
+        # this is set to True when the start time of a segment changes
+        # so that we know that we need to sort the segments again before we use the sort keys
+        self._segments_need_sort = False
 
         self._text = None
 
+        # the text is only re-generated when it's requested after the segments changed
+        self._text_needs_update = False
+
         # the transcript groups are used to group segments together by time intervals
         self._transcript_groups = {}
 
@@ -140,19 +174,6 @@ class Transcription:
         # add this to know that we already initialized this instance
         self._initialized = True
 
-    def __del__(self):
-        """
-        Make sure we remove this from the instances dict when it's deleted
-        """
-
-        # todo: this might not work work since __del__ is only called when all references to the object are deleted
-        #  so considering that the instance is stored in the instances dict, at least that reference will still exist
-        #  and therefore __del__ will not be called
-        # if we're deleting the instance that is stored in the instances dict
-        # we remove it from the dict, so we don't have a reference to a deleted object
-        if self.__class__._instances[self.transcription_path_id] == self:
-            del self.__class__._instances[self.transcription_path_id]
-
     @property
     def language(self):
         return self._language
@@ -187,6 +208,11 @@ class Transcription:
 
     @property
     def segment_ids(self):
+
+        # this is re-generated only if the segments or their ids changed since the last time
+        if self._segment_ids is None:
+            self._segment_ids = {i: segment.id for i, segment in enumerate(self._segments)}
+
         return self._segment_ids
 
     @property
@@ -195,6 +221,16 @@ class Transcription:
 
     @property
     def text(self):
+
+        # take the text from all the segments and put it in the transcription ._text attribute
+        # (but only if the segments changed since the last time we did this)
+        if self._text_needs_update:
+            self._text = \
+                ''.join([segment.text for segment in self._segments if isinstance(segment.text, str)]) \
+                if self._segments else None
+
+            self._text_needs_update = False
+
         return self._text
 
     def __str__(self):
@@ -279,6 +315,16 @@ class Transcription:
     def set_dirty(self, value=True):
         self._dirty = value
 
+    def pin(self):
+        """
+        This keeps the transcription alive in the instances registry until it's unpinned
+        (for eg. while it's open in a window), so we keep getting this instance for its file
+        """
+        return self._instances.pin(self._transcription_path_id)
+
+    def unpin(self):
+        self._instances.unpin(self._transcription_path_id)
+
     def set(self, key: str or dict, value=None):
         """
         We use this to set some of the attributes of the transcription.
@@ -403,6 +449,9 @@ class Transcription:
             self._segments = getattr(source_transcription, '_segments')
             self._has_segments = getattr(source_transcription, '_has_segments')
 
+            # re-index the copied segments
+            self._index_segments()
+
         # set the dirty flag
         self.set_dirty()
 
@@ -589,8 +638,8 @@ class Transcription:
     def _set_segments(self, segments: list = None):
         """
         This method sets the _segments attribute (if segments is not None),
-        checks if all the segments are TranscriptionSegments
-        then re-calculates the _has_segments and _segment_ids attributes
+        checks if all the segments are TranscriptionSegments, sorts them
+        and then re-generates the sort keys, the id map and the _has_segments attribute
         """
 
         # if segments were passed, set them
@@ -606,22 +655,199 @@ class Transcription:
                 # turn this into a segment object
                 self._segments[index] = TranscriptionSegment(segment, parent_transcription=self)
 
-            # take the text from all the segments and put it in the transcription ._text attribute
-            self._text = (self._text + self._segments[index].text) \
-                if isinstance(self._text, str) else self._segments[index].text
-
         # sort all the segments by their start time
         # and keep the meta segments before non-metas with the same start time
-        self._segments = sorted(self._segments, key=lambda x: (x.start, not x.meta))
+        self._segments = sorted(self._segments, key=self._get_segment_sort_key)
+
+        # re-generate the sort keys, the id map etc.
+        self._index_segments()
+
+        # re-calculate if it's valid
+        self._is_valid_transcription_data()
+
+    @staticmethod
+    def _get_segment_sort_key(segment):
+        """
+        The segments are sorted by their start time, with the meta segments before the non-meta segments
+        that have the same start time
+        """
+        return segment.start, not segment.meta
+
+    def _index_segments(self):
+        """
+        This re-generates the sort keys, the id map and the other helper attributes for the current segments list.
+        It assumes that the segments are already sorted.
+        """
+
+        self._segment_keys = [self._get_segment_sort_key(segment) for segment in self._segments]
+        self._segments_by_id = {segment.id: segment for segment in self._segments}
+        self._segment_ids = None
+
+        segment_ids = [segment.id for segment in self._segments if segment.id is not None]
+        self._max_segment_id = int(max(segment_ids)) if segment_ids else None
+
+        self._max_segment_duration = max(
+            [segment.end - segment.start for segment in self._segments
+             if segment.start is not None and segment.end is not None] or [0]
+        )
+
+        self._segments_need_sort = False
 
         # re-calculate the self._has_segments attribute
         self._has_segments = len(self._segments) > 0
 
-        # re-generate the self._segment_ids attribute
-        self._segment_ids = {i: segment.id for i, segment in enumerate(self._segments)}
+        # the text will be re-generated the next time it's requested
+        self._text_needs_update = True
 
-        # re-calculate if it's valid
-        self._is_valid_transcription_data()
+    def _sort_segments_if_needed(self):
+        """
+        If the start time of any of the segments changed since we last sorted them, we need to sort them again
+        """
+
+        if self._segments_need_sort or len(self._segment_keys) != len(self._segments):
+            self._set_segments()
+
+    def _on_segment_changed(self, segment, attribute=None, previous_id=None):
+        """
+        This is called by the segments when one of their attributes changes
+        (if the id of the segment might have changed, the segment also passes its previous id)
+        """
+
+        # move the segment to its new id in the id map
+        # (but only if it was in the map under the previous id, otherwise it's not one of our segments yet)
+        if (attribute is None or attribute == 'id') and previous_id != segment.id \
+                and self._segments_by_id.get(previous_id, None) is segment:
+
+            del self._segments_by_id[previous_id]
+            self._segments_by_id[segment.id] = segment
+            self._segment_ids = None
+
+            if segment.id is not None:
+                self._max_segment_id = int(segment.id) if self._max_segment_id is None \
+                    else max(self._max_segment_id, int(segment.id))
+
+        # the order of the segments might have changed,
+        # but we only re-sort them when another segment is added or removed
+        # (so that the indexes stay the same while the segments are being edited)
+        if attribute is None or attribute in ['start', 'meta']:
+            self._segments_need_sort = True
+
+        if (attribute is None or attribute in ['start', 'end']) \
+                and segment.start is not None and segment.end is not None:
+            self._max_segment_duration = max(self._max_segment_duration, segment.end - segment.start)
+
+        if attribute is None or attribute == 'text':
+            self._text_needs_update = True
+
+    def get_segment_index(self, segment):
+        """
+        This returns the index of the segment object in the segments list (or None if it's not in the list)
+        """
+
+        # if the segments are sorted, we can use the sort keys to find the segment
+        if not self._segments_need_sort and len(self._segment_keys) == len(self._segments) and segment.is_valid:
+
+            segment_key = self._get_segment_sort_key(segment)
+            segment_index = bisect_left(self._segment_keys, segment_key)
+
+            # look through all the segments with the same key
+            while segment_index < len(self._segments) and self._segment_keys[segment_index] == segment_key:
+
+                if self._segments[segment_index] is segment:
+                    return segment_index
+
+                segment_index += 1
+
+            # if it's not among the segments with the same key, it's not in the list
+            return None
+
+        # otherwise, look through the whole list
+        try:
+            return self._segments.index(segment)
+
+        # it might be that the object was already cleared from the segments list
+        except ValueError:
+            return None
+
+    def _insert_segment(self, segment, segment_index: int = None):
+        """
+        This inserts the segment object in the segments list while keeping the list sorted.
+        If a segment_index is passed, it's used to position the segment among the segments with the same sort key.
+        """
+
+        self._sort_segments_if_needed()
+
+        segment_key = self._get_segment_sort_key(segment)
+
+        # these are the positions where the segment can be inserted without breaking the sort order
+        first_index = bisect_left(self._segment_keys, segment_key)
+        last_index = bisect_right(self._segment_keys, segment_key)
+
+        # by default, the segment goes after all the segments with the same key
+        if segment_index is None or not 0 <= segment_index < len(self._segments):
+            segment_index = last_index
+
+        else:
+            segment_index = min(max(segment_index, first_index), last_index)
+
+        self._segments.insert(segment_index, segment)
+        self._segment_keys.insert(segment_index, segment_key)
+        self._segments_by_id[segment.id] = segment
+        self._segment_ids = None
+
+        if segment.id is not None:
+            self._max_segment_id = int(segment.id) if self._max_segment_id is None \
+                else max(self._max_segment_id, int(segment.id))
+
+        if segment.start is not None and segment.end is not None:
+            self._max_segment_duration = max(self._max_segment_duration, segment.end - segment.start)
+
+        self._has_segments = True
+        self._text_needs_update = True
+
+        return segment_index
+
+    def _remove_segments_at(self, segment_indexes: list):
+        """
+        This removes the segments at the passed indexes from the segments list and from the id map
+        """
+
+        if not segment_indexes:
+            return
+
+        segment_indexes = set(segment_indexes)
+
+        for segment_index in segment_indexes:
+
+            segment = self._segments[segment_index]
+
+            # only remove the segment from the id map if it's not used by another segment
+            if self._segments_by_id.get(segment.id, None) is segment:
+                del self._segments_by_id[segment.id]
+
+        # remove a single segment in place, or re-build the lists for multiple segments
+        if len(segment_indexes) == 1:
+            segment_index = segment_indexes.pop()
+            self._segments.pop(segment_index)
+
+            if segment_index < len(self._segment_keys):
+                self._segment_keys.pop(segment_index)
+
+        else:
+            first_index = min(segment_indexes)
+
+            self._segments[first_index:] = \
+                [segment for index, segment in enumerate(self._segments[first_index:], start=first_index)
+                 if index not in segment_indexes]
+
+            self._segment_keys[first_index:] = \
+                [key for index, key in enumerate(self._segment_keys[first_index:], start=first_index)
+                 if index not in segment_indexes]
+
+        self._segment_ids = None
+
+        self._has_segments = len(self._segments) > 0
+        self._text_needs_update = True
 
     def get_segments(self):
         """
@@ -648,10 +874,10 @@ class Transcription:
             # if we're using the segment id but we don't have the index
             if segment_id is not None and segment_index is None:
 
-                # match the segment id to the segment using the self._segment_ids attribute
-                for index, item_id in self._segment_ids.items():
-                    if item_id == segment_id:
-                        return self._segments[index]
+                # match the segment id to the segment using the id map
+                if (segment := self._segments_by_id.get(segment_id, None)) is not None:
+                    return segment
+
                 else:
                     logger.error('Cannot find segment with id "{}".'.format(segment_id))
                     return None
@@ -714,11 +940,12 @@ class Transcription:
         if segment_index is not None and 0 <= segment_index < len(self._segments):
 
             # remove the segment
-            self._segments.pop(segment_index)
+            self._remove_segments_at([segment_index])
 
-            # reset the segments if not mentioned otherwise
+            # re-sort the segments if not mentioned otherwise
+            # (the sort keys and the id map are updated anyway, so we only need to do this if the start times changed)
             if reset_segments:
-                self._set_segments()
+                self._sort_segments_if_needed()
 
         # set the dirty flag anyway
         self.set_dirty()
@@ -735,7 +962,7 @@ class Transcription:
 
         :param start: the start time of the interval
         :param end: the end time of the interval
-        :param reset_segments: if True, we re-set the segments after we deleted the segments
+        :param reset_segments: if True, we re-sort the segments if needed after we deleted the segments
         :param additional_condition: (optional)
                                      a callable that takes a segment as an argument;
                                      if the callable returns True, the segment will be deleted;
@@ -753,15 +980,22 @@ class Transcription:
                     # and therefore it will be deleted
                     return True
 
-        # create new segments list that doesn't contain
-        # the segments that start or end between the specified interval
-        self._segments = \
-            [segment for segment in self._segments
-             if not ((start <= segment.start <= end or start <= segment.end <= end) and additional_condition(segment))]
+        # we need sorted segments to use the sort keys
+        self._sort_segments_if_needed()
 
-        # reset the segments if not mentioned otherwise
-        if reset_segments:
-            self._set_segments()
+        # segments that start between the interval are all before this index
+        last_index = bisect_right(self._segment_keys, (end, True))
+
+        # but we also need to look at the previous segments that might end within the interval
+        # (no segment is longer than the max segment duration)
+        first_index = bisect_left(self._segment_keys, (start - self._max_segment_duration, False))
+
+        # remove the segments that start or end between the specified interval
+        self._remove_segments_at(
+            [index for index in range(first_index, last_index)
+             if (start <= self._segments[index].start <= end or start <= self._segments[index].end <= end)
+             and additional_condition(self._segments[index])]
+        )
 
         # set the dirty flag anyway
         self.set_dirty()
@@ -791,14 +1025,11 @@ class Transcription:
                 # remove overlapping segments
                 self.delete_segments_between(segment.start, segment.end, reset_segments=False)
 
-            # set the segments here after we removed all the overlapping segments
-            self._set_segments()
-
         for segment in segments:
             self.add_segment(segment, skip_reset=True, add_speaker=add_speaker)
 
-        # reset the segments here after we added all the segments
-        self._set_segments()
+        # re-calculate if it's valid
+        self._is_valid_transcription_data()
 
     def add_segment(self, segment: dict or object, segment_index: int = None, skip_reset=False, add_speaker=False):
         """
@@ -806,8 +1037,10 @@ class Transcription:
         If a segment_index is passed, the segment will be added at that index, and the rest of the segments will be
         shifted to the right. If no segment_index is passed, the segment will be added to the end of the segments list.
         :param segment: a segment object or a dict that can be turned into a segment object
-        :param segment_index: the index at which to add the segment.
-        :param skip_reset: if True, the segments will not be re-set (only use if you're doing _set_segments manually!)
+        :param segment_index: the index at which to add the segment
+                              (the segments are always kept sorted by start time,
+                              so this only matters for the segments with the same start time)
+        :param skip_reset: if True, we won't re-check if the transcription data is valid after adding the segment
         :param add_speaker: if True, we add the speakers from the segments to the transcription
                              (works only for simplified list version for now, so segment needs to be a simplified list)
         """
@@ -815,6 +1048,7 @@ class Transcription:
         # make sure we have a segments list
         if not self._has_segments:
             self._segments = []
+            self._index_segments()
 
         # if the segment_data is a dict or list, turn it into a TranscriptionSegment object
         segment = \
@@ -825,31 +1059,17 @@ class Transcription:
         segment.parent_transcription = self
 
         # if the segment's id is none or if it collides with another segment's id
-        if segment.id is None or segment.id in self._segment_ids.values():
+        if segment.id is None or segment.id in self._segments_by_id:
 
             # get a new id for the segment
             segment.id = self.generate_new_segment_id()
 
-        # if we're adding a segment at a specific index
-        # and the index is valid
-        if segment_index is not None and 0 <= segment_index < len(self._segments):
-
-            # add the segment at the index
-            self._segments.insert(segment_index, segment)
-            self._has_segments = True
-
-        # otherwise, add the segment to the end of the list
-        else:
-            self._segments.append(segment)
-            self._has_segments = True
-            segment_index = len(self._segments) - 1
-
-        # make sure that we have the segment id in the segment_ids dict
-        self._segment_ids[segment_index] = segment.id
+        # add the segment in the right place in the sorted segments list
+        self._insert_segment(segment, segment_index=segment_index)
 
-        # reset the segments
+        # re-calculate if it's valid
         if not skip_reset:
-            self._set_segments()
+            self._is_valid_transcription_data()
 
         # set the dirty flag
         self.set_dirty()
@@ -867,6 +1087,7 @@ class Transcription:
 
             # remove all the segments
             self._segments = []
+            self._index_segments()
 
             # add the new segments
             self.add_segments(segments)
@@ -877,15 +1098,15 @@ class Transcription:
 
     def generate_new_segment_id(self):
         """
-        This looks through all the segment ids and returns the next highest id
+        This returns the next highest segment id
         """
 
         # if we don't have segments, return 0
-        if not self._has_segments:
+        if not self._has_segments or self._max_segment_id is None:
             return 0
 
-        # go through all the ids and calculate the highest
-        return int(max(self._segment_ids.values())) + 1
+        # the highest id is kept up to date each time a segment is added
+        return self._max_segment_id + 1
 
     def merge_segments(self, segment_index_list: list):
         """
@@ -998,17 +1219,23 @@ class Transcription:
         :param if_none: callable, a function to call if the transcription was not saved because it was not dirty
         """
 
-        # create the transcription data dict
-        transcription_data = self.to_dict()
+        # encode the transcription data only once for both the hash and the file
+        transcription_json_encoded, transcription_hash = self._encode_transcription()
 
         # add 'modified' to the transcription json
-        transcription_data['last_modified'] = str(time.time()).split('.')[0]
+        # (this is added after the hash was calculated, so that the hash only changes if the data changes)
+        transcription_json_encoded = TranscriptionUtils.add_to_encoded_transcription(
+            transcription_json_encoded,
+            key='last_modified', value=str(time.time()).split('.')[0],
+            compact=self.compact_file_format
+        )
 
         # use the transcription utils function to write the transcription to the file
         save_result = TranscriptionUtils.write_to_transcription_file(
-            transcription_data=transcription_data,
+            transcription_data=None,
             transcription_file_path=self.__transcription_file_path,
-            backup=backup
+            backup=backup,
+            transcription_json_encoded=transcription_json_encoded
         )
 
         # set the exists flag to True
@@ -1018,8 +1245,8 @@ class Transcription:
             # set the last save time
             self._last_save_time = time.time()
 
-            # recalculate transcription hash
-            self._get_transcription_hash()
+            # use the hash of the data we just saved
+            self._last_hash = transcription_hash
 
             # reset the save timer
             self._save_timer = None
@@ -1119,18 +1346,31 @@ class Transcription:
 
         return save_result
 
-    def _get_transcription_hash(self):
+    def _encode_transcription(self):
         """
-        This calculates the hash of a dict version of the transcription
-        (the actual things that are written to the file)
-        and then calculates the hash.
+        This encodes the transcription data (the actual things that are written to the file, without last_modified)
+        and calculates its hash
+        :return: the encoded transcription json and its hash
         """
 
         # get the dict version of the transcription
         transcription_dict = self.to_dict()
 
-        # calculate the hash (also sort the keys to make sure the hash is consistent)
-        self._last_hash = hashlib.md5(json.dumps(transcription_dict, sort_keys=True).encode('utf-8')).hexdigest()
+        # the last_modified value changes with each save, so it shouldn't be part of the hash
+        transcription_dict.pop('last_modified', None)
+
+        transcription_json_encoded = TranscriptionUtils.encode_transcription_data(
+            transcription_dict, compact=self.compact_file_format)
+
+        return transcription_json_encoded, hashlib.md5(transcription_json_encoded.encode('utf-8')).hexdigest()
+
+    def _get_transcription_hash(self):
+        """
+        This calculates the hash of the encoded transcription
+        (the actual things that are written to the file)
+        """
+
+        _, self._last_hash = self._encode_transcription()
 
         return self._last_hash
 
@@ -1482,6 +1722,227 @@ class Transcription:
         return transcript_group
 
 
+class TranscriptionReader:
+    """
+    This is a lightweight, read-only view of a transcription file.
+
+    Unlike Transcription, it doesn't turn the segments into TranscriptionSegment objects
+    and it isn't stored in the instances dict, so it's released as soon as it's no longer used.
+    Use it when only the metadata or the text of a transcription is needed (for eg. when searching or indexing).
+    """
+
+    def __init__(self, transcription_file_path, header_only=False):
+        """
+        :param transcription_file_path: the path of the transcription file
+        :param header_only: if True, we only keep the metadata of the transcription and drop the segments
+        """
+
+        self._transcription_file_path = transcription_file_path
+
+        self._exists = os.path.isfile(transcription_file_path) if isinstance(transcription_file_path, str) else False
+
+        # all the data from the file, except the segments
+        self._header = {}
+
+        # the segments as they were found in the file (only if we're not reading the header only)
+        self._segments = None
+
+        self._header_only = header_only
+
+        self._num_segments = 0
+        self._has_text = False
+        self._is_transcription_file = False
+
+        self._load()
+
+    def _load(self):
+
+        data = {}
+
+        if self._exists:
+            try:
+                with codecs.open(self._transcription_file_path, 'r', 'utf-8-sig') as json_file:
+                    data = json.load(json_file)
+
+            # in case we get JSONDecodeError, we assume that the file is not a valid JSON file
+            except json.decoder.JSONDecodeError:
+                data = {}
+
+            except:
+                logger.error("Transcription file {} is invalid".format(self._transcription_file_path), exc_info=True)
+                data = {}
+
+        if not isinstance(data, dict):
+            data = {}
+
+        segments = data.pop('segments', None)
+
+        self._header = data
+
+        if isinstance(segments, list):
+            self._num_segments = len(segments)
+
+            self._has_text = any(
+                isinstance(segment, dict) and isinstance(segment.get('text', None), str)
+                and segment['text'].strip() != '' for segment in segments)
+
+        # the same rules as in Transcription._is_valid_transcription_data()
+        self._is_transcription_file = \
+            (isinstance(segments, list) and (len(segments) == 0 or self._normalize_segment(segments[0]) is not None)) \
+            or bool(self._header.get('video_index_path', None))
+
+        if not self._header_only and isinstance(segments, list):
+            self._segments = segments
+
+    @staticmethod
+    def _normalize_segment(segment_data):
+        """
+        Returns the segment data as a dict, in the same format as TranscriptionSegment.to_dict()
+        or None if the segment is not valid
+        """
+
+        if isinstance(segment_data, list) and len(segment_data) == 4:
+            segment_data = TranscriptionSegment.dict_from_list(segment_data)
+
+        if not isinstance(segment_data, dict) \
+                or segment_data.get('start', None) is None or segment_data.get('end', None) is None:
+            return None
+
+        segment_dict = dict(segment_data)
+        segment_dict['start'] = float(segment_dict['start'])
+        segment_dict['end'] = float(segment_dict['end'])
+
+        if 'meta' in segment_dict:
+            segment_dict['meta'] = bool(segment_dict['meta'])
+
+        # the words might be saved in columns (compact format)
+        if 'words' in segment_dict:
+            segment_dict['words'] = TranscriptionUtils.words_from_columns(segment_dict['words'])
+
+        return segment_dict
+
+    def iter_segments(self):
+        """
+        Yields the valid segments of the transcription as dicts, in the same order as Transcription.get_segments()
+        (sorted by their start time, with the meta segments before non-metas with the same start time)
+        """
+
+        if self._header_only:
+            logger.error('Cannot get segments from {} - only the header was read.'
+                         .format(self._transcription_file_path))
+            return
+
+        if not self._segments:
+            return
+
+        # we only normalize the segments for sorting, but yield them one by one
+        sort_keys = []
+        for segment_index, segment_data in enumerate(self._segments):
+
+            segment_dict = self._normalize_segment(segment_data)
+
+            if segment_dict is None:
+                continue
+
+            sort_keys.append((segment_dict['start'], not segment_dict.get('meta', False), segment_index))
+
+        for _, _, segment_index in sorted(sort_keys):
+            yield self._normalize_segment(self._segments[segment_index])
+
+    @property
+    def transcription_file_path(self):
+        return self._transcription_file_path
+
+    @property
+    def exists(self):
+        return self._exists
+
+    @property
+    def is_transcription_file(self):
+        return self._is_transcription_file
+
+    @property
+    def has_segments(self):
+        return self._num_segments > 0
+
+    @property
+    def num_segments(self):
+        return self._num_segments
+
+    @property
+    def has_text(self):
+        return self._has_text
+
+    @property
+    def text(self):
+        return ''.join([segment['text'] for segment in self.iter_segments() if isinstance(segment.get('text'), str)])
+
+    @property
+    def name(self):
+
+        # if there is no name, we use the file name without the extension (same as Transcription)
+        if not self._header.get('name', None) and self._transcription_file_path:
+            return os.path.splitext(os.path.basename(self._transcription_file_path))[0]
+
+        return self._header.get('name', None)
+
+    @property
+    def language(self):
+        return self._header.get('language', None)
+
+    @property
+    def transcript_groups(self):
+        return self._header.get('transcript_groups', None)
+
+    @property
+    def audio_file_path(self):
+
+        audio_file_path = self._header.get('audio_file_path', None)
+
+        # if the path is not absolute, make it absolute using the transcription file path
+        if audio_file_path is not None and not os.path.isabs(audio_file_path):
+            return os.path.join(os.path.dirname(self._transcription_file_path), audio_file_path)
+
+        return audio_file_path
+
+    @property
+    def video_index_path(self):
+
+        video_index_path = self._header.get('video_index_path', None)
+
+        # if the path is not absolute, make it absolute using the transcription file path
+        if video_index_path is not None and not os.path.isabs(video_index_path):
+            return os.path.join(os.path.dirname(self._transcription_file_path), video_index_path)
+
+        return video_index_path
+
+    @property
+    def timeline_fps(self):
+        return self._header.get('timeline_fps', None)
+
+    @property
+    def timeline_start_tc(self):
+        return self._header.get('timeline_start_tc', None)
+
+    @property
+    def timeline_name(self):
+        return self._header.get('timeline_name', None)
+
+    @property
+    def project_name(self):
+        return self._header.get('project_name', None)
+
+    def get_timecode_data(self):
+        """
+        Returns the timeline_fps and timeline_start_tc attribute values (same as Transcription.get_timecode_data())
+        """
+
+        if self.timeline_fps is not None and self.timeline_start_tc is not None:
+            return self.timeline_fps, self.timeline_start_tc
+
+        return False
+
+
 class TranscriptionSegment:
     """
     This class represents a segment in a transcription file
@@ -1565,8 +2026,14 @@ class TranscriptionSegment:
 
     @id.setter
     def id(self, value):
+
+        previous_id = self._id
         self._id = value
 
+        # let the parent know, so it can find the segment by its new id
+        if self.parent_transcription and previous_id != value:
+            self.parent_transcription._on_segment_changed(self, attribute='id', previous_id=previous_id)
+
     @property
     def parent_transcription(self):
         return self._parent_transcription
@@ -1628,8 +2095,9 @@ class TranscriptionSegment:
 
             setattr(self, '_'+key, value)
 
-            # if the segment has a parent, flag it as dirty
+            # if the segment has a parent, let it know what changed and flag it as dirty
             if self.parent_transcription:
+                self.parent_transcription._on_segment_changed(self, attribute=key)
                 self.parent_transcription.set_dirty()
 
             return True
@@ -1644,8 +2112,15 @@ class TranscriptionSegment:
         This updates the segment with new segment_data
         """
 
+        # the new data might change the id of the segment
+        previous_id = self._id
+
         self._load_dict_into_attributes(segment_data)
 
+        # let the parent know that the segment changed
+        if self.parent_transcription:
+            self.parent_transcription._on_segment_changed(self, previous_id=previous_id)
+
     # set the known attributes
     __known_attributes = ['id', 'start', 'end', 'words', 'text', 'tokens', 'merged',
                           'seek', 'temperature', 'avg_logprob', 'compression_ratio', 'no_speech_prob',
@@ -1684,6 +2159,10 @@ class TranscriptionSegment:
                 if attribute == 'meta':
                     segment_dict[attribute] = bool(segment_dict[attribute])
 
+                # the words might be saved in columns (compact format)
+                if attribute == 'words':
+                    segment_dict[attribute] = TranscriptionUtils.words_from_columns(segment_dict[attribute])
+
                 setattr(self, '_'+attribute, segment_dict[attribute])
 
             # if the known attribute is not in the json,
@@ -1771,6 +2250,10 @@ class TranscriptionSegment:
         # flag the segment as merged
         self.merged = True
 
+        # let the parent know that the segment changed
+        if self.parent_transcription:
+            self.parent_transcription._on_segment_changed(self)
+
         return self
 
     def get_segment_speaker_name(self):
@@ -1813,8 +2296,8 @@ class TranscriptionSegment:
         # add the known attributes to the data
         for attribute in attributes_to_use:
 
-            if hasattr(self, '_'+attribute) and getattr(self, '_'+attribute) is not None:
-                segment_dict[attribute] = getattr(self, '_'+attribute)
+            if (value := getattr(self, '_'+attribute, None)) is not None:
+                segment_dict[attribute] = value
 
         # merge the other data with the transcription data
         segment_dict.update(self._other_data)
@@ -1901,15 +2384,8 @@ class TranscriptionSegment:
         # if the segment has a parent, return its index
         if self.parent_transcription:
 
-            # try to see if the segment is in the parent's segments list
-            try:
-                segment_index = self.parent_transcription.segments.index(self)
-
-            # it might be that the object was already cleared from the parent's segments list
-            except ValueError:
-                segment_index = None
-
-            return segment_index
+            # the parent uses the sort keys to find the segment faster
+            return self.parent_transcription.get_segment_index(self)
 
         # if the segment does not have a parent, return None
         else:
@@ -2081,7 +2557,106 @@ class TranscriptionUtils:
             return None
 
     @staticmethod
-    def write_to_transcription_file(transcription_data, transcription_file_path, backup=False):
+    def words_to_columns(words):
+        """
+        This turns a list of word dicts into a dict of columns
+        (for eg. [{'word': 'a', 'start': 0.1}, {'word': 'b', 'start': 0.2}]
+        becomes {'word': ['a', 'b'], 'start': [0.1, 0.2]})
+        so that we don't have to write the same keys for each word.
+        If the words don't all have the same keys, they're returned as they are.
+        """
+
+        if not isinstance(words, list) or not words or not isinstance(words[0], dict):
+            return words
+
+        word_keys = words[0].keys()
+
+        # all the words need to have the same keys
+        for word in words:
+            if not isinstance(word, dict) or word.keys() != word_keys:
+                return words
+
+        word_keys = list(word_keys)
+
+        # a single key would make itemgetter return values instead of tuples
+        if len(word_keys) == 1:
+            return {word_keys[0]: [word[word_keys[0]] for word in words]}
+
+        return dict(zip(word_keys, map(list, zip(*map(itemgetter(*word_keys), words)))))
+
+    @staticmethod
+    def words_from_columns(words):
+        """
+        This turns a dict of word columns back into a list of word dicts (see words_to_columns)
+        """
+
+        if not isinstance(words, dict):
+            return words
+
+        word_keys = list(words.keys())
+        columns = [words[key] for key in word_keys]
+
+        # all the columns need to be lists of the same length
+        if not columns or not all(isinstance(column, list) and len(column) == len(columns[0]) for column in columns):
+            return words
+
+        return [dict(zip(word_keys, word_values)) for word_values in zip(*columns)]
+
+    @staticmethod
+    def encode_transcription_data(transcription_data: dict, compact=False) -> str:
+        """
+        This encodes the transcription data to json
+        :param transcription_data: the transcription data dict
+        :param compact: if True, the json is written without indentation
+                        and the segment word timings are written in columns
+        """
+
+        if not compact:
+            return json.dumps(transcription_data, indent=4)
+
+        # don't change the original data, only replace the words in a copy of each segment
+        if isinstance(transcription_data.get('segments', None), list):
+            transcription_data = dict(transcription_data)
+            transcription_data['segments'] = [
+                {**segment, 'words': TranscriptionUtils.words_to_columns(segment['words'])}
+                if isinstance(segment, dict) and segment.get('words', None) else segment
+                for segment in transcription_data['segments']
+            ]
+
+        return json.dumps(transcription_data, separators=(',', ':'))
+
+    @staticmethod
+    def add_to_encoded_transcription(transcription_json_encoded: str, key: str, value, compact=False) -> str:
+        """
+        This adds a top level key to an already encoded transcription (see encode_transcription_data),
+        without encoding the whole transcription again
+        """
+
+        encoded_item = json.dumps({key: value}, separators=(',', ':') if compact else None)[1:-1]
+
+        # if the transcription is empty, just add the item
+        if transcription_json_encoded.strip() == '{}':
+            return '{' + encoded_item + '}'
+
+        # the encoded transcription always ends with the closing brace of the top level dict
+        if compact:
+            return transcription_json_encoded[:-1] + ',' + encoded_item + '}'
+
+        return transcription_json_encoded[:-2] + ',\n    ' + encoded_item + '\n}'
+
+    @staticmethod
+    def write_to_transcription_file(transcription_data, transcription_file_path, backup=False,
+                                    transcription_json_encoded: str = None):
+        """
+        This writes the transcription data to the file
+        (first to a temporary file which then replaces the transcription file,
+        so we never end up with half a transcription file if something goes wrong while writing)
+        :param transcription_data: the transcription data dict
+        :param transcription_file_path: the path of the transcription file
+        :param backup: whether to back up the existing transcription file first (see below)
+        :param transcription_json_encoded: the already encoded transcription data
+                                           (if this is passed, transcription_data is ignored)
+        """
 
         # if no full path was passed
         if transcription_file_path is None:
@@ -2147,11 +2722,26 @@ class TranscriptionUtils:
                 logger.debug('Copied transcription file to backup: {}'.format(backup_transcription_file_path))
 
         # encode the transcription json (do this before writing to the file, to make sure it's valid)
-        transcription_json_encoded = json.dumps(transcription_data, indent=4)
+        if transcription_json_encoded is None:
+            transcription_json_encoded = TranscriptionUtils.encode_transcription_data(transcription_data)
+
+        # write the transcription json to a temporary file first and then replace the transcription file with it
+        temp_transcription_file_path = '{}.tmp'.format(transcription_file_path)
+
+        try:
+            with open(temp_transcription_file_path, 'w', encoding='utf-8') as outfile:
+                outfile.write(transcription_json_encoded)
 
-        # write the transcription json to the file
-        with open(transcription_file_path, 'w', encoding='utf-8') as outfile:
-            outfile.write(transcription_json_encoded)
+            os.replace(temp_transcription_file_path, transcription_file_path)
+
+        except OSError:
+            logger.error('Cannot save transcription to file: {}'.format(transcription_file_path), exc_info=True)
+
+            # remove the temporary file if it's still there
+            if os.path.exists(temp_transcription_file_path):
+                os.remove(temp_transcription_file_path)
+
+            return False
 
         logger.debug('Saved transcription to file: {}'.format(transcription_file_path))
 
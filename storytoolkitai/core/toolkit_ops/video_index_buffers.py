@@ -0,0 +1,197 @@
+from array import array
+
+import numpy as np
+import torch
+
+
+class EmbeddingBuffer:
+    """
+    This holds the embeddings of a video index in a preallocated tensor which doubles its capacity when it's full,
+    so adding the features of each indexed frame doesn't copy all the previous embeddings again
+    (like torch.cat does)
+    """
+
+    # the number of embeddings we make room for when the first features are added
+    initial_capacity = 1024
+
+    def __init__(self, embeddings=None):
+        """
+        :param embeddings: a tensor with the embeddings to start with (it's used as is, without copying)
+        """
+
+        self._data = embeddings
+        self._size = len(embeddings) if embeddings is not None else 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return len(self._data) if self._data is not None else 0
+
+    @property
+    def tensor(self):
+        """
+        This returns the embeddings (a view of the buffer without the unused capacity) or None if it's empty
+        """
+
+        if self._data is None:
+            return None
+
+        return self._data[:self._size]
+
+    def append(self, features):
+        """
+        This adds the features (a tensor with one embedding per row) at the end of the buffer
+        """
+
+        needed_size = self._size + len(features)
+
+        if self._data is None:
+            self._data = torch.empty((max(self.initial_capacity, needed_size), *features.shape[1:]),
+                                     dtype=features.dtype, device=features.device)
+
+        # if we don't have enough room, double the capacity
+        elif needed_size > self.capacity:
+
+            data = torch.empty((max(needed_size, self.capacity * 2), *self._data.shape[1:]),
+                               dtype=self._data.dtype, device=self._data.device)
+            data[:self._size] = self._data[:self._size]
+
+            self._data = data
+
+        self._data[self._size:needed_size] = features.to(dtype=self._data.dtype, device=self._data.device)
+        self._size = needed_size
+
+
+class FrameMetadata:
+    """
+    This holds the metadata of the embeddings of a video index (the path and the frame of each patch) in columns:
+    an array with the frame index of each embedding, an array with the path id of each embedding
+    and a table with the paths (and their other metadata, like the fps), instead of a dict for each patch.
+
+    It still behaves like the list of dicts it replaces, so frame_metadata[i] returns {'path': ..., 'frame': ...}
+    """
+
+    def __init__(self, frames=None):
+        """
+        :param frames: a list of dicts with the metadata of each embedding (at least 'path' and 'frame')
+        """
+
+        self._frames = array('q')
+        self._path_ids = array('q')
+
+        # the paths and their other metadata [(path, {other metadata})]
+        self._paths = []
+        self._path_ids_by_key = {}
+
+        if frames:
+            self.extend(frames)
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __getitem__(self, index):
+
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        index = int(index)
+
+        path, other_metadata = self._paths[self._path_ids[index]]
+
+        return {'path': path, 'frame': self._frames[index], **other_metadata}
+
+    def __iter__(self):
+
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def frame_indexes(self):
+        """
+        This returns the frame index of each embedding as a numpy array
+        """
+
+        return np.frombuffer(self._frames, dtype=np.int64).copy() if self._frames else np.empty(0, dtype=np.int64)
+
+    @property
+    def path_ids(self):
+        """
+        This returns the path id of each embedding as a numpy array
+        """
+
+        return np.frombuffer(self._path_ids, dtype=np.int64).copy() \
+            if self._path_ids else np.empty(0, dtype=np.int64)
+
+    @property
+    def paths(self):
+        """
+        This returns the path table [(path, {other metadata})], the path ids are the indexes of this list
+        """
+
+        return self._paths
+
+    def _get_path_id(self, path, other_metadata):
+
+        key = (path, tuple(sorted(other_metadata.items())))
+
+        path_id = self._path_ids_by_key.get(key, None)
+
+        if path_id is None:
+            path_id = self._path_ids_by_key[key] = len(self._paths)
+            self._paths.append((path, dict(other_metadata)))
+
+        return path_id
+
+    def add(self, path, frame, count=1, **other_metadata):
+        """
+        This adds the metadata of count embeddings that belong to the same frame
+
+        :param path: the path of the video (usually the file name)
+        :param frame: the frame index
+        :param count: the number of embeddings (patches) of this frame
+        :param other_metadata: other metadata that's the same for all the frames of this path (fps etc.)
+        """
+
+        path_id = self._get_path_id(path, other_metadata)
+
+        self._frames.extend([int(frame)] * count)
+        self._path_ids.extend([path_id] * count)
+
+    def add_columns(self, frames, path_ids, paths, **other_metadata):
+        """
+        This adds the metadata of many embeddings at once, from another columnar metadata source
+
+        :param frames: the frame index of each embedding
+        :param path_ids: the id of the path of each embedding (the index in the paths list)
+        :param paths: the path table [(path, {other metadata})]
+        :param other_metadata: metadata to add to all the paths (for eg. the offset)
+        """
+
+        # map the path ids of the source to our own path ids
+        path_id_map = np.array(
+            [self._get_path_id(path, {**path_metadata, **other_metadata}) for path, path_metadata in paths],
+            dtype=np.int64)
+
+        self._frames.frombytes(np.ascontiguousarray(frames, dtype=np.int64).tobytes())
+        self._path_ids.frombytes(
+            np.ascontiguousarray(path_id_map[np.asarray(path_ids, dtype=np.int64)], dtype=np.int64).tobytes())
+
+    def append(self, frame_data):
+
+        frame_data = dict(frame_data)
+
+        self.add(frame_data.pop('path'), frame_data.pop('frame'), **frame_data)
+
+    def extend(self, frames):
+
+        for frame_data in frames:
+            self.append(frame_data)
+
+    def to_list(self):
+        """
+        This returns the metadata as a list of dicts (the format used in the metadata files)
+        """
+
+        return list(self)
@@ -0,0 +1,370 @@
+import hashlib
+import json
+import os
+from threading import RLock
+
+import numpy as np
+
+from storytoolkitai import USER_DATA_PATH
+from storytoolkitai.core.logger import logger
+
+
+class VideoIndexShard:
+    """
+    This is the index of one video (one .npy embeddings file + its .json metadata file).
+    The embeddings are memory-mapped the first time they're needed,
+    and the metadata comes from the manifest cache, so the .json file isn't parsed again.
+    """
+
+    def __init__(self, npy_path, frames, path_ids, paths, metadata):
+        """
+        :param npy_path: the path to the embeddings file
+        :param frames: the frame index of each embedding (numpy array)
+        :param path_ids: the path id of each embedding (numpy array)
+        :param paths: the path table [(path, {other metadata})]
+        :param metadata: the other metadata of the index (clip_model, video_fps etc.)
+        """
+
+        self.npy_path = npy_path
+        self.frames = frames
+        self.path_ids = path_ids
+        self.paths = paths
+        self.metadata = metadata
+
+        self._embeddings = None
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def clip_model(self):
+        return self.metadata.get('clip_model', None)
+
+    @property
+    def embeddings(self):
+        """
+        The embeddings of the video, memory-mapped (so only the parts that are used are read from the disk)
+        """
+
+        if self._embeddings is None:
+            self._embeddings = np.load(self.npy_path, mmap_mode='r')
+
+        return self._embeddings
+
+
+class VideoIndexManifest:
+    """
+    This keeps track of the indexed videos (shards) in a manifest file,
+    together with a compact cache of their metadata, so opening a search over many indexed videos
+    doesn't need to parse all their metadata files and load all their embeddings again.
+
+    The shards are refreshed automatically when their files change (for eg. when a video is re-indexed).
+    """
+
+    _instances = {}
+
+    manifest_version = 1
+
+    def __new__(cls, cache_dir):
+
+        cache_dir = os.path.abspath(cache_dir)
+
+        # only one manifest object per cache directory
+        if cache_dir not in cls._instances:
+            cls._instances[cache_dir] = super(VideoIndexManifest, cls).__new__(cls)
+
+        return cls._instances[cache_dir]
+
+    def __init__(self, cache_dir):
+
+        # prevent initializing the instance more than once
+        if hasattr(self, '_initialized') and self._initialized:
+            return
+
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.manifest_path = os.path.join(self.cache_dir, 'video_index_manifest.json')
+
+        self._lock = RLock()
+
+        # the shard entries from the manifest file {npy_path: {entry}}
+        self._entries = self._load_manifest()
+
+        # the shards that were already opened in this session {npy_path: (signatures, VideoIndexShard)}
+        self._shards = {}
+
+        # this is True when the manifest has changes that weren't saved yet
+        self._dirty = False
+
+        self._initialized = True
+
+    @classmethod
+    def from_settings(cls, stAI=None):
+        """
+        This returns the manifest from the search cache directory set in the config (if any)
+        or from the default cache directory
+        """
+
+        cache_dir = stAI.get_app_setting(setting_name='default_search_cache_dir', default_if_none='') \
+            if stAI is not None else ''
+
+        if not cache_dir or not os.path.isdir(cache_dir):
+            cache_dir = os.path.join(USER_DATA_PATH, 'cache')
+
+        return cls(cache_dir)
+
+    @staticmethod
+    def _get_file_signature(file_path):
+        """
+        We use the modification time and the size of the file to know if it changed since it was added
+        """
+
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            return None
+
+        return [file_stat.st_mtime_ns, file_stat.st_size]
+
+    def _get_signatures(self, npy_path):
+        return [self._get_file_signature(npy_path), self._get_file_signature(npy_path + '.json')]
+
+    def _get_metadata_cache_path(self, npy_path):
+
+        cache_id = hashlib.md5(os.path.abspath(npy_path).encode('utf-8')).hexdigest()
+
+        return os.path.join(self.cache_dir, 'video_index_{}.npz'.format(cache_id))
+
+    def _load_manifest(self):
+
+        if not os.path.isfile(self.manifest_path):
+            return {}
+
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest_data = json.load(f)
+
+            if manifest_data.get('version', None) != self.manifest_version:
+                return {}
+
+            return manifest_data.get('shards', {})
+
+        except Exception:
+            logger.debug('Could not load video index manifest {}.'.format(self.manifest_path), exc_info=True)
+            return {}
+
+    def save(self):
+
+        with self._lock:
+
+            try:
+                if not os.path.isdir(self.cache_dir):
+                    os.makedirs(self.cache_dir)
+
+                # write to a temporary file first, so we never end up with half a manifest
+                temp_file_path = '{}.tmp'.format(self.manifest_path)
+                with open(temp_file_path, 'w', encoding='utf-8') as f:
+                    json.dump({'version': self.manifest_version, 'shards': self._entries}, f)
+
+                os.replace(temp_file_path, self.manifest_path)
+
+                self._dirty = False
+
+            except Exception:
+                logger.debug('Could not save video index manifest {}.'.format(self.manifest_path), exc_info=True)
+                return False
+
+        return True
+
+    def add_shard(self, npy_path, save=True):
+        """
+        This adds (or refreshes) the index of a video in the manifest
+        by reading its metadata file and caching it in a compact format
+
+        :param npy_path: the path to the embeddings file (the metadata file is expected at npy_path + '.json')
+        :param save: whether to save the manifest file right away
+        :return: the VideoIndexShard or None if the index couldn't be added
+        """
+
+        npy_path = os.path.abspath(npy_path)
+
+        with self._lock:
+
+            signatures = self._get_signatures(npy_path)
+
+            if None in signatures:
+                logger.warning('Cannot add video index {} - embeddings or metadata file not found.'.format(npy_path))
+                self.remove_shard(npy_path, save=save)
+                return None
+
+            try:
+                with open(npy_path + '.json', 'r', encoding='utf-8') as f:
+                    metadata_dict = json.load(f)
+
+                # the metadata that's the same for all the frames
+                other_metadata = {
+                    'video_fps': metadata_dict.get('video_fps', None),
+                    'videoanalysis_version': metadata_dict.get('videoanalysis_version', None)
+                }
+
+                frames = metadata_dict.pop('frames', [])
+
+                # these are not needed for searching, so we don't keep them in the manifest
+                metadata_dict.pop('indexed_frames', None)
+                metadata_dict.pop('scene_change_frames', None)
+
+                # turn the frame dicts into columns
+                paths = []
+                path_ids_by_path = {}
+                path_ids = np.empty(len(frames), dtype=np.int64)
+                frame_indexes = np.empty(len(frames), dtype=np.int64)
+
+                for idx, frame_data in enumerate(frames):
+
+                    path = frame_data['path']
+
+                    if path not in path_ids_by_path:
+                        path_ids_by_path[path] = len(paths)
+                        paths.append(
+                            (path, {'full_path': os.path.join(os.path.dirname(npy_path), path), **other_metadata}))
+
+                    path_ids[idx] = path_ids_by_path[path]
+                    frame_indexes[idx] = frame_data['frame']
+
+                # we only need the shape of the embeddings, so we don't read them
+                embeddings = np.load(npy_path, mmap_mode='r')
+
+                if len(embeddings) != len(frame_indexes):
+                    logger.warning('Cannot add video index {} - the embeddings and the metadata do not match.'
+                                   .format(npy_path))
+                    return None
+
+                metadata_cache_path = self._get_metadata_cache_path(npy_path)
+
+                if not os.path.isdir(self.cache_dir):
+                    os.makedirs(self.cache_dir)
+
+                # numpy adds the extension if it's missing, so keep it for the temporary file too
+                temp_file_path = '{}.tmp.npz'.format(metadata_cache_path[:-len('.npz')])
+                np.savez(temp_file_path, frames=frame_indexes, path_ids=path_ids)
+                os.replace(temp_file_path, metadata_cache_path)
+
+                self._entries[npy_path] = {
+                    'signatures': signatures,
+                    'metadata_cache_path': metadata_cache_path,
+                    'paths': paths,
+                    'metadata': metadata_dict,
+                    'rows': int(embeddings.shape[0]),
+                    'dtype': str(embeddings.dtype)
+                }
+
+                shard = VideoIndexShard(npy_path, frame_indexes, path_ids, paths, metadata_dict)
+                self._shards[npy_path] = (signatures, shard)
+
+                self._dirty = True
+
+            except Exception:
+                logger.error('Cannot add video index {} to the manifest.'.format(npy_path), exc_info=True)
+                return None
+
+            if save:
+                self.save()
+
+            return shard
+
+    def remove_shard(self, npy_path, save=True):
+        """
+        This removes the index of a video from the manifest (and its metadata cache)
+        """
+
+        npy_path = os.path.abspath(npy_path)
+
+        with self._lock:
+
+            entry = self._entries.pop(npy_path, None)
+            self._shards.pop(npy_path, None)
+
+            if entry is None:
+                return False
+
+            self._dirty = True
+
+            try:
+                if os.path.isfile(entry.get('metadata_cache_path', '')):
+                    os.remove(entry['metadata_cache_path'])
+            except OSError:
+                logger.debug('Could not remove video index cache {}.'.format(entry['metadata_cache_path']))
+
+            if save:
+                self.save()
+
+        return True
+
+    def get_shard(self, npy_path, save=True):
+        """
+        This returns the VideoIndexShard of a video, and (re-)adds it to the manifest if needed
+        """
+
+        npy_path = os.path.abspath(npy_path)
+
+        with self._lock:
+
+            signatures = self._get_signatures(npy_path)
+
+            # the shards we already opened are used as long as their files didn't change
+            if npy_path in self._shards and self._shards[npy_path][0] == signatures:
+                return self._shards[npy_path][1]
+
+            entry = self._entries.get(npy_path, None)
+
+            if entry is None or entry.get('signatures', None) != signatures \
+                    or not os.path.isfile(entry.get('metadata_cache_path', '')):
+                return self.add_shard(npy_path, save=save)
+
+            try:
+                with np.load(entry['metadata_cache_path']) as metadata_cache:
+                    frame_indexes = metadata_cache['frames']
+                    path_ids = metadata_cache['path_ids']
+
+            except Exception:
+                logger.debug('Could not load video index cache for {}.'.format(npy_path), exc_info=True)
+                return self.add_shard(npy_path, save=save)
+
+            shard = VideoIndexShard(
+                npy_path, frame_indexes, path_ids, [tuple(path) for path in entry['paths']], entry['metadata'])
+
+            self._shards[npy_path] = (signatures, shard)
+
+            return shard
+
+    def get_shards(self, npy_paths):
+        """
+        This returns the VideoIndexShards of multiple videos (only the ones that use the same model as the first one)
+        """
+
+        shards = []
+        model_name = None
+
+        with self._lock:
+
+            for npy_path in npy_paths:
+
+                shard = self.get_shard(npy_path, save=False)
+
+                if shard is None:
+                    continue
+
+                # all the embeddings need to come from the same model
+                if model_name is not None and shard.clip_model != model_name:
+                    logger.error('Cannot load embeddings for {} - model "{}" is not "{}".'
+                                 .format(npy_path, shard.clip_model, model_name))
+                    continue
+
+                model_name = shard.clip_model
+
+                shards.append(shard)
+
+            # save the manifest only once, after all the changes
+            if self._dirty:
+                self.save()
+
+        return shards
@@ -0,0 +1,1048 @@
+import os
+import queue
+import subprocess
+import threading
+from collections import OrderedDict, deque
+
+import cv2
+import numpy as np
+import tqdm
+from scipy import stats
+
+from storytoolkitai.core.logger import logger
+
+
+class VideoFrameReader:
+    """
+    This reads the frames of a video sequentially, without seeking between frames
+    (seeking makes the decoder go back to the previous keyframe and decode everything up to the requested frame,
+    which, for long-GOP codecs, means decoding the same frames over and over again)
+    """
+
+    def __init__(self, path, start_frame=0, end_frame=None):
+        """
+        :param path: the path to the video file
+        :param start_frame: the first frame to read
+        :param end_frame: the last frame to read (inclusive), if None, we read until the end of the video
+        """
+
+        self.path = path
+
+        self.start_frame = int(start_frame) if start_frame else 0
+        self.end_frame = int(end_frame) if end_frame is not None else None
+
+        self._cap = cv2.VideoCapture(path)
+
+        if not self._cap.isOpened():
+            raise IOError('Unable to open video file: {}'.format(path))
+
+        self.total_frames = int(self._cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = self._cap.get(cv2.CAP_PROP_FPS)
+        self.width = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def __iter__(self):
+        """
+        This yields (frame_index, frame) for each frame between the start and the end frame
+        """
+
+        try:
+            # this is the only seek we do
+            if self.start_frame > 0:
+                self._cap.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame)
+
+            frame_index = self.start_frame
+
+            while self.end_frame is None or frame_index <= self.end_frame:
+
+                ret, frame = self._cap.read()
+
+                if not ret:
+                    break
+
+                yield frame_index, frame
+
+                frame_index += 1
+
+        finally:
+            self.release()
+
+    def release(self):
+
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+
+class SeekingFrameReader:
+    """
+    This reads the frames of a video by frame index using OpenCV,
+    but it only seeks when the frame isn't the next one the decoder would return anyway
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+
+        self._cap = cv2.VideoCapture(path)
+
+        self.total_frames = int(self._cap.get(cv2.CAP_PROP_FRAME_COUNT)) if self._cap.isOpened() else 0
+        self.fps = self._cap.get(cv2.CAP_PROP_FPS) if self._cap.isOpened() else 0
+
+        # the index of the frame that the next cap.read() returns
+        self._next_frame_index = 0
+
+    def read(self, frame_index):
+        """
+        This returns (ret, frame) just like cv2.VideoCapture.read()
+        """
+
+        if self._cap is None:
+            return False, None
+
+        if frame_index != self._next_frame_index:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+
+        ret, frame = self._cap.read()
+
+        self._next_frame_index = frame_index + 1
+
+        return ret, frame
+
+    def release(self):
+
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+
+class FFmpegFrameReader:
+    """
+    This reads the frames of a video sequentially from an FFmpeg process,
+    which scales them down (and converts them to grayscale) before sending them through a pipe,
+    so we only get the pixels we actually need and we don't have to resize each frame in Python.
+
+    The raw frames are read into a few reusable buffers, so the frames yielded by the reader are only valid
+    until the reader has gone through all the other buffers (buffer_count - 1 frames later),
+    copy them if you need to keep them around for longer.
+    """
+
+    def __init__(self, path, start_frame=0, end_frame=None, width=480, gray=True, buffer_count=2):
+        """
+        :param path: the path to the video file
+        :param start_frame: the first frame to read
+        :param end_frame: the last frame to read (inclusive), if None, we read until the end of the video
+        :param width: the width of the frames we want (the height keeps the aspect ratio of the video),
+                      if None, or larger than the video, we keep the size of the video
+        :param gray: whether to get grayscale frames (otherwise we get BGR frames, just like OpenCV)
+        :param buffer_count: how many frame buffers to use
+        """
+
+        self.path = path
+
+        self.start_frame = int(start_frame) if start_frame else 0
+        self.end_frame = int(end_frame) if end_frame is not None else None
+
+        self.gray = gray
+        self.buffer_count = max(1, int(buffer_count))
+
+        # we use OpenCV to read the details of the video,
+        # so the frame count and the fps are exactly the ones the other readers see
+        cap = cv2.VideoCapture(path)
+
+        if not cap.isOpened():
+            raise IOError('Unable to open video file: {}'.format(path))
+
+        self.total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self.source_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.source_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        cap.release()
+
+        if not self.source_width or not self.source_height:
+            raise IOError('Unable to get the frame size of video file: {}'.format(path))
+
+        # calculate the size of the frames we get from ffmpeg (most scalers need even sizes)
+        if width is None or width >= self.source_width:
+            self.width, self.height = self.source_width, self.source_height
+        else:
+            self.width = max(2, int(width) // 2 * 2)
+            self.height = max(2, int(round(self.source_height * self.width / self.source_width / 2)) * 2)
+
+        self._process = None
+
+    @staticmethod
+    def get_ffmpeg_binary():
+        """
+        This returns the ffmpeg binary found by StoryToolkitAI.check_ffmpeg (or just 'ffmpeg' if it wasn't set)
+        """
+
+        return os.getenv('FFMPEG_BINARY') or 'ffmpeg'
+
+    def _get_command(self):
+
+        command = [self.get_ffmpeg_binary(), '-v', 'error', '-nostdin']
+
+        # seek before opening the input, so ffmpeg jumps to the nearest keyframe
+        # and then decodes (without outputting) only up to the start frame
+        if self.start_frame > 0 and self.fps:
+            command += ['-ss', '{:.6f}'.format(self.start_frame / self.fps)]
+
+        command += ['-i', self.path, '-map', '0:v:0', '-an', '-sn', '-dn']
+
+        # don't drop or duplicate frames, so the frame indexes match the ones in the video
+        command += ['-vsync', '0']
+
+        if self.end_frame is not None:
+            command += ['-frames:v', str(max(0, self.end_frame - self.start_frame + 1))]
+
+        if (self.width, self.height) != (self.source_width, self.source_height):
+            command += ['-vf', 'scale={}:{}:flags=area'.format(self.width, self.height)]
+
+        command += ['-f', 'rawvideo', '-pix_fmt', 'gray' if self.gray else 'bgr24', '-']
+
+        return command
+
+    def _read_into(self, buffer):
+        """
+        This fills the buffer with the next frame from the pipe
+        :return: True if the whole frame was read, False if the stream ended
+        """
+
+        view = memoryview(buffer).cast('B')
+        bytes_read = 0
+
+        while bytes_read < len(view):
+
+            chunk_size = self._process.stdout.readinto(view[bytes_read:])
+
+            if not chunk_size:
+                return False
+
+            bytes_read += chunk_size
+
+        return True
+
+    def __iter__(self):
+        """
+        This yields (frame_index, frame) for each frame between the start and the end frame
+        """
+
+        frame_shape = (self.height, self.width) if self.gray else (self.height, self.width, 3)
+        buffers = [np.empty(frame_shape, dtype=np.uint8) for _ in range(self.buffer_count)]
+
+        try:
+            self._process = subprocess.Popen(
+                self._get_command(), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL,
+                bufsize=buffers[0].nbytes)
+
+            frame_index = self.start_frame
+
+            while self.end_frame is None or frame_index <= self.end_frame:
+
+                buffer = buffers[(frame_index - self.start_frame) % self.buffer_count]
+
+                if not self._read_into(buffer):
+                    break
+
+                yield frame_index, buffer
+
+                frame_index += 1
+
+        finally:
+            self.release()
+
+    def release(self):
+
+        if self._process is not None:
+
+            # we might stop reading before the end of the video, so don't wait for ffmpeg to finish
+            if self._process.poll() is None:
+                self._process.kill()
+
+            self._process.stdout.close()
+            self._process.wait()
+
+            self._process = None
+
+
+class FrameWindow:
+    """
+    This gives access by frame index to the last frames of a sequential reader
+    (VideoFrameReader or FFmpegFrameReader), so we can go back a few frames without seeking
+    """
+
+    def __init__(self, reader, size):
+        """
+        :param reader: the sequential reader
+        :param size: how many of the last frames to keep
+        """
+
+        self.reader = reader
+        self.size = max(1, int(size))
+
+        self._frames = OrderedDict()
+        self._iterator = iter(reader)
+
+    def read(self, frame_index):
+        """
+        This returns (True, frame) just like cv2.VideoCapture.read(),
+        or (False, None) if the video ended before the frame or the frame is no longer in the window
+        """
+
+        while frame_index not in self._frames:
+
+            # we can't go back further than the window
+            if self._frames and frame_index < next(iter(self._frames)):
+                return False, None
+
+            try:
+                read_frame_index, frame = next(self._iterator)
+            except StopIteration:
+                return False, None
+
+            self._frames[read_frame_index] = frame
+
+            if len(self._frames) > self.size:
+                self._frames.popitem(last=False)
+
+        return True, self._frames[frame_index]
+
+    def release(self):
+
+        self._frames.clear()
+        self.reader.release()
+
+
+class SharpnessTracker:
+    """
+    This looks for the sharpest frame at the beginning of a shot, just like ClipIndex.index_video does
+    when prefer_sharp is True, but it receives the frames as they're decoded
+    instead of seeking to the start of the shot.
+
+    Since we don't know where the shot ends (the next shot might still be filtered out by the neighbor analysis),
+    the tracker remembers the sharpest frame it saw before each detected shot change,
+    so we can get the result for whichever of them ends up being the end of the shot.
+    """
+
+    def __init__(self, start_frame_index):
+
+        self.start_frame_index = start_frame_index
+
+        # the sharpness scores of the frames we looked at so far
+        self.scores = []
+
+        self.best_frame_index = None
+        self.best_frame = None
+        self._best_score = None
+
+        # the best frame we had before each possible shot end {shot_end_index: (frame_index, frame)}
+        self._best_before = {}
+
+        # this becomes True once the search is over (we found a sharp frame, or the sharpness stopped improving)
+        self.stopped = False
+
+        # this is set when the result of the search is no longer needed
+        self.closed = False
+
+    @property
+    def active(self):
+        return not self.stopped and not self.closed
+
+    def add_shot_end(self, frame_index):
+        """
+        This remembers the best frame we have before this (possible) end of the shot
+        """
+
+        if self.active and self.best_frame is not None:
+            self._best_before[frame_index] = (self.best_frame_index, self.best_frame)
+
+    def feed(self, frame_index, frame, sharpness):
+        """
+        This looks at the next frame of the shot
+        """
+
+        if not self.active:
+            return
+
+        # check if we're still improving the sharpness every 24 frames
+        if len(self.scores) % 24 == 0 and len(self.scores) > 0:
+
+            slope, _, _, _, _ = stats.linregress(range(len(self.scores)), self.scores)
+
+            # if the slope is not positive, we stop
+            if slope < 0:
+                self.stopped = True
+                return
+
+        # stop if the frame is sharp enough and use it
+        if sharpness > 1:
+            self.best_frame_index, self.best_frame, self._best_score = frame_index, frame, sharpness
+            self.stopped = True
+            return
+
+        self.scores.append(sharpness)
+
+        # keep the first of the sharpest frames
+        if self._best_score is None or sharpness > self._best_score:
+            self.best_frame_index, self.best_frame, self._best_score = frame_index, frame, sharpness
+
+    def select(self, shot_end_index):
+        """
+        This returns the (frame_index, frame) that should be encoded if the shot ends at shot_end_index
+        """
+
+        if shot_end_index in self._best_before:
+            return self._best_before[shot_end_index]
+
+        return self.best_frame_index, self.best_frame
+
+
+class VideoIndexingPipeline:
+    """
+    This detects the shots, filters them and indexes a video in a single decoding pass.
+
+    The frames are decoded sequentially in one thread and flow through bounded queues:
+        decoder -> scene detection (+ sharpness search) -> neighbor shot analysis -> CLIP encoding
+    so each stage works while the others are busy, and the decoder never runs too far ahead of the slowest stage.
+
+    Scene detection, neighbor analysis and indexing use the same logic as
+    ClipIndex.get_scene_changes, ClipIndex.analyze_neighbor_shots and ClipIndex.index_video,
+    only that instead of seeking back to the frames they need, the frames are kept around while they're needed:
+     - the scene detection keeps the last jump_every_frames frames to find the exact frame of a shot change
+     - the shot records carry their first frame to the neighbor analysis and the encoder
+     - the sharpness search runs on the frames as they pass (see SharpnessTracker)
+    """
+
+    # the max number of items waiting between the stages
+    frame_queue_size = 16
+    shot_queue_size = 8
+    decision_queue_size = 8
+
+    # this goes through the queues after the last item
+    _END = object()
+
+    def __init__(self, clip_index, path,
+                 *,
+                 trim_after_frame: int = None, trim_before_frame: int = 0,
+                 content_analysis_every: int = 40,
+                 jump_every_frames: int = 10,
+                 shot_frequency: str = 'medium',
+                 prefer_sharp: bool = True,
+                 skip_color_blocks: bool = True,
+                 skip_empty: int = 0,
+                 skip_dark: int = 11,
+                 skip_similar_neighbors: bool = True,
+                 frame_progress_callback: callable = None,
+                 show_progress_bar: bool = True,
+                 **kwargs):
+        """
+        :param clip_index: the ClipIndex object which will hold the index
+        :param path: the path to the video file
+        :param shot_frequency: how often should we expect shots to change (see ClipIndex.analyze_neighbor_shots)
+        :param frame_progress_callback: this is called with current_frame_index and total_frames
+                                        while the video is processed, if it returns something falsy, we cancel
+        :param kwargs: the other detection options (they're passed to ClipIndex.fast_detect_change)
+
+        See ClipIndex.get_scene_changes and ClipIndex.index_video for the rest of the options
+        """
+
+        self.clip_index = clip_index
+        self.path = path
+
+        self.trim_before_frame = int(trim_before_frame) if trim_before_frame else 0
+        self.trim_after_frame = trim_after_frame
+        self.content_analysis_every = content_analysis_every
+        self.jump_every_frames = max(1, int(jump_every_frames))
+        self.shot_frequency = shot_frequency
+
+        self.prefer_sharp = prefer_sharp
+        self.skip_color_blocks = skip_color_blocks
+        self.skip_empty = skip_empty
+        self.skip_dark = skip_dark
+        self.skip_similar_neighbors = skip_similar_neighbors
+
+        self.frame_progress_callback = frame_progress_callback
+        self.show_progress_bar = show_progress_bar
+
+        self.detection_kwargs = kwargs
+
+        self.reader = None
+
+        # the last frame that was decoded (used for progress reporting)
+        self.decoded_frame_index = 0
+
+        self._frame_queue = queue.Queue(maxsize=self.frame_queue_size)
+        self._shot_queue = queue.Queue(maxsize=self.shot_queue_size)
+        self._decision_queue = queue.Queue(maxsize=self.decision_queue_size)
+
+        # this is set when all the stages should stop (cancel or error)
+        self._stop_event = threading.Event()
+
+        # the exceptions raised in the stage threads
+        self._errors = []
+
+        # the results
+        self.scene_changes = []
+        self.filtered_scene_changes = []
+        self.uncertain_scene_changes = []
+        self.total_encoded_frames = 0
+        self.total_empty_frames = 0
+
+        # the selected frames waiting to be encoded together [(shot frame index, selected frame index, frame)]
+        self._encode_batch = []
+
+        # the features of the last indexed frame (to skip similar neighbors)
+        self._last_frame_features = None
+
+    def _put(self, target_queue, item):
+        """
+        This puts the item in the queue, but gives up if the pipeline was stopped
+        """
+
+        while not self._stop_event.is_set():
+            try:
+                target_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def _get(self, source_queue):
+        """
+        This gets the next item from the queue, or _END if the pipeline was stopped
+        """
+
+        while not self._stop_event.is_set():
+            try:
+                return source_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+        return self._END
+
+    def _run_stage(self, stage, output_queue):
+        """
+        This runs a stage in its thread and makes sure the next stage hears about the end of the stream
+        """
+
+        try:
+            stage()
+
+        except Exception as e:
+            logger.error('Error in video indexing stage {}: {}'.format(stage.__name__, e), exc_info=True)
+            self._errors.append(e)
+            self._stop_event.set()
+
+        finally:
+            self._put(output_queue, self._END)
+
+    def _decode_frames(self):
+        """
+        STAGE 0 - decode each frame of the video once, in order
+        """
+
+        for frame_index, frame in self.reader:
+
+            self.decoded_frame_index = frame_index
+
+            if not self._put(self._frame_queue, (frame_index, frame)):
+                break
+
+    def _iter_frames(self):
+
+        while True:
+
+            item = self._get(self._frame_queue)
+
+            if item is self._END:
+                return
+
+            yield item
+
+    def _detect_scene_changes(self):
+        """
+        STAGE 1 - find the shot changes (see ClipIndex.get_scene_changes) and run the sharpness search for each shot
+        """
+
+        clip_index = self.clip_index
+        jump_every_frames = self.jump_every_frames
+
+        # the last jump_every_frames frames, so we can go back to find the exact frame of a shot change
+        recent_frames = OrderedDict()
+
+        # the shots that are waiting for their first frame
+        pending_shots = deque()
+
+        # the sharpness searches that are still running
+        trackers = []
+
+        # this is where we stop moving forward
+        end_frame_index = self.trim_after_frame \
+            if self.trim_after_frame is not None else max(self.reader.total_frames, 1)
+
+        def add_shot(frame_index):
+            pending_shots.append({'position': len(self.scene_changes), 'frame_index': frame_index,
+                                  'frame': None, 'triage': None, 'tracker': None})
+            self.scene_changes.append(frame_index)
+
+        def release_frame(frame_index, frame):
+            """
+            This is called when the frame leaves the recent frames,
+            by then, we know for sure if a shot starts on it
+            """
+
+            starting_shots = []
+            while pending_shots and pending_shots[0]['frame_index'] <= frame_index:
+                shot = pending_shots.popleft()
+                shot['frame'] = frame if shot['frame_index'] == frame_index else None
+                starting_shots.append(shot)
+
+            if starting_shots:
+
+                # a new shot might be where the previous shots end
+                for tracker in trackers:
+                    tracker.add_shot_end(frame_index)
+
+                if self.prefer_sharp:
+                    tracker = SharpnessTracker(frame_index)
+                    trackers.append(tracker)
+
+                    for shot in starting_shots:
+                        shot['tracker'] = tracker
+
+            trackers[:] = [tracker for tracker in trackers if tracker.active]
+
+            # analyze the frame only once for everything that needs it
+            # (the emptiness checks of the shot start and the sharpness searches)
+            if starting_shots or trackers:
+                triage = clip_index.triage_frame(frame)
+
+                for shot in starting_shots:
+                    shot['triage'] = triage
+
+                for tracker in trackers:
+                    tracker.feed(frame_index, frame, triage['sharpness'])
+
+            for shot in starting_shots:
+                if not self._put(self._shot_queue, shot):
+                    return False
+
+            return True
+
+        previous_frame = None
+        shot_change_detected = False
+        scene_start_frame_index = None
+
+        # the next frame the detection needs to look at
+        current_frame_index = self.trim_before_frame
+
+        # we always start with a shot change
+        add_shot(current_frame_index)
+
+        for frame_index, frame in self._iter_frames():
+
+            recent_frames[frame_index] = frame
+
+            if len(recent_frames) > jump_every_frames:
+                if not release_frame(*recent_frames.popitem(last=False)):
+                    return
+
+            # skip the frames until we reach the one we need
+            if frame_index < current_frame_index:
+                continue
+
+            # if we have a trim after and we have reached it then stop
+            if self.trim_after_frame is not None and current_frame_index >= self.trim_after_frame:
+                logger.debug('Reached trim frame {}. Stopping detection here.'.format(self.trim_after_frame))
+                break
+
+            current_frame = frame
+
+            # we don't have a last frame or we detected a change
+            if previous_frame is None \
+                    or (shot_change_detected := clip_index.fast_detect_change(
+                        current_frame, previous_frame, **self.detection_kwargs)):
+
+                # since we're jumping frames, whenever a change was detected,
+                # go through the recent frames to find the exact frame where it happened
+                if previous_frame is not None:
+                    stopped_at_frame = current_frame_index
+
+                    current_frame_index = max(0, current_frame_index - jump_every_frames + 1)
+
+                    while current_frame_index <= stopped_at_frame:
+
+                        current_frame = recent_frames.get(current_frame_index)
+
+                        if clip_index.fast_detect_change(current_frame, previous_frame, **self.detection_kwargs):
+                            break
+
+                        previous_frame = current_frame
+                        current_frame_index += 1
+
+                scene_start_frame_index = current_frame_index
+                add_shot(scene_start_frame_index)
+
+                current_frame_index += jump_every_frames
+
+            # compare using content analysis every X frames since the last detected change
+            elif current_frame_index - scene_start_frame_index >= self.content_analysis_every:
+
+                similarity = clip_index.calculate_similarity(current_frame, previous_frame, device=clip_index.device)
+
+                if similarity < 0.85:
+                    scene_start_frame_index = current_frame_index
+                    add_shot(scene_start_frame_index)
+
+                current_frame_index += jump_every_frames
+
+            else:
+                # otherwise we just move to the next frame (or to the last frame if we reached the end)
+                current_frame_index += jump_every_frames \
+                    if current_frame_index + jump_every_frames < end_frame_index \
+                    else max(1, end_frame_index - current_frame_index)
+
+            if previous_frame is not None and self.detection_kwargs.get('visualize', False):
+                clip_index._visualize_shot_change(
+                    previous_frame, current_frame, current_frame_index, shot_change_detected)
+
+            previous_frame = current_frame
+
+        # release the frames that are left
+        while recent_frames:
+            if not release_frame(*recent_frames.popitem(last=False)):
+                return
+
+        # the shots that start after the last decoded frame won't get a frame
+        while pending_shots:
+            if not self._put(self._shot_queue, pending_shots.popleft()):
+                return
+
+    def _analyze_neighbor_shots(self):
+        """
+        STAGE 2 - filter out the shot changes that are too similar to their close neighbors
+        (see ClipIndex.analyze_neighbor_shots)
+        """
+
+        clip_index = self.clip_index
+
+        fps = self.reader.fps or 0
+
+        if self.shot_frequency == 'high':
+            closeness_threshold = int(fps) // 2
+        elif self.shot_frequency == 'low':
+            closeness_threshold = int(fps) * 2
+        else:
+            closeness_threshold = int(fps) // 1
+
+        # the shots we received from the detection
+        # (we drop the reference to each shot once it's sent further, so its frames can be released)
+        shots = []
+        stream_ended = False
+
+        def has_shot(position):
+            """
+            This waits until we know if there's a shot at this position
+            """
+
+            nonlocal stream_ended
+
+            while len(shots) <= position and not stream_ended:
+
+                shot = self._get(self._shot_queue)
+
+                if shot is self._END:
+                    stream_ended = True
+                    break
+
+                shots.append(shot)
+
+            return position < len(shots)
+
+        # the positions of the shots that were removed
+        removed_positions = set()
+
+        position = 0
+
+        while has_shot(position):
+
+            shot = shots[position]
+            frame_index = shot['frame_index']
+
+            local_closeness_threshold = closeness_threshold
+
+            if position in removed_positions:
+                shots[position] = None
+                if not self._put(self._decision_queue, (shot, False)):
+                    return
+                position += 1
+                continue
+
+            frame1 = shot['frame']
+
+            idx = position
+
+            while has_shot(idx + 1) and frame_index + local_closeness_threshold >= shots[idx + 1]['frame_index']:
+
+                next_frame_index = shots[idx + 1]['frame_index']
+                frame2 = shots[idx + 1]['frame']
+
+                shot_removed = False
+
+                # without a frame we can't compare anything, so we keep the shot
+                if frame1 is None or frame2 is None:
+                    break
+
+                # use the cropped version of the frames in case they have black bars
+                frame1, frame2 = clip_index._use_cropped_frames(frame1, frame2)
+
+                if frame1.shape != frame2.shape:
+                    break
+
+                ssim_index = clip_index.ssim(frame1, frame2)
+
+                points_matching_ratio = clip_index.compare_using_orb(frame1, frame2, visualize=False)
+
+                if points_matching_ratio is None:
+                    points_matching_ratio = 0
+
+                if (ssim_index > 0.65 and points_matching_ratio > 0.50) \
+                        or (ssim_index > 0.75 and points_matching_ratio > 0.10) \
+                        or ssim_index > 0.79 \
+                        or points_matching_ratio > 0.50:
+                    shot_removed = True
+
+                elif clip_index.calculate_similarity(frame1, frame2, device=clip_index.device) > 0.85:
+                    shot_removed = True
+
+                if shot_removed:
+                    removed_positions.add(idx + 1)
+
+                    # also check the shots that are close to the one we just removed
+                    local_closeness_threshold = next_frame_index - frame_index + closeness_threshold * 1.1
+
+                    idx += 1
+
+                else:
+                    self.uncertain_scene_changes.append(next_frame_index)
+                    break
+
+            self.filtered_scene_changes.append(frame_index)
+
+            shots[position] = None
+            if not self._put(self._decision_queue, (shot, True)):
+                return
+
+            position += 1
+
+    def _encode_shot(self, shot, shot_end_index):
+        """
+        STAGE 3 - select the best frame of the shot and add it to the encoding batch (see ClipIndex.index_video)
+        """
+
+        clip_index = self.clip_index
+
+        tracker = shot['tracker']
+        frame = shot['frame']
+        frame_index = shot['frame_index']
+
+        # we won't need any more frames for this search
+        if tracker is not None:
+            tracker.closed = True
+
+        if frame is None:
+            return
+
+        # if the frame is empty, skip it
+        if clip_index.is_skippable_frame(
+                shot['triage'] or clip_index.triage_frame(frame),
+                skip_color_blocks=self.skip_color_blocks, skip_empty=self.skip_empty, skip_dark=self.skip_dark):
+
+            logger.debug('Skipping empty, color block or dark frame {}'.format(frame_index))
+
+            self.total_empty_frames += 1
+
+            return
+
+        selected_frame_index = frame_index
+
+        # use the sharpest frame between the start of this shot and the next one
+        if self.prefer_sharp and tracker is not None \
+                and shot_end_index is not None and frame_index < shot_end_index:
+
+            sharpest_frame_index, sharpest_frame = tracker.select(shot_end_index)
+
+            if sharpest_frame is not None:
+                selected_frame_index, frame = sharpest_frame_index, sharpest_frame
+
+        self._encode_batch.append((frame_index, selected_frame_index, frame))
+
+        # encode the frames once we have enough patches for a full batch
+        rows, columns = clip_index.get_patch_grid(frame.shape)
+        if len(self._encode_batch) * rows * columns >= clip_index.encode_batch_size:
+            self._encode_frames()
+
+    def _encode_frames(self):
+        """
+        This encodes the frames waiting in the encoding batch
+        """
+
+        if not self._encode_batch:
+            return
+
+        clip_index = self.clip_index
+
+        logger.debug('Encoding frames {}'.format([frame_index for _, frame_index, _ in self._encode_batch]))
+
+        results = clip_index.encode_frames(
+            [(selected_frame_index, frame) for _, selected_frame_index, frame in self._encode_batch], self.path,
+            last_frame_features=self._last_frame_features if self.skip_similar_neighbors else None,
+            skip_similar_neighbors=self.skip_similar_neighbors
+        )
+
+        if results is False:
+            raise RuntimeError('Unable to encode frames of video {}'.format(self.path))
+
+        for (shot_frame_index, _, _), frame_features in zip(self._encode_batch, results):
+
+            if frame_features is None:
+                continue
+
+            # the next frame will be compared with the last one we indexed
+            self._last_frame_features = frame_features
+
+            clip_index.indexed_frames.append(shot_frame_index)
+            self.total_encoded_frames += 1
+
+        self._encode_batch = []
+
+    def _report_progress(self, progress_bar):
+        """
+        :return: False if the callback asked us to stop
+        """
+
+        if progress_bar is not None:
+            progress_bar.update(max(0, self.decoded_frame_index - progress_bar.n))
+
+        if self.frame_progress_callback and callable(self.frame_progress_callback):
+            return bool(self.frame_progress_callback(
+                current_frame_index=self.decoded_frame_index, total_frames=self.reader.total_frames))
+
+        return True
+
+    def run(self):
+        """
+        This runs the pipeline and fills the ClipIndex with the encoded frames
+        :return: True if the video was indexed, False if it was canceled or something went wrong
+        """
+
+        clip_index = self.clip_index
+
+        if not os.path.isfile(self.path):
+            logger.error('File not found or path is not a file: {}'.format(self.path))
+            return False
+
+        end_frame = self.trim_after_frame if self.trim_after_frame is not None else None
+        self.reader = VideoFrameReader(self.path, start_frame=self.trim_before_frame, end_frame=end_frame)
+
+        # we need the size of the frames before encoding anything
+        if not self.reader.width or not self.reader.height:
+            self.reader.release()
+            logger.error('Unable to get the frame size of video: {}'.format(self.path))
+            return False
+
+        clip_index.source_path = self.path
+        clip_index._height, clip_index._width = self.reader.height, self.reader.width
+        clip_index.calculate_patch_dims()
+
+        if clip_index._video_fps is None:
+            clip_index._video_fps = self.reader.fps
+
+        clip_index.load_model()
+
+        logger.info('Indexing video in a single pass: {}'.format(self.path))
+
+        threads = [
+            threading.Thread(target=self._run_stage, args=(stage, output_queue), daemon=True,
+                             name='VideoIndexing-{}'.format(stage.__name__.strip('_')))
+            for stage, output_queue in [
+                (self._decode_frames, self._frame_queue),
+                (self._detect_scene_changes, self._shot_queue),
+                (self._analyze_neighbor_shots, self._decision_queue)
+            ]
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        progress_bar = tqdm.tqdm(total=self.reader.total_frames, unit='frames', desc="Indexing Video") \
+            if self.show_progress_bar else None
+
+        # the last shot that survived the neighbor analysis,
+        # we can only encode it once we know where it ends (where the next surviving shot starts)
+        pending_shot = None
+        canceled = False
+
+        try:
+            while not self._stop_event.is_set():
+
+                if not self._report_progress(progress_bar):
+                    canceled = True
+                    break
+
+                try:
+                    item = self._decision_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+
+                if item is self._END:
+                    break
+
+                shot, shot_survived = item
+
+                if not shot_survived:
+
+                    # stop the sharpness search of the removed shot (unless another shot is using it)
+                    if shot['tracker'] is not None \
+                            and (pending_shot is None or pending_shot['tracker'] is not shot['tracker']):
+                        shot['tracker'].closed = True
+
+                    continue
+
+                if pending_shot is not None:
+                    self._encode_shot(pending_shot, shot['frame_index'])
+
+                pending_shot = shot
+
+            if not canceled and not self._errors:
+
+                if pending_shot is not None:
+                    self._encode_shot(pending_shot, None)
+
+                self._encode_frames()
+
+        finally:
+
+            # this makes all the stages stop if they didn't already
+            self._stop_event.set()
+
+            for thread in threads:
+                thread.join()
+
+            self.reader.release()
+
+            if progress_bar is not None:
+                progress_bar.close()
+
+        if canceled or self._errors:
+            return False
+
+        clip_index.scene_change_frames = self.filtered_scene_changes
+
+        logger.info('Finished indexing: {}. Encoded {} frames out of {} detected shots.'
+                    .format(self.path, self.total_encoded_frames, len(self.filtered_scene_changes)))
+
+        return True
@@ -1,5 +1,7 @@
 import copy
 import os.path
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 import tqdm
 
@@ -20,9 +22,8 @@ from scipy import stats
 from scipy.spatial.distance import cosine
 from skimage.metrics import structural_similarity as ssim
 
-from collections import defaultdict
-
 from storytoolkitai.core.logger import logger
+from storytoolkitai.core.toolkit_ops.video_index_buffers import EmbeddingBuffer, FrameMetadata
 
 class ClipIndex:
 
@@ -49,11 +50,26 @@ class ClipIndex:
         self.clip_model_name = clip_model_name
         self.clip_model = self.clip_prep = None
 
+        # the input size and the normalization values of the CLIP preprocessor (see preprocess_patches)
+        self._preprocess_params = None
+
+        # how many patches are sent to the CLIP model at once
+        self.encode_batch_size = kwargs.get('encode_batch_size', 64)
+
         # this will contain all the image features for our video in a tensor
-        self.video_encoded = None
+        self._embeddings = EmbeddingBuffer()
 
         # this will hold the metadata for every image feature held in video_encoded
-        self.video_frames = []
+        self._video_frames = FrameMetadata()
+
+        # the patch to frame mapping used to score whole frames when searching (see _get_frame_segments)
+        self._frame_segments = None
+
+        # the memory-mapped embeddings of multiple videos, used instead of video_encoded (see load_shards)
+        self._embedding_shards = None
+
+        # the shard embeddings that were moved to the device or converted to the search dtype {shard index: tensor}
+        self._shard_tensors = {}
 
         # this will hold other metadata (like fps etc.) for the video
         self.video_other_metadata = []
@@ -72,6 +88,42 @@ class ClipIndex:
     def video_fps(self):
         return self._video_fps
 
+    @property
+    def video_encoded(self):
+        """
+        The image features of all the indexed patches in a tensor (or None if nothing was indexed)
+        """
+
+        # if the embeddings come from memory-mapped shards, we need to put them together now
+        if self._embedding_shards:
+            self._embeddings = EmbeddingBuffer(
+                torch.from_numpy(np.concatenate([shard.embeddings for shard in self._embedding_shards]))
+                .to(self.device))
+            self._embedding_shards = None
+            self._shard_tensors = {}
+
+        return self._embeddings.tensor
+
+    @video_encoded.setter
+    def video_encoded(self, value):
+        self._embeddings = EmbeddingBuffer(value)
+        self._embedding_shards = None
+        self._shard_tensors = {}
+
+    def has_embeddings(self):
+        return len(self._embeddings) > 0 or bool(self._embedding_shards)
+
+    @property
+    def video_frames(self):
+        """
+        The metadata of each image feature held in video_encoded (see FrameMetadata)
+        """
+        return self._video_frames
+
+    @video_frames.setter
+    def video_frames(self, value):
+        self._video_frames = value if isinstance(value, FrameMetadata) else FrameMetadata(value)
+
     @property
     def unique_frames(self):
         """
@@ -448,7 +500,8 @@ class ClipIndex:
 
         try:
 
-            ssim_index = ssim(frame1, frame2, multichannel=True, win_size=3)
+            # grayscale frames only have one channel
+            ssim_index = ssim(frame1, frame2, multichannel=len(frame1.shape) == 3, win_size=3)
 
         except ValueError:
 
@@ -544,6 +597,10 @@ class ClipIndex:
             resized_frame1 = cv2.resize(frame1, (0, 0), fx=resize_factor, fy=resize_factor)
             resized_frame2 = cv2.resize(frame2, (0, 0), fx=resize_factor, fy=resize_factor)
 
+        # the frames might already be small enough (for eg. when they're streamed by ffmpeg)
+        else:
+            resized_frame1, resized_frame2 = frame1, frame2
+
         # crop the frames if they have black bars around them
         resized_frame1, resized_frame2 = ClipIndex._use_cropped_frames(resized_frame1, resized_frame2)
 
@@ -610,6 +667,8 @@ class ClipIndex:
 
         self.clip_model, self.clip_prep = clip.load(self.clip_model_name, self.device, jit=False)
 
+        self._preprocess_params = None
+
     def index_video(self, path=None,
                     *,
                     detected_shots: list = None,
@@ -760,9 +819,9 @@ class ClipIndex:
             ret, frame = cap.read()
 
             # if the frame is empty, skip it
-            if (skip_color_blocks and self.is_single_color_block(frame)) \
-                    or self.is_empty_frame(frame, threshold=skip_empty)\
-                    or self.is_dark_frame(frame, ire=skip_dark):
+            if self.is_skippable_frame(
+                    self.triage_frame(frame),
+                    skip_color_blocks=skip_color_blocks, skip_empty=skip_empty, skip_dark=skip_dark):
 
                 logger.debug('Skipping empty, color block or dark frame {}'.format(current_frame_index))
 
@@ -895,6 +954,45 @@ class ClipIndex:
 
         return True
 
+    def index_video_single_pass(self, path=None,
+                                *,
+                                detection_options: dict = None,
+                                shot_frequency: str = 'medium',
+                                frame_progress_callback: callable = None,
+                                **kwargs):
+        """
+        This detects the scene changes, analyzes the neighbor shots and indexes the video
+        while decoding each frame only once (see VideoIndexingPipeline).
+        The result should be the same as running get_scene_changes, analyze_neighbor_shots and index_video,
+        but without opening the video three times and seeking before each frame.
+
+        :param path: path to video file
+        :param detection_options: the options for the scene detection (see get_scene_changes)
+        :param shot_frequency: how often should we expect shots to change (see analyze_neighbor_shots)
+        :param frame_progress_callback: this is called with current_frame_index and total_frames,
+                                        if it returns something falsy, the indexing is canceled
+        :param kwargs: the indexing options (see index_video)
+        :return: True if the video was indexed, False otherwise
+        """
+
+        from storytoolkitai.core.toolkit_ops.video_pipeline import VideoIndexingPipeline
+
+        # if no path was provided, try to use the source path
+        if path is None:
+            path = self.source_path
+
+        # the frame size is calculated by the pipeline
+        kwargs.pop('patch_divider', None)
+
+        pipeline = VideoIndexingPipeline(
+            self, path,
+            shot_frequency=shot_frequency,
+            frame_progress_callback=frame_progress_callback,
+            **{**(detection_options or dict()), **kwargs}
+        )
+
+        return pipeline.run()
+
     @staticmethod
     def get_frame_sharpness_laplacian(frame):
         """
@@ -910,9 +1008,6 @@ class ClipIndex:
         # scale the image to 0.5x
         gray = cv2.resize(gray, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
 
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        gray = cv2.resize(gray, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
-
         laplacian = cv2.Laplacian(gray, cv2.CV_64F)
         sharpness_score = laplacian.var()
 
@@ -1051,6 +1146,33 @@ class ClipIndex:
         :param skip_similar_threshold: The threshold to use when comparing the last frame to the current frame
         """
 
+        results = self.encode_frames(
+            [(frame_idx, frame)], path,
+            last_frame_features=last_frame_features, skip_similar_threshold=skip_similar_threshold
+        )
+
+        if not results:
+            return results
+
+        return results[0]
+
+    def encode_frames(self, frames, path, last_frame_features=None, skip_similar_threshold=0.90,
+                      skip_similar_neighbors=True):
+        """
+        This encodes multiple frames using the clip model.
+        The patches of all the frames are sent to the model in batches of encode_batch_size patches,
+        so the model doesn't have to run once for each frame.
+
+        :param frames: a list of (frame_idx, frame) tuples, in the order they appear in the video
+        :param path: The path to the video file
+        :param last_frame_features: The features of the last frame that was indexed before these frames
+        :param skip_similar_threshold: The threshold to use when comparing a frame to the last indexed frame
+        :param skip_similar_neighbors: if this is True, each frame is compared to the last indexed frame
+                                       and it's not indexed if they're too similar
+        :return: a list with the features of each frame (None for the frames that were skipped)
+                 or False if something went wrong
+        """
+
         if self.clip_model is None or self.clip_prep is None:
             self._load_model()
 
@@ -1058,100 +1180,171 @@ class ClipIndex:
             logger.error('Cannot encode frame - file {} not found or is not a file.'.format(path))
             return False
 
-        # initialize the metadata list for this frame
-        frame_metadata = []
+        if not frames:
+            return []
 
-        # split frame into patches - but use the custom patchify function
-        # patches = patchify(frame, self._patch_shape, self._patch_step).squeeze()
-        patches, coordinates = self.patchify_custom(frame, self._patch_shape, self._patch_step, return_coordinates=True)
+        # split the frames into patches
+        frame_patches = [self.get_frame_patches(frame) for _, frame in frames]
 
-        # show the patches on the frame in a cv2 window using the coordinates and the patch_shape
-        # self.show_patches(frame, coordinates)
+        patches = np.concatenate(frame_patches, axis=0)
 
-        # todo: add a few bigger patches that cover the entire image to make sure we have all the content
-        # resize the frame so that it fits the self._patch_shape on it's smallest side
-        # aspect_ratio = float(frame.shape[1]) / float(frame.shape[0])
-        # if frame.shape[1] > frame.shape[0]:
-        #     new_shape = (int(self._patch_size * aspect_ratio), self._patch_size)
-        # else:
-        #     new_shape = (self._patch_size, int(self._patch_size / aspect_ratio))
-        # frame_small = cv2.resize(frame, new_shape)
+        # encode all the patches, one batch at a time
+        batch_size = max(1, int(self.encode_batch_size))
+        features = []
+        with torch.no_grad():
+            for batch_start in range(0, len(patches), batch_size):
 
-        # patches2 = self.patchify_custom(frame_small, self._patch_shape, self._patch_step)
+                batch = self.preprocess_patches(patches[batch_start:batch_start + batch_size])
 
-        # patches is a 2d array of images patches lets unravel into a 1d array of patches
-        shape = patches.shape
-        patches = patches.reshape(shape[0] * shape[1], *self._patch_shape)
+                features.append(self.clip_model.encode_image(batch))
 
-        # clip wants PIL image objects
-        pils = []
-        for p in patches:
+        features = torch.cat(features, dim=0)
 
-            # add the metadata for this patch
-            frame_metadata.append({'path': os.path.basename(path), 'frame': frame_idx})
+        # make sure that we have the same number of features and patches
+        if features.shape[0] != len(patches):
+            logger.error('Frame features and metadata do not match. Aborting.')
+            return False
 
-            # convert the patch to a PIL image and add it to the list
-            pils.append(self.clip_prep(Image.fromarray(p)))
+        # normalize the image feature vectors so that they all have a length of 1
+        features /= features.norm(dim=-1, keepdim=True)
 
-        # place all the patches into a single tensor
-        tensor = torch.stack(pils, dim=0)
-        uploaded = tensor.to(self.device)
+        results = []
+        patch_start = 0
+        for (frame_idx, _), current_patches in zip(frames, frame_patches):
 
-        # encode the image features for our patches into a feature vector
-        with torch.no_grad():
-            frame_features = self.clip_model.encode_image(uploaded)
+            frame_features = features[patch_start:patch_start + len(current_patches)]
+            patch_start += len(current_patches)
 
-        # make sure that we have the same number of features and metadata
-        if frame_features.shape[0] != len(frame_metadata):
-            logger.error('Frame features and metadata do not match. Aborting.')
-            return
+            # if we have a last frame, compare the two and decide whether to skip this frame or to index it
+            if last_frame_features is not None:
 
-        # normalize the image feature vectors so that they all have a length of 1
-        frame_features /= frame_features.norm(dim=-1, keepdim=True)
+                # since this is a batch of patches, we take the average similarity
+                average_similarity = \
+                    torch.mean(torch.cosine_similarity(frame_features, last_frame_features, dim=-1))
 
-        # if we have a last frame, compare the two and decide whether to skip this frame or to index it
-        if last_frame_features is not None:
+                # if the average similarity is above the threshold,
+                # it means that this frame is very similar to the last, so we skip it
+                if average_similarity > skip_similar_threshold:
+                    results.append(None)
+                    continue
 
-            # calculate the similarity between the two frames
-            similarity = torch.cosine_similarity(frame_features, last_frame_features, dim=-1)
+            # if we reached this point, it means that we want to index this frame
+            self._embeddings.append(frame_features)
+            self._video_frames.add(os.path.basename(path), frame_idx, count=len(current_patches))
 
-            # since this is a batch of patches, we take the average similarity
-            average_similarity = torch.mean(similarity)
+            results.append(frame_features)
 
-            # if the average similarity is above the threshold,
-            # it means that this frame is very similar to the last
-            if average_similarity > skip_similar_threshold:
+            # the next frame in the list will be compared with this one
+            if skip_similar_neighbors:
+                last_frame_features = frame_features
 
-                # print('Skipping frame {} - similarity: {}'.format(frame_idx, average_similarity))
+        return results
 
-                # so we skip it
-                return None
+    def get_frame_patches(self, frame):
+        """
+        This splits the frame into patches using the patch shape and step of the index
+        :return: an array of patches with the shape (patches, patch height, patch width, channels)
+        """
+
+        patch_height, patch_width = self._patch_shape[:2]
+
+        rows, columns = self.get_patch_grid(frame.shape)
+
+        return np.stack([
+            frame[row * self._patch_step[0]:row * self._patch_step[0] + patch_height,
+                  column * self._patch_step[1]:column * self._patch_step[1] + patch_width]
+            for row in range(rows) for column in range(columns)
+        ])
+
+    def get_patch_grid(self, frame_shape):
+        """
+        This returns the number of patch rows and columns for a frame of this shape
+        """
+
+        return ((frame_shape[0] - self._patch_shape[0]) // self._patch_step[0] + 1,
+                (frame_shape[1] - self._patch_shape[1]) // self._patch_step[1] + 1)
+
+    def _get_preprocess_params(self):
+        """
+        This reads the input size and the normalization values from the CLIP preprocessor,
+        so we can apply the same transforms to whole batches of patches
+        :return: (input size, mean, std) or None if the preprocessor isn't what we expect
+        """
+
+        if self._preprocess_params is not None:
+            return self._preprocess_params or None
+
+        input_size = mean = std = None
+
+        for transform in getattr(self.clip_prep, 'transforms', []):
+
+            if isinstance(transform, transforms.Resize):
+                input_size = transform.size if isinstance(transform.size, int) else min(transform.size)
+
+            elif isinstance(transform, transforms.Normalize):
+                mean, std = transform.mean, transform.std
 
-            # print('Adding frame {} to index - similarity: {}'.format(frame_idx, average_similarity))
+        if input_size is None or mean is None or std is None:
+            logger.debug('Unknown CLIP preprocessor, patches will be preprocessed one by one.')
+            self._preprocess_params = False
+            return None
+
+        self._preprocess_params = (
+            input_size,
+            torch.tensor(mean, device=self.device).view(1, -1, 1, 1),
+            torch.tensor(std, device=self.device).view(1, -1, 1, 1)
+        )
+
+        return self._preprocess_params
+
+    def preprocess_patches(self, patches):
+        """
+        This does the same as running the CLIP preprocessor on each patch (resize, center crop, normalize),
+        but for the whole batch at once
+        :param patches: an array of patches with the shape (patches, height, width, channels)
+        :return: a tensor ready to be sent to the CLIP model
+        """
+
+        preprocess_params = self._get_preprocess_params()
+
+        # if we don't know how to preprocess the patches, use the CLIP preprocessor on each of them
+        if preprocess_params is None:
+            return torch.stack([self.clip_prep(Image.fromarray(patch)) for patch in patches], dim=0)\
+                .to(self.device)
+
+        input_size, mean, std = preprocess_params
+
+        batch = torch.from_numpy(np.ascontiguousarray(patches)).to(self.device).permute(0, 3, 1, 2).float()
+
+        # resize the smallest side to the input size (using the same interpolation as the CLIP preprocessor)
+        height, width = batch.shape[-2:]
+        if min(height, width) != input_size:
+            scale = input_size / min(height, width)
+            batch = torch.nn.functional.interpolate(
+                batch, size=(max(input_size, round(height * scale)), max(input_size, round(width * scale))),
+                mode='bicubic', align_corners=False, antialias=True
+            )
 
-        # if we reached this point, it means that we want to index this frame
-        self._index_frame(frame_features, frame_metadata)
+            # the preprocessor works with 8-bit images
+            batch = batch.clamp(0, 255).round()
 
-        return frame_features
+        # center crop
+        height, width = batch.shape[-2:]
+        top, left = (height - input_size) // 2, (width - input_size) // 2
+        batch = batch[:, :, top:top + input_size, left:left + input_size]
+
+        return (batch / 255 - mean) / std
 
     def _index_frame(self, frame_features, frame_metadata):
         """
         This indexes a frame by adding its features to the video features and its metadata to the video frames list.
         """
 
-        # if we reached this point, it means that we want to index this frame
         # add the frame features to the video features
-        if self.video_encoded is not None:
-
-            # concatenate the frame features to the video features if we already have some
-            self.video_encoded = torch.cat((self.video_encoded, frame_features), dim=0)
-        else:
-
-            # otherwise just set the video features to the frame features
-            self.video_encoded = frame_features
+        self._embeddings.append(frame_features)
 
         # add the frame metadata to the video frames list
-        self.video_frames.extend(frame_metadata)
+        self._video_frames.extend(frame_metadata)
 
     @staticmethod
     def is_empty_frame(frame, resize_factor=0.5, threshold=2):
@@ -1214,23 +1407,22 @@ class ClipIndex:
                  or just the boolean (if return_color is False)
         """
 
-        # calculate the range of each channel
-        min_b, max_b = np.min(frame[:, :, 0]), np.max(frame[:, :, 0])
-        min_g, max_g = np.min(frame[:, :, 1]), np.max(frame[:, :, 1])
-        min_r, max_r = np.min(frame[:, :, 2]), np.max(frame[:, :, 2])
+        # treat grayscale frames as frames with a single channel
+        if len(frame.shape) == 2:
+            frame = frame[:, :, np.newaxis]
 
-        is_single_color = (max_b - min_b < threshold) and (max_g - min_g < threshold) and (max_r - min_r < threshold)
+        # calculate the range of each channel
+        is_single_color = all(
+            np.max(frame[:, :, channel]) - np.min(frame[:, :, channel]) < threshold
+            for channel in range(frame.shape[2])
+        )
 
         # if we need the color back, calculate it
         if return_color:
 
             if is_single_color:
-                # Calculate the average color in the BGR format
-                avg_b = np.mean(frame[:, :, 0])
-                avg_g = np.mean(frame[:, :, 1])
-                avg_r = np.mean(frame[:, :, 2])
-
-                return True, (avg_b, avg_g, avg_r)
+                # Calculate the average color in the BGR format (or the average intensity for grayscale frames)
+                return True, tuple(np.mean(frame[:, :, channel]) for channel in range(frame.shape[2]))
 
             else:
                 return False, None
@@ -1239,6 +1431,69 @@ class ClipIndex:
         else:
             return is_single_color
 
+    @staticmethod
+    def triage_frame(frame, resize_factor=0.5):
+        """
+        This calculates all the statistics we need to decide if a frame is worth indexing
+        (see is_empty_frame, is_dark_frame, is_single_color_block and get_frame_sharpness_laplacian)
+        but it downsamples and converts the frame only once, instead of once for each check.
+
+        :param frame: the frame to analyze (BGR or grayscale)
+        :param resize_factor: how much to downsample the frame before analyzing it
+        :return: a dict with the mean and standard deviation of the grayscale frame,
+                 the largest range of values of all the channels (single color blocks have a small range),
+                 and the sharpness of the frame (laplacian variance / 1000)
+        """
+
+        # downsample the frame once (averaging the pixels keeps the mean and the flat areas flat)
+        small_frame = cv2.resize(frame, None, fx=resize_factor, fy=resize_factor, interpolation=cv2.INTER_AREA)
+
+        gray = cv2.cvtColor(small_frame, cv2.COLOR_BGR2GRAY) if len(small_frame.shape) == 3 else small_frame
+
+        mean, std = cv2.meanStdDev(gray)
+
+        # the range of values of each channel
+        channel_range = max(
+            max_value - min_value
+            for min_value, max_value, _, _ in (cv2.minMaxLoc(channel) for channel in cv2.split(small_frame))
+        )
+
+        return {
+            'mean': float(mean[0][0]),
+            'std': float(std[0][0]),
+            'channel_range': float(channel_range),
+            'sharpness': float(cv2.Laplacian(gray, cv2.CV_64F).var() / 1000)
+        }
+
+    @staticmethod
+    def triage_frames(frames, resize_factor=0.5, max_workers=None):
+        """
+        This runs triage_frame on a batch of frames using a thread pool
+        (OpenCV releases the GIL, so the frames are analyzed in parallel)
+        :return: a list with the triage result of each frame
+        """
+
+        if len(frames) < 2:
+            return [ClipIndex.triage_frame(frame, resize_factor=resize_factor) for frame in frames]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda frame: ClipIndex.triage_frame(frame, resize_factor=resize_factor), frames))
+
+    @staticmethod
+    def is_skippable_frame(triage, skip_color_blocks=True, skip_empty=0, skip_dark=11):
+        """
+        This uses the result of triage_frame to decide if the frame should be skipped when indexing
+        :param triage: the result of triage_frame
+        :param skip_color_blocks: skip the frames that are single color blocks
+        :param skip_empty: the standard deviation below which the frame is considered empty (0 to disable)
+        :param skip_dark: the average intensity below which the frame is considered dark
+        :return: True if the frame is a single color block, empty or dark
+        """
+
+        return (skip_color_blocks and triage['channel_range'] < 2) \
+            or (bool(skip_empty) and triage['std'] < skip_empty) \
+            or triage['mean'] < skip_dark
+
     def get_scene_changes(self,
                           path=None,
                           *,
@@ -1246,6 +1501,8 @@ class ClipIndex:
                           frame_progress_callback: callable = None,
                           content_analysis_every: int = 40,
                           jump_every_frames: int = 10,
+                          decode_backend: str = 'opencv',
+                          detection_frame_width: int = 480,
                           **kwargs):
         """
         This returns the frame indexes where a shot change occurs.
@@ -1257,6 +1514,10 @@ class ClipIndex:
         :param jump_every_frames: How many frames to jump to detect the scene change
                                     - if a change is detected though, we'll go back to where we started the jump
                                       and compare each frame to find the exact frame where the change occurs
+        :param decode_backend: 'opencv' to seek to the frames we need using OpenCV,
+                               or 'ffmpeg' to stream small grayscale frames from an FFmpeg process
+                               (the jumps back are then served from the last frames we received, without seeking)
+        :param detection_frame_width: the width of the frames streamed by FFmpeg (when using the ffmpeg backend)
 
 
         """
@@ -1272,27 +1533,56 @@ class ClipIndex:
 
         self.source_path = path
 
-        # get the total frames of the video
-        total_frames = self.video_total_frames(path)
-
         logger.info('Detecting scene changes in video: {}'.format(path))
 
-        # open the video
-        cap = cv2.VideoCapture(path)
-
         trim_before_frame = int(trim_before_frame) if trim_before_frame else 0
 
-        # calculate the total frames based on the trim before and trim after frames
-        total_frames = math.ceil((total_frames if not trim_after_frame else trim_after_frame) - trim_before_frame)
-
         # set the current frame index (and take into account the trim before frame)
         current_frame_index = (trim_before_frame if trim_before_frame and int(trim_before_frame) > 0 else 0)
 
-        # read the first frame
-        cap.set(cv2.CAP_PROP_POS_FRAMES, current_frame_index)
+        from storytoolkitai.core.toolkit_ops.video_pipeline import FFmpegFrameReader, FrameWindow, SeekingFrameReader
 
-        # read the first frame
-        ret, current_frame = cap.read()
+        # open the video
+        cap = None
+        if decode_backend == 'ffmpeg':
+
+            try:
+                # we need to be able to go back one jump, and still have the frame before it
+                cap = FrameWindow(
+                    FFmpegFrameReader(
+                        path, start_frame=current_frame_index, end_frame=trim_after_frame,
+                        width=detection_frame_width, gray=True, buffer_count=jump_every_frames + 3),
+                    size=jump_every_frames + 1
+                )
+
+                # read the first frame (this also starts ffmpeg)
+                ret, current_frame = cap.read(current_frame_index)
+
+                if not ret:
+                    raise IOError('FFmpeg did not return any frames.')
+
+                total_frames = cap.reader.total_frames
+
+                # the frames are already scaled down by ffmpeg
+                kwargs['resize_factor'] = None
+
+            except OSError:
+                logger.warning('Cannot stream video {} using FFmpeg. Using OpenCV instead.'.format(path),
+                               exc_info=True)
+
+                if cap is not None:
+                    cap.release()
+                    cap = None
+
+        if cap is None:
+            cap = SeekingFrameReader(path)
+            total_frames = cap.total_frames
+
+            # read the first frame
+            ret, current_frame = cap.read(current_frame_index)
+
+        # calculate the total frames based on the trim before and trim after frames
+        total_frames = math.ceil((total_frames if not trim_after_frame else trim_after_frame) - trim_before_frame)
 
         # use tqdm to show a progress bar
         progress_bar = tqdm.tqdm(total=total_frames, unit='frames', desc="Detecting Scene Changes") \
@@ -1362,14 +1652,11 @@ class ClipIndex:
                     if current_frame_index < 0:
                         current_frame_index = 0
 
-                    # move the playhead back to the frame before the jump
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, current_frame_index)
-
                     # until we reach the frame where we stopped for the deep dive
                     while current_frame_index <= stopped_at_frame:
 
-                        # read the frame
-                        ret, current_frame = cap.read()
+                        # read the frame (starting with the one before the jump)
+                        ret, current_frame = cap.read(current_frame_index)
 
                         # compare using fast_detect
                         if self.fast_detect_change(current_frame, previous_frame, **kwargs):
@@ -1381,7 +1668,8 @@ class ClipIndex:
                         current_frame_index += 1
 
                 # store the frame where the shot change happened
-                scene_start_frame = current_frame
+                # (copy it, since the ffmpeg backend reuses its frame buffers)
+                scene_start_frame = current_frame.copy() if current_frame is not None else None
                 scene_start_frame_index = current_frame_index
 
                 # add the frame index to the list of scene changes
@@ -1401,7 +1689,7 @@ class ClipIndex:
                 if similarity < 0.85:
 
                     # store the frame where the shot change happened
-                    scene_start_frame = current_frame
+                    scene_start_frame = current_frame.copy()
                     scene_start_frame_index = current_frame_index
 
                     # add the frame index to the list of scene changes
@@ -1427,16 +1715,15 @@ class ClipIndex:
             previous_frame = current_frame
             previous_frame_index = current_frame_index
 
-            # move the playhead before the next frame that we should read
-            cap.set(cv2.CAP_PROP_POS_FRAMES, current_frame_index)
-
-            # and read the next frame
-            ret, current_frame = cap.read()
+            # read the next frame that we should look at
+            ret, current_frame = cap.read(current_frame_index)
 
             # calculate the progress bar update
             if progress_bar:
                 progress_bar.update(current_frame_index - progress_bar.n)
 
+        cap.release()
+
         if len(scene_changes) <= 1:
             logger.info('No shot changes detected.')
             return []
@@ -1659,7 +1946,7 @@ class ClipIndex:
         loader = transforms.Compose([transforms.Resize((224, 224)), transforms.ToTensor(),
                                      transforms.Normalize(mean=[0.485, 0.456, 0.406],
                                                           std=[0.229, 0.224, 0.225])])
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB if len(frame.shape) == 3 else cv2.COLOR_GRAY2RGB)
         frame = Image.fromarray(frame).convert('RGB')
         frame = loader(frame).unsqueeze(0)
         return frame
@@ -1681,7 +1968,7 @@ class ClipIndex:
 
     def search(self, query, n=6, threshold=35, combine_patches=True):
 
-        if self.video_encoded is None or self.video_frames is None:
+        if not self.has_embeddings() or self.video_frames is None:
             return
 
         if self.clip_model is None:
@@ -1695,6 +1982,15 @@ class ClipIndex:
         # normalize the query feature vector so that it has a length of 1
         query_features /= query_features.norm(dim=-1, keepdim=True)
 
+        # if the embeddings are in shards, compare the query with each of them
+        if self._embedding_shards:
+            similarity = 100.0 * self._get_shards_similarity(query_features)
+
+            if combine_patches:
+                return self._combine_patches(similarity, n)
+
+            return self._all_patches(similarity, n, threshold)
+
         # convert the embeddings to this machine's dtype if necessary
         if query_features.dtype != self.video_encoded.dtype:
             self.video_encoded = self.video_encoded.to(query_features.dtype)
@@ -1724,6 +2020,63 @@ class ClipIndex:
 
         return result
 
+    def _get_shards_similarity(self, query_features):
+        """
+        This calculates the similarity between the query and the embeddings of all the shards
+        (the same as query_features @ video_encoded.T, but without putting the embeddings together first)
+        """
+
+        similarities = []
+
+        for shard_idx, shard in enumerate(self._embedding_shards):
+
+            shard_tensor = self._shard_tensors.get(shard_idx, None)
+
+            if shard_tensor is None or shard_tensor.dtype != query_features.dtype:
+
+                with warnings.catch_warnings():
+
+                    # the memory-mapped arrays are read-only, but we never write to them
+                    warnings.simplefilter('ignore', UserWarning)
+                    shard_tensor = torch.from_numpy(shard.embeddings)
+
+                # only keep a copy of the embeddings if they need to be moved or converted,
+                # otherwise we keep reading them from the memory-mapped file
+                if shard_tensor.device != query_features.device or shard_tensor.dtype != query_features.dtype:
+                    shard_tensor = shard_tensor.to(device=query_features.device, dtype=query_features.dtype)
+                    self._shard_tensors[shard_idx] = shard_tensor
+
+            similarities.append(query_features @ shard_tensor.T)
+
+        return torch.cat(similarities, dim=1)
+
+    def load_shards(self, shards):
+        """
+        This loads the indexes of multiple videos (see VideoIndexManifest) into this instance.
+        The embeddings stay memory-mapped until they're needed for searching.
+
+        :param shards: a list of VideoIndexShard objects
+        """
+
+        video_frames = FrameMetadata()
+
+        total_offset = 0
+        for shard in shards:
+
+            video_frames.add_columns(shard.frames, shard.path_ids, shard.paths, offset=total_offset)
+
+            total_offset += len(shard)
+
+        self._embeddings = EmbeddingBuffer()
+        self._embedding_shards = list(shards)
+        self._shard_tensors = {}
+
+        self.video_frames = video_frames
+
+        # prepare the patch to frame mapping now, so the first search doesn't have to wait for it
+        if len(self.video_frames):
+            self._get_frame_segments(self.device)
+
     def encode_queries(self, queries):
         query_tensors = torch.cat([clip.tokenize(query) for query in queries]).to(self.device)
         with torch.no_grad():
@@ -1764,32 +2117,76 @@ class ClipIndex:
 
         return result
 
-    def _combine_patches(self, similarity, n):
+    def _get_frame_segments(self, device):
+        """
+        This maps each patch to the frame it belongs to, so we can score whole frames with a single reduce operation.
+        The result is calculated once for the loaded embeddings and then reused for each search.
+
+        :param device: the device where the segment ids are needed (the device of the similarity tensor)
+        :return: a tuple with:
+                 - the frame (segment) id of each patch (tensor)
+                 - the number of patches of each frame (tensor)
+                 - the index of the first patch of each frame (numpy array)
+        """
+
+        cache_key = (id(self._video_frames), len(self._video_frames), str(device))
+
+        if self._frame_segments is not None and self._frame_segments[0] == cache_key:
+            return self._frame_segments[1]
+
+        # the frames are identified by their path and their frame index,
+        # so we don't mix up the frames of different videos that have the same index
+        frame_keys = np.stack([self._video_frames.path_ids, self._video_frames.frame_indexes], axis=1)
+
+        _, first_patches, segment_ids, patch_counts = \
+            np.unique(frame_keys, axis=0, return_index=True, return_inverse=True, return_counts=True)
+
+        frame_segments = (
+            torch.from_numpy(segment_ids.reshape(-1).astype(np.int64)).to(device),
+            torch.from_numpy(patch_counts).to(device=device, dtype=torch.float32),
+            first_patches
+        )
+
+        self._frame_segments = (cache_key, frame_segments)
+
+        return frame_segments
+
+    def _combine_patches(self, similarity, n, reduce='mean'):
         """
         This function combines all the patches of a frame into a single image to calculate similarity
         depending whether the patches themselves are similar or not.
+
+        :param similarity: the similarity between the query and each patch (tensor with the shape (1, patches))
+        :param n: the number of frames to return
+        :param reduce: how to calculate the score of a frame from its patches ('mean' or 'max')
         """
 
-        frame_groups = defaultdict(list)
-        for idx, frame_data in enumerate(self.video_frames):
-            frame_groups[frame_data['frame']].append(idx)
+        if len(self.video_frames) == 0:
+            return []
+
+        segment_ids, patch_counts, first_patches = self._get_frame_segments(similarity.device)
 
-        frame_similarity = {}
-        for frame, indices_list in frame_groups.items():
-            total_similarity = sum(similarity[0, idx].item() for idx in indices_list)
-            avg_similarity = total_similarity / len(indices_list)
-            frame_similarity[frame] = avg_similarity
+        patch_scores = similarity[0].float()
 
-        sorted_frames = sorted(frame_similarity.items(), key=lambda item: item[1], reverse=True)
-        unique_frames = sorted_frames[:n]
+        # score all the frames at once
+        if reduce == 'max':
+            frame_scores = torch.full((len(patch_counts),), float('-inf'), device=similarity.device) \
+                .scatter_reduce(0, segment_ids, patch_scores, reduce='amax', include_self=True)
+
+        else:
+            frame_scores = torch.zeros(len(patch_counts), device=similarity.device) \
+                .index_add_(0, segment_ids, patch_scores) / patch_counts
+
+        values, frame_ids = frame_scores.topk(min(n, len(frame_scores)))
 
         result = []
-        for frame, avg_similarity in unique_frames:
-            frame_indices = frame_groups[frame]
-            best_patch_meta = self.video_frames[frame_indices[0]]
+        for score, frame_id in zip(values.tolist(), frame_ids.tolist()):
+
+            best_patch_meta = self.video_frames[first_patches[frame_id]]
+
             frame_data = {
                 'frame': best_patch_meta['frame'],
-                'score': avg_similarity,
+                'score': score,
                 'path': best_patch_meta['path'],
                 'full_path': best_patch_meta.get('full_path', None),
                 'video_fps': best_patch_meta.get('video_fps', None),
@@ -1805,7 +2202,7 @@ class ClipIndex:
         """
 
         # if no video features are available, abort
-        if self.video_encoded is None:
+        if not self.has_embeddings():
             logger.warning('Cannot save embeddings for {} - no video features available'.format(self.source_path))
             return None
 
@@ -1864,7 +2261,7 @@ class ClipIndex:
 
             # the metadata containing the frame indexes and timestamps
             # without this it's impossible to map the embeddings back to the video
-            metadata_dict['frames'] = self.video_frames
+            metadata_dict['frames'] = self.video_frames.to_list()
 
             # and save the metadata to a json file using utf-8 encoding
             with open(metadata_file_path, 'w', encoding='utf-8') as f:
@@ -1894,6 +2291,10 @@ class ClipIndex:
 
         self.video_encoded, self.video_frames = self._load_multiple_embeddings(npy_paths)
 
+        # prepare the patch to frame mapping now, so the first search doesn't have to wait for it
+        if len(self.video_frames):
+            self._get_frame_segments(self.video_encoded.device)
+
     def _load_embeddings(self, npy_path=None, model_name=None):
         """
         This loads the video features from a .npy file
@@ -1956,7 +2357,7 @@ class ClipIndex:
         """
 
         video_encoded_list = []
-        video_frames_list = []
+        video_frames_list = FrameMetadata()
         total_offset = 0
         model_name = None
 
@@ -1983,7 +2384,8 @@ class ClipIndex:
                     # Update this metadata with the offset
                     frame_data['offset'] = total_offset
 
-                    video_frames_list.append(frame_data)
+                # the metadata is stored in columns, so the repeated paths are only stored once
+                video_frames_list.extend(frames)
 
                 total_offset += len(embeddings)  # Update the offset for the next batch of embeddings
 
@@ -0,0 +1,236 @@
+# this module wraps the CTranslate2 (faster-whisper) Whisper implementation,
+# so it can be used instead of the OpenAI Whisper model for StoryToolkitAI transcriptions
+
+import logging
+from typing import Optional, Tuple, Union
+
+import numpy as np
+
+from whisper.utils import format_timestamp, make_safe
+
+logger = logging.getLogger('StAI')
+
+# the engines that can be used for transcription
+WHISPER_ENGINES = ['openai', 'ctranslate2']
+
+
+class FasterWhisperModel:
+    """
+    This loads a CTranslate2 Whisper model (for eg. int8 quantized weights, which are much faster on CPU)
+    and exposes the same transcribe and transcribe_batched functions as the mots_whisper model,
+    returning the results in the same format (text, segments and language),
+    so the rest of the transcription process works the same, no matter which engine is used.
+    """
+
+    def __init__(self, model_name_or_path, device='cpu', compute_type='int8', cpu_threads=0, download_root=None):
+        """
+        :param model_name_or_path: the path to a converted CTranslate2 model
+                                   or the name of a model that faster-whisper can download (for eg. "medium")
+        :param device: cpu or cuda
+        :param compute_type: the type used for the weights and the computation (int8, int8_float16, float16, float32)
+        :param cpu_threads: the number of threads used on CPU (0 lets CTranslate2 decide)
+        :param download_root: where to download the model (if needed)
+        """
+
+        try:
+            from faster_whisper import WhisperModel
+
+        except ImportError:
+            logger.error('The CTranslate2 Whisper engine needs the faster-whisper package. '
+                         'Install it using "pip install faster-whisper" or use the openai engine.')
+            raise
+
+        self.model_name_or_path = model_name_or_path
+        self.device = device
+        self.compute_type = compute_type
+
+        self.model = WhisperModel(model_name_or_path, device=device, compute_type=compute_type,
+                                  cpu_threads=int(cpu_threads or 0), download_root=download_root)
+
+    @property
+    def is_multilingual(self):
+        return self.model.model.is_multilingual
+
+    def transcribe(
+        self,
+        audio: Union[str, np.ndarray],
+        *,
+        verbose: Optional[bool] = None,
+        temperature: Union[float, Tuple[float, ...]] = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0),
+        compression_ratio_threshold: Optional[float] = 2.4,
+        logprob_threshold: Optional[float] = -1.0,
+        no_speech_threshold: Optional[float] = 0.6,
+        condition_on_previous_text: bool = True,
+        initial_prompt: Optional[str] = None,
+        word_timestamps: bool = False,
+        prepend_punctuations: str = "\"'“¿([{-",
+        append_punctuations: str = "\"'.。,，!！?？:：”)]}、",
+
+        # StoryToolkitAI additions
+        queue_id: Optional[str] = None,
+        toolkit_ops_obj: object = None,
+        audio_segment_duration: int = None,
+        total_duration: int = None,
+        previous_progress: int = 0,
+        # end StoryToolkitAI additions
+
+        **decode_options,
+    ):
+        """
+        Transcribe an audio file or waveform using the CTranslate2 model
+
+        The parameters are the same as for mots_whisper.transcribe
+        (the decode options that CTranslate2 doesn't use, like fp16, are ignored)
+
+        Returns
+        -------
+        A dictionary containing the resulting text ("text") and segment-level details ("segments"), and
+        the spoken language ("language")
+        """
+
+        # faster-whisper expects a list of temperatures
+        temperatures = [temperature] if isinstance(temperature, (int, float)) else list(temperature)
+
+        language = decode_options.get('language', None) or None
+
+        if language is None and not self.is_multilingual:
+            language = 'en'
+
+        segments, info = self.model.transcribe(
+            audio,
+            language=language,
+            task=decode_options.get('task', 'transcribe'),
+
+            # use the same defaults as the OpenAI Whisper decoding options (greedy decoding)
+            beam_size=decode_options.get('beam_size', None) or 1,
+            best_of=decode_options.get('best_of', None) or 1,
+            patience=decode_options.get('patience', None) or 1,
+
+            temperature=temperatures,
+            compression_ratio_threshold=compression_ratio_threshold,
+            log_prob_threshold=logprob_threshold,
+            no_speech_threshold=no_speech_threshold,
+            condition_on_previous_text=condition_on_previous_text,
+            initial_prompt=initial_prompt,
+            word_timestamps=word_timestamps,
+            prepend_punctuations=prepend_punctuations,
+            append_punctuations=append_punctuations,
+        )
+
+        if verbose is not None and language is None:
+            logger.info('Detected language: {}'.format(info.language))
+
+        all_segments = []
+        all_text = []
+
+        # the segments are only transcribed as we go through them
+        for segment in segments:
+
+            # gracefully cancel if the queue item has been canceled
+            if queue_id is not None \
+                    and toolkit_ops_obj.processing_queue.get_status(queue_id=queue_id) \
+                    in [None, False, 'canceling', 'canceled']:
+                return dict(
+                    text=''.join(all_text),
+                    segments=all_segments,
+                    language=info.language,
+                    status='canceled'
+                )
+
+            new_segment = {
+                "id": len(all_segments),
+                "seek": segment.seek,
+                "start": segment.start,
+                "end": segment.end,
+                "text": segment.text,
+                "tokens": list(segment.tokens),
+                "temperature": segment.temperature,
+                "avg_logprob": segment.avg_logprob,
+                "compression_ratio": segment.compression_ratio,
+                "no_speech_prob": segment.no_speech_prob,
+            }
+
+            if word_timestamps:
+                new_segment["words"] = [
+                    {"word": word.word, "start": word.start, "end": word.end, "probability": word.probability}
+                    for word in (segment.words or [])
+                ]
+
+            # if a segment is instantaneous or does not contain text, clear it
+            if new_segment["start"] == new_segment["end"] or new_segment["text"].strip() == "":
+                new_segment["text"] = ""
+                new_segment["tokens"] = []
+                new_segment["words"] = []
+
+            if verbose and new_segment["text"]:
+                line = f"[{format_timestamp(segment.start)} --> {format_timestamp(segment.end)}] {segment.text}"
+                print(make_safe(line))
+
+                # add the text to the queue item variable (to make it available in the UI)
+                if queue_id is not None:
+                    toolkit_ops_obj.processing_queue.update_output(queue_id=queue_id,
+                                                                   output=make_safe(segment.text))
+
+            all_segments.append(new_segment)
+            all_text.append(new_segment["text"])
+
+            # calculate the progress
+            progress = min(100, int(segment.end / info.duration * 100)) if info.duration else 0
+
+            # but if a total duration and an audio segment duration were passed
+            # take that into account
+            if total_duration and audio_segment_duration:
+                progress = int(previous_progress) + int(progress * (audio_segment_duration / total_duration))
+
+            # update the progress in the app
+            if queue_id is not None:
+                toolkit_ops_obj.processing_queue.update_queue_item(queue_id=queue_id,
+                                                                   save_to_file=False, progress=progress)
+
+        return dict(
+            text=''.join(all_text),
+            segments=all_segments,
+            language=info.language,
+        )
+
+    def transcribe_batched(
+        self,
+        audio_segments,
+        *,
+        batch_size: int = 8,
+        queue_id: Optional[str] = None,
+        toolkit_ops_obj: object = None,
+        total_duration: int = None,
+        previous_progress: int = 0,
+        **transcribe_options
+    ):
+        """
+        This works like mots_whisper.transcribe_batched, but the segments are transcribed one after the other
+        (CTranslate2 already spreads the work of each window over the cpu_threads)
+
+        Yields
+        -------
+        (audio_segment, result) for each audio segment, in the same order as the audio segments
+        """
+
+        for audio_segment in audio_segments:
+
+            audio_segment_duration = audio_segment[1] - audio_segment[0]
+
+            result = self.transcribe(
+                audio_segment[2],
+                queue_id=queue_id,
+                toolkit_ops_obj=toolkit_ops_obj,
+                total_duration=total_duration,
+                audio_segment_duration=audio_segment_duration,
+                previous_progress=previous_progress,
+                **transcribe_options
+            )
+
+            yield audio_segment, result
+
+            if 'status' in result:
+                return
+
+            if total_duration:
+                previous_progress += int(audio_segment_duration / total_duration * 100)
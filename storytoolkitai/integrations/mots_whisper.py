@@ -599,4 +599,484 @@ def transcribe(
     )
 
 
-Whisper.transcribe = transcribe
\ No newline at end of file
+def transcribe_batched(
+    model: "Whisper",
+    audio_segments,
+    *,
+    batch_size: int = 8,
+    verbose: Optional[bool] = None,
+    temperature: Union[float, Tuple[float, ...]] = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0),
+    compression_ratio_threshold: Optional[float] = 2.4,
+    logprob_threshold: Optional[float] = -1.0,
+    no_speech_threshold: Optional[float] = 0.6,
+    initial_prompt: Optional[str] = None,
+    word_timestamps: bool = False,
+    prepend_punctuations: str = "\"'“¿([{-",
+    append_punctuations: str = "\"'.。,，!！?？:：”)]}、",
+
+    # StoryToolkitAI additions
+    queue_id: Optional[str] = None,
+    toolkit_ops_obj: object = None,
+    total_duration: int = None,
+    previous_progress: int = 0,
+    # end StoryToolkitAI additions
+
+    **decode_options,
+):
+    """
+    Transcribe multiple independent audio segments using Whisper,
+    by decoding the 30-second windows of up to batch_size segments in a single model.decode batch
+
+    This works like calling transcribe for each segment, with these differences:
+     - the windows are not conditioned on the previously transcribed text of their segment
+       (all the sequences in a batch share the same prompt, so only the initial_prompt is passed to each window)
+     - the temperature fallback is done per sequence:
+       only the windows that failed are decoded again (in a smaller batch) with the next temperature
+     - if the language isn't passed, it's detected for each segment, and only the windows that share
+       the same language are decoded together
+     - the hallucination silence skipping is not available
+
+    Parameters
+    ----------
+    model: Whisper
+        The Whisper model instance
+
+    audio_segments: iterable
+        The [start, end, audio] segments to transcribe (the audio is a 16kHz mono waveform).
+        They are read from the iterable only when there is room for them in the batch.
+
+    batch_size: int
+        The maximum number of segments that are decoded together
+
+    total_duration: int
+        The total duration of all the audio segments (used for StoryToolkitAI progress)
+
+    previous_progress: int
+        The progress of the queue item before transcribing these segments (used for StoryToolkitAI)
+
+    The rest of the parameters are the same as for transcribe.
+
+    Yields
+    -------
+    (audio_segment, result) for each audio segment, in the same order as the audio segments,
+    where the result is the same dictionary that transcribe returns (the times are relative to the segment start).
+    If the queue item is canceled, the last result has its status set to 'canceled'.
+    """
+
+    dtype = torch.float16 if decode_options.get("fp16", True) else torch.float32
+    if model.device == torch.device("cpu"):
+        if torch.cuda.is_available():
+            logger.warning("Performing inference on CPU when CUDA is available")
+        if dtype == torch.float16:
+            logger.debug("FP16 is not supported on CPU; using FP32 instead")
+            dtype = torch.float32
+
+    if dtype == torch.float32:
+        decode_options["fp16"] = False
+
+    task: str = decode_options.get("task", "transcribe")
+
+    # the prompt is set for each batch below
+    decode_options.pop("prompt", None)
+
+    temperatures = [temperature] if isinstance(temperature, (int, float)) else temperature
+
+    input_stride = exact_div(
+        N_FRAMES, model.dims.n_audio_ctx
+    )  # mel frames per output token: 2
+    time_precision = (
+        input_stride * HOP_LENGTH / SAMPLE_RATE
+    )  # time per output token: 0.02 (seconds)
+
+    if word_timestamps and task == "translate":
+        logger.warning("Word-level timestamps on translations may not be reliable.")
+
+    # keep one tokenizer for each language (together with the tokens of the initial prompt)
+    tokenizers = {}
+
+    def get_language_tokenizer(language: str):
+
+        if language not in tokenizers:
+            language_tokenizer = get_tokenizer(
+                model.is_multilingual,
+                num_languages=model.num_languages,
+                language=language,
+                task=task,
+            )
+
+            prompt_tokens = language_tokenizer.encode(" " + initial_prompt.strip()) \
+                if initial_prompt is not None else []
+
+            tokenizers[language] = (language_tokenizer, prompt_tokens)
+
+        return tokenizers[language]
+
+    def needs_fallback(decode_result: DecodingResult) -> bool:
+
+        if (
+            no_speech_threshold is not None
+            and decode_result.no_speech_prob > no_speech_threshold
+            and logprob_threshold is not None
+            and decode_result.avg_logprob < logprob_threshold
+        ):
+            return False  # silence
+        if (
+            compression_ratio_threshold is not None
+            and decode_result.compression_ratio > compression_ratio_threshold
+        ):
+            return True  # too repetitive
+        if (
+            logprob_threshold is not None
+            and decode_result.avg_logprob < logprob_threshold
+        ):
+            return True  # average log probability is too low
+
+        return False
+
+    def decode_with_fallback(mel_batch: torch.Tensor, language: str, prompt: list) -> List[DecodingResult]:
+
+        decode_results = [None] * len(mel_batch)
+
+        # the windows that still need to be decoded (with the current temperature)
+        pending = list(range(len(mel_batch)))
+
+        for t in temperatures:
+            kwargs = {**decode_options, "language": language, "prompt": prompt}
+            if t > 0:
+                # disable beam_size and patience when t > 0
+                kwargs.pop("beam_size", None)
+                kwargs.pop("patience", None)
+            else:
+                # disable best_of when t == 0
+                kwargs.pop("best_of", None)
+
+            options = DecodingOptions(**kwargs, temperature=t)
+
+            pending_results = model.decode(mel_batch[pending], options)
+
+            failed = []
+            for window_index, decode_result in zip(pending, pending_results):
+                decode_results[window_index] = decode_result
+
+                if needs_fallback(decode_result):
+                    failed.append(window_index)
+
+            # only the windows that failed are decoded again with the next temperature
+            pending = failed
+            if not pending:
+                break
+
+        return decode_results
+
+    def new_state(segment_index: int, audio_segment) -> dict:
+
+        # Pad 30-seconds of silence to the input audio, for slicing
+        mel = log_mel_spectrogram(audio_segment[2], model.dims.n_mels, padding=N_SAMPLES)
+
+        return {
+            "index": segment_index,
+            "audio_segment": audio_segment,
+            "mel": mel,
+            "content_frames": mel.shape[-1] - N_FRAMES,
+            "seek": 0,
+            "language": decode_options.get("language", None) or (None if model.is_multilingual else "en"),
+            "segments": [],
+            "tokens": [],
+            "last_speech_timestamp": 0.0,
+        }
+
+    def get_state_result(state: dict) -> dict:
+
+        state_tokenizer, _ = get_language_tokenizer(state["language"])
+
+        return dict(
+            text=state_tokenizer.decode(state["tokens"]),
+            segments=state["segments"],
+            language=state["language"],
+        )
+
+    def add_window_result(state: dict, window: dict, result: DecodingResult):
+        """
+        This turns the decoded tokens of a window into segments (just like transcribe does)
+        and moves the seek of the state to the next window
+        """
+
+        tokenizer, _ = get_language_tokenizer(state["language"])
+
+        seek = state["seek"]
+        time_offset = window["time_offset"]
+        segment_size = window["segment_size"]
+        segment_duration = segment_size * HOP_LENGTH / SAMPLE_RATE
+
+        tokens = torch.tensor(result.tokens)
+
+        if no_speech_threshold is not None:
+            # no voice activity check
+            should_skip = result.no_speech_prob > no_speech_threshold
+            if (
+                logprob_threshold is not None
+                and result.avg_logprob > logprob_threshold
+            ):
+                # don't skip if the logprob is high enough, despite the no_speech_prob
+                should_skip = False
+
+            if should_skip:
+                state["seek"] += segment_size  # fast-forward to the next segment boundary
+                return
+
+        def new_segment(
+            *, start: float, end: float, tokens: torch.Tensor
+        ):
+            tokens = tokens.tolist()
+            text_tokens = [token for token in tokens if token < tokenizer.eot]
+            return {
+                "seek": seek,
+                "start": start,
+                "end": end,
+                "text": tokenizer.decode(text_tokens),
+                "tokens": tokens,
+                "temperature": result.temperature,
+                "avg_logprob": result.avg_logprob,
+                "compression_ratio": result.compression_ratio,
+                "no_speech_prob": result.no_speech_prob,
+            }
+
+        current_segments = []
+
+        timestamp_tokens: torch.Tensor = tokens.ge(tokenizer.timestamp_begin)
+        single_timestamp_ending = timestamp_tokens[-2:].tolist() == [False, True]
+
+        consecutive = torch.where(timestamp_tokens[:-1] & timestamp_tokens[1:])[0]
+        consecutive.add_(1)
+        if len(consecutive) > 0:
+            # if the output contains two consecutive timestamp tokens
+            slices = consecutive.tolist()
+            if single_timestamp_ending:
+                slices.append(len(tokens))
+
+            last_slice = 0
+            for current_slice in slices:
+                sliced_tokens = tokens[last_slice:current_slice]
+                start_timestamp_pos = (
+                    sliced_tokens[0].item() - tokenizer.timestamp_begin
+                )
+                end_timestamp_pos = (
+                    sliced_tokens[-1].item() - tokenizer.timestamp_begin
+                )
+                current_segments.append(
+                    new_segment(
+                        start=time_offset + start_timestamp_pos * time_precision,
+                        end=time_offset + end_timestamp_pos * time_precision,
+                        tokens=sliced_tokens,
+                    )
+                )
+                last_slice = current_slice
+
+            if single_timestamp_ending:
+                # single timestamp at the end means no speech after the last timestamp.
+                state["seek"] += segment_size
+            else:
+                # otherwise, ignore the unfinished segment and seek to the last timestamp
+                last_timestamp_pos = (
+                    tokens[last_slice - 1].item() - tokenizer.timestamp_begin
+                )
+                state["seek"] += last_timestamp_pos * input_stride
+        else:
+            duration = segment_duration
+            timestamps = tokens[timestamp_tokens.nonzero().flatten()]
+            if (
+                len(timestamps) > 0
+                and timestamps[-1].item() != tokenizer.timestamp_begin
+            ):
+                # no consecutive timestamps but it has a timestamp; use the last one.
+                last_timestamp_pos = (
+                    timestamps[-1].item() - tokenizer.timestamp_begin
+                )
+                duration = last_timestamp_pos * time_precision
+
+            current_segments.append(
+                new_segment(
+                    start=time_offset,
+                    end=time_offset + duration,
+                    tokens=tokens,
+                )
+            )
+            state["seek"] += segment_size
+
+        if word_timestamps:
+            add_word_timestamps(
+                segments=current_segments,
+                model=model,
+                tokenizer=tokenizer,
+                mel=window["mel_segment"],
+                num_frames=segment_size,
+                prepend_punctuations=prepend_punctuations,
+                append_punctuations=append_punctuations,
+                last_speech_timestamp=state["last_speech_timestamp"],
+            )
+
+            if not single_timestamp_ending:
+                last_word_end = get_end(current_segments)
+                if last_word_end is not None and last_word_end > time_offset:
+                    state["seek"] = round(last_word_end * FRAMES_PER_SECOND)
+
+            last_word_end = get_end(current_segments)
+            if last_word_end is not None:
+                state["last_speech_timestamp"] = last_word_end
+
+        if verbose:
+            for segment in current_segments:
+                start, end, text = segment["start"], segment["end"], segment["text"]
+                line = f"[{format_timestamp(start)} --> {format_timestamp(end)}] {text}"
+                print(make_safe(line))
+
+                # add the text to the queue item variable (to make it available in the UI)
+                if queue_id is not None:
+                    toolkit_ops_obj.processing_queue.update_output(queue_id=queue_id,
+                                                                   output=make_safe(segment["text"]))
+
+        # if a segment is instantaneous or does not contain text, clear it
+        for segment in current_segments:
+            if segment["start"] == segment["end"] or segment["text"].strip() == "":
+                segment["text"] = ""
+                segment["tokens"] = []
+                segment["words"] = []
+
+        state["segments"].extend(
+            [
+                {"id": i, **segment}
+                for i, segment in enumerate(
+                    current_segments, start=len(state["segments"])
+                )
+            ]
+        )
+        state["tokens"].extend(
+            [token for segment in current_segments for token in segment["tokens"]]
+        )
+
+    audio_segments = enumerate(audio_segments)
+    no_more_audio_segments = False
+
+    # the segments that are being transcribed
+    active_states = []
+
+    # the segments that were transcribed, but can't be yielded yet
+    # (because a segment before them is still being transcribed)
+    finished_states = {}
+    next_index = 0
+
+    # the number of frames transcribed so far (for the progress)
+    transcribed_frames = 0
+
+    while True:
+
+        # fill the batch with new segments
+        new_states = []
+        while not no_more_audio_segments and len(active_states) < batch_size:
+
+            next_audio_segment = next(audio_segments, None)
+
+            if next_audio_segment is None:
+                no_more_audio_segments = True
+                break
+
+            state = new_state(*next_audio_segment)
+
+            active_states.append(state)
+            new_states.append(state)
+
+        # detect the language of the new segments (using up to the first 30 seconds of each)
+        undetected_states = [state for state in new_states
+                             if state["language"] is None and state["content_frames"] > 0]
+        if undetected_states:
+            if verbose:
+                logger.info("Detecting language using up to the first 30 seconds of {} segments."
+                            .format(len(undetected_states)))
+
+            mel_batch = torch.stack(
+                [pad_or_trim(state["mel"], N_FRAMES) for state in undetected_states]).to(model.device).to(dtype)
+            _, language_probs = model.detect_language(mel_batch)
+
+            for state, probs in zip(undetected_states, language_probs):
+                state["language"] = max(probs, key=probs.get)
+
+                if verbose is not None:
+                    logger.info(f"Detected language: {LANGUAGES[state['language']].title()}")
+
+        # move the segments that were completely transcribed out of the batch
+        for state in [state for state in active_states if state["seek"] >= state["content_frames"]]:
+            active_states.remove(state)
+
+            # we no longer need the mel spectrogram
+            state["mel"] = None
+            finished_states[state["index"]] = state
+
+        # yield the finished segments in order
+        while next_index in finished_states:
+            state = finished_states.pop(next_index)
+
+            # the segments without any audio have no language
+            if state["language"] is None:
+                state["language"] = decode_options.get("language", None) or "en"
+
+            yield state["audio_segment"], get_state_result(state)
+            next_index += 1
+
+        if not active_states:
+            break
+
+        # gracefully cancel if the queue item has been canceled
+        if queue_id is not None \
+                and toolkit_ops_obj.processing_queue.get_status(queue_id=queue_id) \
+                in [None, False, 'canceling', 'canceled']:
+
+            # return what we have so far from the first segment that wasn't yielded
+            state = min(active_states, key=lambda active_state: active_state["index"])
+
+            yield state["audio_segment"], {**get_state_result(state), "status": "canceled"}
+            return
+
+        # get the next window of each segment
+        windows_by_language = {}
+        for state in active_states:
+
+            seek = state["seek"]
+            segment_size = min(N_FRAMES, state["content_frames"] - seek)
+            mel_segment = pad_or_trim(state["mel"][:, seek: seek + segment_size], N_FRAMES).to(model.device).to(dtype)
+
+            windows_by_language.setdefault(state["language"], []).append(
+                (state, {
+                    "time_offset": float(seek * HOP_LENGTH / SAMPLE_RATE),
+                    "segment_size": segment_size,
+                    "mel_segment": mel_segment
+                })
+            )
+
+        # decode the windows of each language in a single batch
+        for language, language_windows in windows_by_language.items():
+
+            _, prompt_tokens = get_language_tokenizer(language)
+
+            results = decode_with_fallback(
+                torch.stack([window["mel_segment"] for _, window in language_windows]),
+                language=language, prompt=prompt_tokens
+            )
+
+            for (state, window), result in zip(language_windows, results):
+                previous_seek = state["seek"]
+
+                add_window_result(state, window, result)
+
+                transcribed_frames += min(state["content_frames"], state["seek"]) - previous_seek
+
+        # update the progress in the app
+        if queue_id is not None and total_duration:
+            progress = int(previous_progress) \
+                + int(transcribed_frames * HOP_LENGTH / SAMPLE_RATE / total_duration * 100)
+
+            toolkit_ops_obj.processing_queue.update_queue_item(queue_id=queue_id,
+                                                               save_to_file=False, progress=min(100, progress))
+
+
+Whisper.transcribe = transcribe
+Whisper.transcribe_batched = transcribe_batched
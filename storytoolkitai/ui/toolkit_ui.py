@@ -2694,8 +2694,9 @@ class toolkit_UI():
             file_list = {}
             for transcription_file_path in transcriptions or []:
 
-                # get the transcription object
-                transcription = Transcription(transcription_file_path=transcription_file_path)
+                # we only need the transcription metadata for the list,
+                # so there's no need to load the entire transcription object
+                transcription = TranscriptionReader(transcription_file_path=transcription_file_path, header_only=True)
 
                 # get the transcription name
                 if transcription.exists and transcription.name is not None:
@@ -2704,9 +2705,6 @@ class toolkit_UI():
                 else:
                     transcription_name = os.path.basename(transcription_file_path)
 
-                # this helps us determine if the transcription has text
-                transcription_text = transcription.text.strip() if transcription.text else ''
-
                 # source media
                 transcription_source_media = transcription.audio_file_path
 
@@ -2716,7 +2714,7 @@ class toolkit_UI():
                 file_list[transcription_file_path]['name'] = transcription_name
                 file_list[transcription_file_path]['file_exists'] = transcription.exists
                 file_list[transcription_file_path]['has_video'] = transcription.video_index_path
-                file_list[transcription_file_path]['has_text'] = True if len(transcription_text) > 0 else False
+                file_list[transcription_file_path]['has_text'] = transcription.has_text
                 file_list[transcription_file_path]['file_path'] = transcription_file_path
                 file_list[transcription_file_path]['source_media_path'] = transcription_source_media
                 file_list[transcription_file_path]['type'] = 'transcription'
@@ -2806,7 +2804,7 @@ class toolkit_UI():
                     width=100
                 )
 
-                if isinstance(file_list[item_path]['object'], Transcription):
+                if file_list[item_path]['type'] == 'transcription':
                     def open_on_click(event, path):
                         # open the transcription
                         self.open_transcription_window(transcription_file_path=path)
@@ -3712,7 +3710,7 @@ class toolkit_UI():
         search_label = None
         send_to_assistant_label = None
 
-        if exists and isinstance(item['object'], Transcription):
+        if exists and item.get('type', None) == 'transcription':
 
             # add the Open Transcription menu item
             context_menu.add_command(
@@ -3773,7 +3771,7 @@ class toolkit_UI():
             label="Relink File",
             command=lambda: self.button_relink_file(
                 file_path=item['file_path'],
-                object_type=str(item['object'].__class__.__name__).lower()
+                object_type=item['type']
             )
         )
 
@@ -3782,7 +3780,7 @@ class toolkit_UI():
             label="Unlink File",
             command=lambda: self.button_set_file_link_to_project(
                 file_path=item['file_path'],
-                object_type=str(item['object'].__class__.__name__).lower(),
+                object_type=item['type'],
                 link=False
             )
         )
@@ -13022,6 +13020,9 @@ class toolkit_UI():
             # add the Transcription object to this window
             self.t_edit_obj.set_window_transcription(t_window_id, transcription)
 
+            # keep the transcription in the registry while the window is open
+            transcription.pin()
+
             #
             # UI ELEMENTS
             # THE THREE WINDOW COLUMN FRAMES
@@ -13854,6 +13855,11 @@ class toolkit_UI():
 
     def destroy_transcription_window(self, window_id):
 
+        # the transcription no longer needs to be kept in the registry for this window
+        if (t_window := self.get_window_by_id(window_id)) is not None \
+                and getattr(t_window, 'transcription', None) is not None:
+            t_window.transcription.unpin()
+
         # close any associated find windows and remove the reference from the text windows
         if window_id in self.text_windows:
             if 'find_window_id' in self.text_windows[window_id]:
@@ -17192,6 +17198,9 @@ class toolkit_UI():
             # attach the story object to the window
             window.story = story
 
+            # keep the story in the registry while the window is open
+            story.pin()
+
             # the story lines list will be used to store the story lines
             # and we initialize them with whatever is in the story object
             window.story_lines = story.to_dict().get('lines', [])
@@ -17345,6 +17354,10 @@ class toolkit_UI():
         :return:
         """
 
+        # the story no longer needs to be kept in the registry for this window
+        if (window := self.get_window_by_id(window_id)) is not None and getattr(window, 'story', None) is not None:
+            window.story.unpin()
+
         # close any find windows
         if 'find_window_id' in self.text_windows[window_id]:
             find_window_id = self.text_windows[window_id]['find_window_id']
@@ -18613,7 +18626,11 @@ class toolkit_UI():
                     #    results_text_element.insert(ctk.END, 'Searching for: "' + result_search_term + '"\n')
                     #    results_text_element.insert(ctk.END, '--------------------------------------\n')
 
-                    results_text_element.insert(ctk.END, 'Top {} closest phrases:\n\n'.format(max_results))
+                    results_text_element.insert(
+                        ctk.END, 'Top {} closest phrases{}:\n\n'.format(
+                            max_results,
+                            ' (approximate search)' if getattr(text_search_item, 'last_search_approximate', False)
+                            else ''))
 
                 # remember the current insert position
                 current_insert_position = results_text_element.index(ctk.INSERT)